@@ -0,0 +1,361 @@
+"""
+Benchmarks for the graph algorithms in pychem.molecule.graph. Run from the benchmarks directory with:
+
+    PYTHONPATH=.. python bench_graph.py
+"""
+import random
+import time
+from collections import deque
+from queue import Queue
+import tracemalloc
+
+from pychem.molecule import graph
+
+
+def random_graph(node_count, average_degree=4, weighted=True, seed=0):
+    """
+    Builds a connected, undirected graph: a random spanning tree plus random extra edges until the average
+    degree is reached.
+    """
+    rng = random.Random(seed)
+    g = graph.Graph(directed=False, weighted=weighted)
+    edges = list()
+    for node in range(1, node_count):
+        edges.append((rng.randrange(node), node, rng.randint(1, 100)))
+    for _ in range(node_count * average_degree // 2 - len(edges)):
+        edges.append((rng.randrange(node_count), rng.randrange(node_count), rng.randint(1, 100)))
+    g.create_edges(edges)
+    return g
+
+
+def _dijkstra_scan(graph, source):
+    """The previous O(V²) implementation, which scans all unvisited nodes for the closest one."""
+    unvisited_nodes = set()
+    distance = dict()
+    predecessor = dict()
+    for node in graph.yield_nodes():
+        distance[node] = float('inf')
+        predecessor[node] = None
+        unvisited_nodes.add(node)
+    distance[source] = 0
+
+    while unvisited_nodes:
+        closest_node = None
+        lowest_distance = float('inf')
+        for node in unvisited_nodes:
+            if distance[node] < lowest_distance:
+                lowest_distance = distance[node]
+                closest_node = node
+        current_node = closest_node
+        if current_node is None:
+            break
+        unvisited_nodes.remove(current_node)
+
+        for edge in current_node.edges:
+            adj_node = edge.get_other_node(current_node)
+            new_dist = distance[current_node] + edge.weight
+            if new_dist < distance[adj_node]:
+                distance[adj_node] = new_dist
+                predecessor[adj_node] = current_node
+
+    return distance, predecessor
+
+
+def _previous_tarjan_csr(graph):
+    """The previous CSR implementation, with index, lowlink and on-stack lists and a set per SCC."""
+    offsets, neighbors = graph.offsets, graph.neighbors
+    index = [-1] * len(graph)
+    lowlink = [0] * len(graph)
+    onstack = [False] * len(graph)
+    stack = list()
+    i = 0
+
+    scc_list = list()
+    for root in range(len(graph)):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = i
+        i += 1
+        stack.append(root)
+        onstack[root] = True
+        work = [(root, offsets[root])]
+        while work:
+            node, slot = work[-1]
+            end = offsets[node + 1]
+            while slot < end:
+                adj_node = neighbors[slot]
+                slot += 1
+                if index[adj_node] == -1:
+                    work[-1] = (node, slot)
+                    index[adj_node] = lowlink[adj_node] = i
+                    i += 1
+                    stack.append(adj_node)
+                    onstack[adj_node] = True
+                    work.append((adj_node, offsets[adj_node]))
+                    break
+                elif onstack[adj_node] and index[adj_node] < lowlink[node]:
+                    lowlink[node] = index[adj_node]
+            else:
+                work.pop()
+                if lowlink[node] == index[node]:
+                    scc = set()
+                    other_node = None
+                    while other_node != node:
+                        other_node = stack.pop()
+                        onstack[other_node] = False
+                        scc.add(other_node)
+                    scc_list.append(scc)
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+    return scc_list
+
+
+def _previous_bellman_ford_csr(graph, source):
+    """The previous CSR implementation, which always makes len(graph) - 1 passes over all arcs."""
+    offsets, neighbors, weights = graph.offsets, graph.neighbors, graph.weights
+    arcs = list()
+    for node in range(len(graph)):
+        for slot in range(offsets[node], offsets[node + 1]):
+            arcs.append((node, neighbors[slot], weights[slot]))
+
+    distance = [None] * len(graph)
+    predecessor = [None] * len(graph)
+    distance[source] = 0
+    for _ in range(len(graph) - 1):
+        for node, adj_node, weight in arcs:
+            if distance[node] is not None:
+                if distance[adj_node] is None or distance[node] + weight < distance[adj_node]:
+                    distance[adj_node] = distance[node] + weight
+                    predecessor[adj_node] = node
+    for node, adj_node, weight in arcs:
+        if distance[node] is not None and distance[node] + weight < distance[adj_node]:
+            raise ValueError('Graph contains negative cycles!')
+    return distance, predecessor
+
+
+def _previous_bfs_csr(graph, source):
+    """The previous breadth-first search, with a thread-safe queue.Queue."""
+    offsets, neighbors = graph.offsets, graph.neighbors
+    distance = [None] * len(graph)
+    predecessor = [None] * len(graph)
+    distance[source] = 0
+    bfs_queue = Queue()
+    bfs_queue.put(source)
+    while not bfs_queue.empty():
+        current_node = bfs_queue.get()
+        for slot in range(offsets[current_node], offsets[current_node + 1]):
+            adj_node = neighbors[slot]
+            if distance[adj_node] is None:
+                predecessor[adj_node] = current_node
+                distance[adj_node] = distance[current_node] + 1
+                bfs_queue.put(adj_node)
+    return distance, predecessor
+
+
+def random_csr_edges(node_count, average_degree=2, seed=0):
+    """
+    Random edges between node indices: a path through all nodes, which makes the search as deep as the
+    graph, plus random extra edges until the average out-degree is reached.
+    """
+    rng = random.Random(seed)
+    edges = [(node, node + 1) for node in range(node_count - 1)]
+    edges.extend((rng.randrange(node_count), rng.randrange(node_count))
+                 for _ in range(node_count * (average_degree - 1)))
+    return edges
+
+
+def _previous_edmonds_karp(graph, source, sink):
+    """The previous CSR implementation: breadth-first augmenting paths over a residual list."""
+    offsets, neighbors, weights = graph.offsets, graph.neighbors, graph.weights
+    arc_heads = list()
+    residual = list()
+    node_arcs = [list() for _ in range(len(graph))]
+    for node in range(len(graph)):
+        for slot in range(offsets[node], offsets[node + 1]):
+            adj_node = neighbors[slot]
+            node_arcs[node].append(len(arc_heads))
+            arc_heads.append(adj_node)
+            residual.append(weights[slot])
+            node_arcs[adj_node].append(len(arc_heads))
+            arc_heads.append(node)
+            residual.append(0)
+
+    max_flow = 0
+    while True:
+        parent_arc = [None] * len(graph)
+        reached = [False] * len(graph)
+        reached[source] = True
+        bfs_queue = deque([source])
+        while bfs_queue and not reached[sink]:
+            current_node = bfs_queue.popleft()
+            for arc in node_arcs[current_node]:
+                adj_node = arc_heads[arc]
+                if residual[arc] > 0 and not reached[adj_node]:
+                    reached[adj_node] = True
+                    parent_arc[adj_node] = arc
+                    bfs_queue.append(adj_node)
+        if not reached[sink]:
+            return max_flow
+        path = list()
+        node = sink
+        while node != source:
+            arc = parent_arc[node]
+            path.append(arc)
+            node = arc_heads[arc ^ 1]
+        min_flow = min(residual[arc] for arc in path)
+        for arc in path:
+            residual[arc] -= min_flow
+            residual[arc ^ 1] += min_flow
+        max_flow += min_flow
+
+
+def random_flow_network(edge_count, average_degree=4, seed=0):
+    """
+    A directed CSRGraph with random capacities between 1 and 100 and edge_count / average_degree nodes. The
+    source is node 0 and the sink the last node.
+    """
+    rng = random.Random(seed)
+    node_count = edge_count // average_degree
+    edges = [(rng.randrange(node_count), rng.randrange(node_count), rng.randint(1, 100))
+             for _ in range(edge_count)]
+    return graph.CSRGraph(node_count, edges, directed=True, weighted=True)
+
+
+def _peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_dijkstra(sizes=(10**3, 10**4, 10**5), max_scan_size=10**4):
+    print('dijkstra (seconds)')
+    print('{:>8} {:>10} {:>10} {:>10}'.format('nodes', 'scan', 'heap', 'target'))
+    for size in sizes:
+        g = random_graph(size)
+        source = g.get_node(0)
+        target = g.get_node(size // 2)
+
+        heap_time, (heap_distance, _) = _timed(graph.dijkstra, g, source)
+        target_time, _ = _timed(graph.dijkstra, g, source, targets=[target])
+        if size <= max_scan_size:
+            scan_time, (scan_distance, _) = _timed(_dijkstra_scan, g, source)
+            assert scan_distance == heap_distance
+            scan_column = '{:10.3f}'.format(scan_time)
+        else:
+            scan_column = '{:>10}'.format('skipped')
+        print('{:>8} {} {:10.3f} {:10.3f}'.format(size, scan_column, heap_time, target_time))
+
+
+def bench_csr(sizes=(10**3, 10**4, 10**5)):
+    print('Graph versus CSRGraph (seconds)')
+    print('{:>8} {:>10} {:>10} {:>14} {:>14}'.format('nodes', 'convert', 'dijkstra', 'csr dijkstra', 'csr tarjan'))
+    for size in sizes:
+        g = random_graph(size)
+        convert_time, csr = _timed(graph.CSRGraph.from_graph, g)
+        source = g.get_node(0)
+
+        graph_time, (graph_distance, _) = _timed(graph.dijkstra, g, source)
+        csr_time, (csr_distance, _) = _timed(graph.dijkstra, csr, csr.node_index(source))
+        assert all(graph_distance[node] == csr_distance[i] for i, node in enumerate(csr.nodes))
+        tarjan_csr_time, _ = _timed(graph.tarjan, csr)
+        print('{:>8} {:10.3f} {:10.3f} {:14.3f} {:14.3f}'.format(
+            size, convert_time, graph_time, csr_time, tarjan_csr_time))
+
+
+def bench_bellman_ford(sizes=(10**3, 10**4, 10**5), max_previous_size=10**3):
+    print('bellman-ford on random graphs (seconds)')
+    print('{:>8} {:>10} {:>10} {:>10}'.format('nodes', 'previous', 'passes', 'spfa'))
+    for size in sizes:
+        csr = graph.CSRGraph.from_graph(random_graph(size))
+        passes_time, (distance, _) = _timed(graph.bellman_ford, csr, 0)
+        spfa_time, (spfa_distance, _) = _timed(graph.bellman_ford, csr, 0, spfa=True)
+        assert distance == spfa_distance
+        if size <= max_previous_size:
+            previous_time, (previous_distance, _) = _timed(_previous_bellman_ford_csr, csr, 0)
+            assert previous_distance == distance
+            previous_column = '{:10.3f}'.format(previous_time)
+        else:
+            previous_column = '{:>10}'.format('skipped')
+        print('{:>8} {} {:10.3f} {:10.3f}'.format(size, previous_column, passes_time, spfa_time))
+
+
+def bench_bfs(sizes=(10**4, 10**5, 10**6), pairs=20):
+    print('breadth-first search from node 0 on random sparse graphs (seconds; bidirectional is the average '
+          'per sink)')
+    print('{:>8} {:>10} {:>10} {:>10} {:>14}'.format('nodes', 'queue', 'deque', 'levels', 'bidirectional'))
+    rng = random.Random(0)
+    for size in sizes:
+        csr = graph.CSRGraph(size, random_csr_edges(size, average_degree=3), directed=False)
+        previous_time, (previous_distance, _) = _timed(_previous_bfs_csr, csr, 0)
+        deque_time, (distance, _) = _timed(graph.bfs_shortest_paths, csr, 0)
+        levels_time, levels = _timed(graph.bfs_levels, csr, 0)
+        assert previous_distance == distance == list(levels)
+
+        bidirectional_time = 0
+        for _ in range(pairs):
+            sink = rng.randrange(size)
+            pair_time, path = _timed(graph.bidirectional_bfs, csr, 0, sink)
+            bidirectional_time += pair_time
+            assert len(path) - 1 == levels[sink]
+        print('{:>8} {:10.3f} {:10.3f} {:10.3f} {:14.6f}'.format(
+            size, previous_time, deque_time, levels_time, bidirectional_time / pairs))
+
+
+def bench_components(sizes=(10**4, 10**5, 10**6)):
+    print('strongly connected components and bridges on CSR graphs (seconds, peak MiB)')
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'nodes', 'previous', 'MiB', 'labels', 'MiB', 'tarjan', 'bridges', 'MiB'))
+    for size in sizes:
+        edges = random_csr_edges(size)
+        directed = graph.CSRGraph(size, edges, directed=True)
+        undirected = graph.CSRGraph(size, edges, directed=False)
+
+        previous_time, previous_sccs = _timed(_previous_tarjan_csr, directed)
+        labels_time, (count, _) = _timed(graph.scc_labels, directed)
+        tarjan_time, sccs = _timed(graph.tarjan, directed)
+        assert count == len(sccs) == len(previous_sccs)
+        assert sorted(map(len, sccs)) == sorted(map(len, previous_sccs))
+        bridges_time, _ = _timed(graph.bridges, undirected)
+        print('{:>8} {:10.3f} {:10.1f} {:10.3f} {:10.1f} {:10.3f} {:10.3f} {:10.1f}'.format(
+            size, previous_time, _peak_memory(_previous_tarjan_csr, directed), labels_time,
+            _peak_memory(graph.scc_labels, directed), tarjan_time, bridges_time,
+            _peak_memory(graph.bridges, undirected)))
+
+
+def bench_max_flow(sizes=(10**4, 10**5, 10**6), max_previous_size=10**5):
+    print('maximum flow on random directed networks (seconds)')
+    print('{:>8} {:>12} {:>10} {:>14}'.format('edges', 'edmonds-karp', 'dinic', 'push-relabel'))
+    for size in sizes:
+        network = random_flow_network(size)
+        sink = len(network) - 1
+        dinic_time, result = _timed(graph.max_flow, network, 0, sink)
+        push_relabel_time, push_relabel_result = _timed(graph.max_flow, network, 0, sink, algorithm='push_relabel')
+        assert result.value == push_relabel_result.value
+        if size <= max_previous_size:
+            previous_time, previous_value = _timed(_previous_edmonds_karp, network, 0, sink)
+            assert previous_value == result.value
+            previous_column = '{:12.3f}'.format(previous_time)
+        else:
+            previous_column = '{:>12}'.format('skipped')
+        print('{:>8} {} {:10.3f} {:14.3f}'.format(size, previous_column, dinic_time, push_relabel_time))
+
+
+if __name__ == '__main__':
+    bench_dijkstra()
+    bench_csr()
+    bench_bellman_ford()
+    bench_bfs()
+    bench_components()
+    bench_max_flow()
@@ -0,0 +1,439 @@
+"""
+Benchmarks for pychem.molecule.molecule. Run from the benchmarks directory with:
+
+    PYTHONPATH=.. python bench_molecule.py
+"""
+import hashlib
+import time
+
+from pychem import Molecule
+from pychem.molecule import fingerprint, graph, substructure
+from pychem.molecule.molecule import Atom, Bond, topological_descriptors
+from pychem.molecule.parsers import iupac, smiles
+
+
+NATURAL_PRODUCTS = {
+    'oenanthotoxin': 'CCC[C@@H](O)CC\\C=C\\C=C\\C#CC#C\\C=C\\CO',
+    'pyrethrin': 'COC(=O)C(\\C)=C\\C1C(C)(C)[C@H]1C(=O)O[C@@H]2C(C)=C(C(=O)C2)CC=CC=C',
+    'glucose': 'OC[C@@H](O1)[C@@H](O)[C@H](O)[C@@H](O)[C@@H](O)1',
+    'bergenin': 'OC[C@@H](O1)[C@@H](O)[C@H](O)[C@@H]2[C@@H]1c3c(O)c(OC)c(O)cc3C(=O)O2',
+    'cephalostatin': 'C[C@@](C)(O1)C[C@@H](O)[C@@]1(O2)[C@@H](C)[C@@H]3CC=C4[C@]3(C2)C(=O)C[C@H]5[C@H]4CC[C@@H]'
+                     '(C6)[C@]5(C)Cc(n7)c6nc(C[C@@]89(C))c7C[C@@H]8CC[C@@H]%10[C@@H]9C[C@@H](O)[C@@]%11(C)C%10=C'
+                     '[C@H](O%12)[C@]%11(O)[C@H](C)[C@]%12(O%13)[C@H](O)C[C@@]%13(C)CO',
+    'polyethylene-300': 'C' * 300,
+}
+
+
+def _atom_priority_list(molecule):
+    """The previous ranking: a BFS from every atom and a sort per distance layer."""
+    atom_priority_list = list()
+
+    distance_order = dict()
+    for atom in molecule:
+        distance = 0
+        distance_order[atom] = {distance: {atom}}
+        used_atoms = {atom}
+        while True:
+            next_atoms = set()
+            for other_atom in distance_order[atom][distance]:
+                for adjacent_atom in other_atom.adj_atoms:
+                    if adjacent_atom not in used_atoms:
+                        next_atoms.add(adjacent_atom)
+                        used_atoms.add(adjacent_atom)
+            distance += 1
+            distance_order[atom][distance] = next_atoms
+            if not next_atoms:
+                break
+
+    for atom in molecule:
+        atom_priority_list.append([atom, -atom.atomic_number, atom.charge or 0])
+
+    distance = 1
+    while True:
+        go_to_next_iteration = False
+        for item in atom_priority_list:
+            atom = item[0]
+            distance_score = 0
+            if distance in distance_order[atom]:
+                go_to_next_iteration = True
+                for other_atom in distance_order[atom][distance]:
+                    distance_score -= other_atom.atomic_number
+            item.append(distance_score)
+        if not go_to_next_iteration:
+            break
+        distance += 1
+
+    for i in reversed(range(1, distance+3)):
+        atom_priority_list.sort(key=lambda x: x[i])
+    return [item[0] for item in atom_priority_list]
+
+
+def _previous_parse_from_smiles(molecule, smiles_string, _active_atom=None, _labels=None):
+    """The previous parser, which tokenizes every branch again and recurses into it."""
+    active_atom = _active_atom
+    labels = dict() if _labels is None else _labels
+
+    bond_type = '-'
+    for token in _previous_tokenize_smiles(smiles_string):
+        if token[0] == '(':
+            _previous_parse_from_smiles(molecule, token[1:-1], _active_atom=active_atom, _labels=labels)
+        elif token[0] == '[':
+            isotope, element, h_count, charge, chirality = smiles._parse_smiles_parenthesis(token)
+            new_atom = Atom(element, molecule, isotope=isotope, charge=charge, aromatic=element.islower())
+            molecule.add_atom(new_atom)
+            if active_atom:
+                molecule.add_bond(Bond(active_atom, new_atom, bond_type=bond_type))
+            active_atom = new_atom
+            bond_type = '-'
+        elif token.lower() in ['b', 'c', 'n', 'o', 'p', 's', 'f', 'cl', 'br', 'i']:
+            new_atom = Atom(token, molecule, aromatic=token.islower())
+            molecule.add_atom(new_atom)
+            if active_atom:
+                molecule.add_bond(Bond(active_atom, new_atom, bond_type=bond_type))
+            active_atom = new_atom
+            bond_type = '-'
+        elif token[0] == '%':
+            label = token[1:]
+            if label not in labels:
+                labels[label] = active_atom
+            else:
+                molecule.add_bond(Bond(active_atom, labels[label], bond_type=bond_type))
+                bond_type = '-'
+        elif token in ['-', '=', '#', '$', ':']:
+            bond_type = token
+
+
+def _previous_tokenize_smiles(smiles_string):
+    index = 0
+    while index < len(smiles_string):
+        if smiles_string[index] == '(':
+            right_brack = index
+            while index < len(smiles_string):
+                right_brack = smiles_string.find(')', right_brack) + 1
+                bracketed_string = smiles_string[index:right_brack]
+                if bracketed_string.count('(') == bracketed_string.count(')'):
+                    yield bracketed_string
+                    index = right_brack
+                    break
+        elif smiles_string[index] == '[':
+            right_brack = smiles_string.find(']', index) + 1
+            yield smiles_string[index:right_brack]
+            index = right_brack
+        elif smiles_string[index] == '%':
+            label_string = '%'
+            while index + 1 < len(smiles_string):
+                index += 1
+                if smiles_string[index] in '0123456789':
+                    label_string += smiles_string[index]
+                else:
+                    break
+            yield label_string
+        else:
+            if smiles_string[index] in '0123456789':
+                yield '%' + smiles_string[index]
+            else:
+                element_string = smiles_string[index]
+                if index+1 < len(smiles_string) and smiles_string[index+1].islower():
+                    element_string += smiles_string[index+1]
+                    index += 1
+                yield element_string
+            index += 1
+
+
+def _previous_ring_search(molecule):
+    """
+    What graph.get_non_reducible_cycles does, with the path search fixed: for every bond, the shortest path
+    between its atoms that does not use the bond, deduplicated with a list of sets.
+    """
+    ring_sets = list()
+    rings = list()
+    for bond in molecule.bonds:
+        predecessor = {bond.source: None}
+        queue = [bond.source]
+        for atom in queue:
+            if atom is bond.sink:
+                break
+            for other_bond in atom.bonds:
+                other_atom = other_bond.get_other_node(atom)
+                if other_bond is not bond and other_atom not in predecessor:
+                    predecessor[other_atom] = atom
+                    queue.append(other_atom)
+        if bond.sink in predecessor:
+            ring = [bond.sink]
+            while predecessor[ring[-1]] is not None:
+                ring.append(predecessor[ring[-1]])
+            if set(ring) not in ring_sets:
+                ring_sets.append(set(ring))
+                rings.append(ring)
+    return rings
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_canonical_ranks():
+    print('canonical atom ranking (seconds)')
+    print('{:>18} {:>6} {:>10} {:>10}'.format('molecule', 'atoms', 'previous', 'canonical'))
+    for name, smiles in NATURAL_PRODUCTS.items():
+        molecule = Molecule(smiles=smiles)
+        previous_time, _ = _timed(_atom_priority_list, molecule)
+        canonical_time, _ = _timed(molecule.canonical_ranks)
+        print('{:>18} {:>6} {:10.4f} {:10.4f}'.format(name, len(molecule.atoms), previous_time, canonical_time))
+
+
+def bench_hashing(repeat=100):
+    print('hash_molecule (microseconds per molecule)')
+    print('{:>18} {:>6} {:>12} {:>10} {:>10}'.format('molecule', 'atoms', 'bond table', 'digest', 'cached'))
+    for name, smiles in NATURAL_PRODUCTS.items():
+        molecule = Molecule(smiles=smiles)
+
+        def string_hash():
+            molecule._cache.clear()
+            return hashlib.md5(molecule.bond_table(include_bonds=False).encode('utf-8')).digest()
+
+        def digest():
+            molecule._cache.clear()
+            return molecule.hash_molecule()
+
+        string_time, _ = _timed(lambda: [string_hash() for _ in range(repeat)])
+        digest_time, _ = _timed(lambda: [digest() for _ in range(repeat)])
+        cached_time, _ = _timed(lambda: [molecule.hash_molecule() for _ in range(repeat)])
+        print('{:>18} {:>6} {:12.1f} {:10.1f} {:10.2f}'.format(
+            name, len(molecule.atoms), 1e6 * string_time / repeat, 1e6 * digest_time / repeat,
+            1e6 * cached_time / repeat))
+
+
+def bench_smiles_parser(repeat=200):
+    print('SMILES parser without hydrogen filling (molecules per second)')
+    print('{:>18} {:>10} {:>12}'.format('molecule', 'previous', 'single pass'))
+    branched = {'branched-100': 'C' + '(C' * 100 + ')' * 100, 'branched-300': 'C' + '(C' * 300 + ')' * 300}
+    for name, smiles_string in list(NATURAL_PRODUCTS.items()) + list(branched.items()):
+        previous_time, _ = _timed(lambda: [_previous_parse_from_smiles(Molecule(), smiles_string)
+                                           for _ in range(repeat)])
+        single_pass_time, _ = _timed(lambda: [smiles._parse_from_smiles(Molecule(), smiles_string)
+                                              for _ in range(repeat)])
+        print('{:>18} {:10.0f} {:12.0f}'.format(name, repeat / previous_time, repeat / single_pass_time))
+
+
+def bench_implicit_hydrogens(repeat=50):
+    print('explicit versus implicit hydrogens (molecules per second, atoms)')
+    print('{:>18} {:>10} {:>10} {:>8} {:>8}'.format('molecule', 'explicit', 'implicit', 'atoms', 'atoms'))
+    for name, smiles_string in NATURAL_PRODUCTS.items():
+        explicit_time, explicit = _timed(lambda: [smiles.parse(smiles_string) for _ in range(repeat)])
+        implicit_time, implicit = _timed(lambda: [smiles.parse(smiles_string, implicit_hydrogens=True)
+                                                  for _ in range(repeat)])
+        assert explicit[0].hash_molecule() == implicit[0].hash_molecule()
+        print('{:>18} {:10.0f} {:10.0f} {:8} {:8}'.format(name, repeat / explicit_time, repeat / implicit_time,
+                                                          len(explicit[0].atoms), len(implicit[0].atoms)))
+
+
+def bench_rings(repeat=10):
+    print('ring perception (milliseconds)')
+    print('{:>18} {:>6} {:>6} {:>12} {:>10} {:>8}'.format('molecule', 'atoms', 'rings', 'shortest/bond', 'vismara',
+                                                          'cached'))
+    molecules = dict(NATURAL_PRODUCTS, steroid='CC(C)CCCC(C)C1CCC2C1(CCC3C2CC=C4C3(CCC(C4)O)C)C',
+                     cubane='C12C3C4C1C5C2C3C45')
+    for name, smiles_string in molecules.items():
+        molecule = Molecule(smiles=smiles_string)
+        previous_time, _ = _timed(lambda: [_previous_ring_search(molecule) for _ in range(repeat)])
+
+        def perceive():
+            molecule._cache.clear()
+            return molecule.ring_info()
+
+        perceive_time, _ = _timed(lambda: [perceive() for _ in range(repeat)])
+        cached_time, _ = _timed(lambda: [molecule.ring_info() for _ in range(repeat)])
+        print('{:>18} {:>6} {:>6} {:12.2f} {:10.2f} {:8.4f}'.format(
+            name, len(molecule.atoms), molecule.cyclomatic_number(), 1e3 * previous_time / repeat,
+            1e3 * perceive_time / repeat, 1e3 * cached_time / repeat))
+
+
+LONG_CHAINS = {
+    'tripalmitin': 'CCCCCCCCCCCCCCCC(=O)OCC(COC(=O)CCCCCCCCCCCCCCC)OC(=O)CCCCCCCCCCCCCCC',
+    'cholesteryl oleate': 'CCCCCCCCC=CCCCCCCCC(=O)OC1CCC2(C)C(=CCC3C2CCC4(C)C3CCC4C(C)CCCC(C)C)C1',
+    'polystyrene-50': 'C' + 'C(c1ccccc1)C' * 50,
+    'polyethylene-300': 'C' * 300,
+    'macrocycle-200': 'C1' + 'C' * 198 + 'C1',
+}
+
+
+def bench_ring_reduction(repeat=5):
+    print('ring perception on the reduced graph (milliseconds)')
+    print('{:>18} {:>6} {:>6} {:>6} {:>10} {:>10} {:>10}'.format(
+        'molecule', 'atoms', 'core', 'merged', 'full', 'reduced', 'chordless'))
+    for name, smiles_string in LONG_CHAINS.items():
+        molecule = Molecule(smiles=smiles_string)
+        full_time, full = _timed(lambda: [graph.perceive_rings(molecule, reduce=False) for _ in range(repeat)])
+        reduced_time, reduced = _timed(lambda: [graph.perceive_rings(molecule) for _ in range(repeat)])
+        assert sorted(map(len, full[0].relevant_cycles)) == sorted(map(len, reduced[0].relevant_cycles))
+        chordless_time, _ = _timed(lambda: [list(graph.chordless_cycles(molecule)) for _ in range(repeat)])
+        merged_graph, _ = graph.reduce_graph(molecule)
+        print('{:>18} {:>6} {:>6} {:>6} {:10.2f} {:10.2f} {:10.2f}'.format(
+            name, len(molecule.atoms), len(graph._remove_degree1_nodes(molecule)), len(merged_graph.nodes),
+            1e3 * full_time / repeat, 1e3 * reduced_time / repeat, 1e3 * chordless_time / repeat))
+
+
+def _previous_distances(molecule):
+    """All-pairs distances as the previous code found them: a breadth-first search from every atom."""
+    return {atom: graph.bfs_shortest_paths(molecule, atom)[0] for atom in molecule.atoms}
+
+
+def _previous_wiener_index(molecule):
+    heavy_atoms = [atom for atom in molecule.atoms if atom.symbol != 'H']
+    return sum(graph.bfs_shortest_paths(molecule, atom)[0].get(other_atom, 0)
+               for atom in heavy_atoms for other_atom in heavy_atoms) // 2
+
+
+def bench_distance_matrix(repeat=5):
+    print('all-pairs topological distances (milliseconds)')
+    print('{:>18} {:>6} {:>10} {:>10}'.format('molecule', 'atoms', 'bfs/atom', 'matrix'))
+    molecules = dict(NATURAL_PRODUCTS, **{'polyethylene-1000': 'C' * 1000})
+    # NumPy is imported on first use
+    graph.distance_matrix(Molecule(smiles='CC'))
+    for name, smiles_string in molecules.items():
+        molecule = Molecule(smiles=smiles_string, implicit_hydrogens=True)
+        previous_time, _ = _timed(lambda: [_previous_distances(molecule) for _ in range(repeat)])
+        matrix_time, _ = _timed(lambda: [graph.distance_matrix(molecule) for _ in range(repeat)])
+        print('{:>18} {:>6} {:10.2f} {:10.2f}'.format(name, len(molecule.atoms), 1e3 * previous_time / repeat,
+                                                      1e3 * matrix_time / repeat))
+
+
+def bench_descriptors(molecule_count=2000):
+    print('Wiener index, diameter and eccentricities of a batch (molecules per second)')
+    print('{:>8} {:>12} {:>10} {:>10}'.format('batch', 'bfs/atom', 'batched', 'cached'))
+    smiles_strings = list(NATURAL_PRODUCTS.values())[:5]
+    molecules = [Molecule(smiles=smiles_strings[i % len(smiles_strings)], implicit_hydrogens=True)
+                 for i in range(molecule_count)]
+    previous_time, previous = _timed(lambda: [_previous_wiener_index(molecule) for molecule in molecules[:200]])
+    batch_time, descriptors = _timed(topological_descriptors, molecules)
+    cached_time, _ = _timed(topological_descriptors, molecules)
+    assert previous == descriptors.wiener_indices[:200].tolist()
+    print('{:>8} {:12.0f} {:10.0f} {:10.0f}'.format(molecule_count, 200 / previous_time,
+                                                    molecule_count / batch_time, molecule_count / cached_time))
+
+
+def _previous_longest_chains(atoms):
+    """The previous search: every chain from every ending atom, copying the chain at every step."""
+    def recursive(current_chain):
+        current_atom = current_chain[-1]
+        yielded = False
+        for other_atom in current_atom.adj_atoms:
+            if other_atom in atom_set and other_atom not in current_chain:
+                new_chain = current_chain.copy()
+                new_chain.append(other_atom)
+                yield from recursive(new_chain)
+                yielded = True
+        if not yielded:
+            yield current_chain
+
+    atom_set = set(atoms)
+    longest_chains = list()
+    for atom in atoms:
+        if sum(1 for other_atom in atom.adj_atoms if other_atom in atom_set) != 1:
+            continue
+        for long_chain in recursive([atom]):
+            if not longest_chains or len(long_chain) > len(longest_chains[0]):
+                longest_chains = [long_chain]
+            elif len(long_chain) == len(longest_chains[0]):
+                longest_chains.append(long_chain)
+    return longest_chains
+
+
+def bench_longest_chains(repeat=5):
+    print('longest carbon chains (milliseconds)')
+    print('{:>18} {:>6} {:>7} {:>10} {:>10}'.format('molecule', 'atoms', 'chains', 'previous', 'tree'))
+    molecules = {'pyrethrin': NATURAL_PRODUCTS['pyrethrin'],
+                 'oenanthotoxin': NATURAL_PRODUCTS['oenanthotoxin'],
+                 'comb-50': 'C' + 'C(C)' * 50,
+                 'comb-200': 'C' + 'C(C)' * 200,
+                 'polyethylene-300': 'C' * 300}
+    for name, smiles_string in molecules.items():
+        molecule = Molecule(smiles=smiles_string)
+        ring_atoms = set().union(*molecule.ring_systems())
+        carbon_atoms = [atom for atom in molecule.atoms if atom.symbol == 'C' and atom not in ring_atoms]
+        previous_time, previous = _timed(lambda: [_previous_longest_chains(carbon_atoms) for _ in range(repeat)])
+        tree_time, chains = _timed(lambda: [graph.longest_paths(molecule, carbon_atoms) for _ in range(repeat)])
+        # the previous search finds every chain in both directions
+        assert 2 * len(chains[0]) == len(previous[0]) or len(chains[0][0]) == 1
+        assert len(chains[0][0]) == len(previous[0][0])
+        print('{:>18} {:>6} {:>7} {:10.2f} {:10.2f}'.format(name, len(molecule.atoms), len(chains[0]),
+                                                           1e3 * previous_time / repeat, 1e3 * tree_time / repeat))
+
+
+def bench_substructure(molecule_count=2000):
+    print('functional groups and substructures of {} molecules (molecules per second)'.format(molecule_count))
+    print('{:>8} {:>16} {:>10} {:>10}'.format('queries', 'compile/molecule', 'compiled', 'cached'))
+    patterns = [group.pattern for group in iupac.functional_groups().values()] + ['c1ccccc1', 'C=O', 'C1CCCCC1',
+                                                                                 '-O', 'N']
+    smiles_strings = list(NATURAL_PRODUCTS.values())[:5]
+    molecules = [Molecule(smiles=smiles_strings[i % len(smiles_strings)], implicit_hydrogens=True)
+                 for i in range(molecule_count)]
+    previous_time, previous = _timed(lambda: [[substructure.Query(pattern).has_match(molecule)
+                                               for pattern in patterns] for molecule in molecules[:200]])
+    fresh = [Molecule(smiles=smiles_strings[i % len(smiles_strings)], implicit_hydrogens=True)
+             for i in range(molecule_count)]
+    compiled_time, matches = _timed(lambda: list(substructure.match_all(patterns, fresh)))
+    # the second pass reuses the targets cached on the molecules
+    queries = [substructure.Query(pattern) for pattern in patterns]
+    cached_time, _ = _timed(lambda: list(substructure.match_all(queries, fresh)))
+    assert previous == matches[:200]
+    print('{:>8} {:16.0f} {:10.0f} {:10.0f}'.format(len(patterns), 200 / previous_time,
+                                                   molecule_count / compiled_time, molecule_count / cached_time))
+
+
+def bench_fingerprint_screen(molecule_count=2000, library_rows=1000000):
+    import numpy
+    print('substructure screens of {} molecules (milliseconds)'.format(molecule_count))
+    print('{:>16} {:>8} {:>10} {:>10} {:>10}'.format('query', 'matches', 'screened', 'match all', 'screen'))
+    smiles_strings = list(NATURAL_PRODUCTS.values())[:5] + ['CC(=O)O', 'CCN', 'c1ccccc1']
+    molecules = [Molecule(smiles=smiles_strings[i % len(smiles_strings)], implicit_hydrogens=True)
+                 for i in range(molecule_count)]
+    index = fingerprint.FingerprintIndex()
+    index.add(molecules)
+    for pattern in ['-C(=O)O', 'c1ccccc1', 'CCN', 'C1CCCCC1', 'C=CC=C']:
+        query = substructure.Query(pattern)
+        full_time, matches = _timed(lambda: [row for row, molecule in enumerate(molecules)
+                                             if query.has_match(molecule)])
+        screen_time, screened = _timed(index.search, query)
+        assert matches == screened
+        print('{:>16} {:>8} {:>10} {:10.2f} {:10.2f}'.format(pattern, len(matches), len(index.screen(query)),
+                                                             1e3 * full_time, 1e3 * screen_time))
+
+    print('Tanimoto top-10 of {} fingerprints (milliseconds)'.format(library_rows))
+    library = fingerprint.FingerprintIndex()
+    repeats = -(-library_rows // len(index))
+    library.add_fingerprints(numpy.tile(index.rows, (repeats, 1))[:library_rows])
+    query = fingerprint.fingerprint(molecules[0])
+    similar_time, (rows, _) = _timed(library.similar, query, 10)
+    screen_time, _ = _timed(library.screen, molecules[5])
+    print('  similar {:10.2f}   screen {:10.2f}'.format(1e3 * similar_time, 1e3 * screen_time))
+
+
+def bench_bulk_parsing(molecule_count=2000, workers=(0, 2, 4)):
+    print('bulk SMILES parsing of {} molecules (molecules per second)'.format(molecule_count))
+    names = list(NATURAL_PRODUCTS)[:-1]
+    lines = ['{} {}\n'.format(NATURAL_PRODUCTS[names[i % len(names)]], i) for i in range(molecule_count)]
+    for worker_count in workers:
+        for ordered in (True, False):
+            parse_time, records = _timed(lambda: list(smiles.parse_many(
+                lines, workers=worker_count, ordered=ordered, transform=Molecule.hash_molecule)))
+            assert len(records) == molecule_count
+            print('  workers={} ordered={!s:5} {:10.0f}'.format(worker_count, ordered, molecule_count / parse_time))
+
+
+if __name__ == '__main__':
+    bench_canonical_ranks()
+    bench_hashing()
+    bench_smiles_parser()
+    bench_implicit_hydrogens()
+    bench_rings()
+    bench_ring_reduction()
+    bench_distance_matrix()
+    bench_descriptors()
+    bench_longest_chains()
+    bench_substructure()
+    bench_fingerprint_screen()
+    bench_bulk_parsing()
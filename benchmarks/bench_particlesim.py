@@ -0,0 +1,230 @@
+"""
+Benchmarks for pychem.particlesim. Run from the benchmarks directory with:
+
+    PYTHONPATH=.. python bench_particlesim.py
+"""
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from math import sqrt
+
+import numpy
+
+from pychem.particlesim import checkpoint, forces, integrators, nbody, trajectory
+
+
+G = Decimal('6.67408e-11')
+Ke = Decimal('8.9875517873681764e9')
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _previous_simulation(particles, steps, delta_t):
+    """
+    The previous simulation loop of electron_simulation: Decimal arithmetic in a double loop over all ordered
+    pairs. 'particles' is a list of [position, velocity, mass, charge] lists in SI units, updated in place.
+    """
+    for _ in range(steps):
+        next_states = list()
+        for position, velocity, mass, charge in particles:
+            current_x, current_y, current_z = position
+            current_v_x, current_v_y, current_v_z = velocity
+            for other in particles:
+                if other[0] is not position:
+                    other_x, other_y, other_z = other[0]
+                    dx, dy, dz = other_x-current_x, other_y-current_y, other_z-current_z
+                    distance = Decimal(sqrt(dx*dx + dy*dy + dz*dz))
+                    fg = Decimal(G*mass*other[2]/(distance*distance))
+                    fe = -Decimal(Ke*charge*other[3]/(distance*distance))
+                    f_tot = fg + fe
+                    current_v_x += dx / distance * f_tot / mass * delta_t
+                    current_v_y += dy / distance * f_tot / mass * delta_t
+                    current_v_z += dz / distance * f_tot / mass * delta_t
+            next_states.append(((current_x + current_v_x * delta_t, current_y + current_v_y * delta_t,
+                                 current_z + current_v_z * delta_t), (current_v_x, current_v_y, current_v_z)))
+        for particle, (position, velocity) in zip(particles, next_states):
+            particle[0], particle[1] = position, velocity
+    return particles
+
+
+def random_plasma(count, seed=0):
+    """
+    A cloud of protons and electrons within 1000 pm, in SI units.
+    """
+    random_state = numpy.random.default_rng(seed)
+    positions = random_state.uniform(-1e-9, 1e-9, (count, 3))
+    velocities = random_state.uniform(-1e5, 1e5, (count, 3))
+    is_proton = numpy.arange(count) % 2 == 0
+    masses = numpy.where(is_proton, 1.007276466879, 5.4857991e-4) * nbody.UNIT_MASS
+    charges = numpy.where(is_proton, 1.0, -1.0) * nbody.UNIT_CHARGE
+    return positions, velocities, masses, charges
+
+
+def bench_engine(count=1000, steps=10, previous_steps=1, delta_t=1e-20):
+    print('N-body step of {} particles (milliseconds per step)'.format(count))
+    positions, velocities, masses, charges = random_plasma(count)
+    particles = [[tuple(Decimal(x) for x in position), tuple(Decimal(v) for v in velocity), Decimal(mass),
+                  Decimal(charge)] for position, velocity, mass, charge in zip(positions.tolist(),
+                                                                              velocities.tolist(),
+                                                                              masses.tolist(), charges.tolist())]
+    previous_time, _ = _timed(_previous_simulation, particles, previous_steps, Decimal(delta_t))
+
+    system = nbody.ParticleSystem.from_si(positions, velocities, masses, charges)
+    reference = system.copy()
+    nbody.simulate(reference, previous_steps, delta_t / nbody.UNIT_TIME, record=False)
+    previous_positions = numpy.array([[float(x) for x in particle[0]] for particle in particles]) / nbody.UNIT_LENGTH
+    assert numpy.allclose(previous_positions, reference.positions, rtol=1e-9, atol=1e-9)
+
+    numpy_time, _ = _timed(nbody.simulate, system, steps, delta_t / nbody.UNIT_TIME, record=False)
+    print('  decimal {:12.1f}   numpy {:8.2f}   speedup {:8.0f}x'.format(
+        1e3 * previous_time / previous_steps, 1e3 * numpy_time / steps,
+        (previous_time / previous_steps) / (numpy_time / steps)))
+
+
+def neutral_cloud(count, density=1e-3, seed=0):
+    """
+    A neutral cloud of protons and electrons in reduced units, at 'density' particles per cubic picometre.
+    """
+    random_state = numpy.random.default_rng(seed)
+    half_side = 0.5 * (count / density) ** (1 / 3)
+    charges = numpy.where(numpy.arange(count) % 2 == 0, 1.0, -1.0)
+    masses = numpy.where(charges > 0, 1.007276466879, 5.4857991e-4)
+    return nbody.ParticleSystem(random_state.uniform(-half_side, half_side, (count, 3)), numpy.zeros((count, 3)),
+                                masses, charges)
+
+
+def bench_force_backends(counts=(1000, 4000, 16000), cutoff=30.0):
+    print('force backends (milliseconds per force evaluation; error against the exact forces)')
+    print('{:>7} {:>10} {:>12} {:>10} {:>12} {:>10}'.format('N', 'pairwise', 'barnes-hut', 'rms error', 'cell list',
+                                                            'rms error'))
+    for count in counts:
+        system = neutral_cloud(count)
+        exact = forces.PairwiseBackend()
+        barnes_hut = forces.BarnesHutBackend(theta=0.5)
+        cell_list = forces.CellListBackend(cutoff=cutoff)
+        pairwise_time, _ = _timed(exact.forces, system)
+        barnes_hut_time, _ = _timed(barnes_hut.forces, system)
+        cell_list.forces(system)
+        # the neighbor list is reused while the particles stay within the skin
+        cell_list_time, _ = _timed(cell_list.forces, system)
+        barnes_hut_error = forces.force_error(system, barnes_hut, exact)
+        cell_list_error = forces.force_error(system, cell_list, exact)
+        print('{:>7} {:10.1f} {:12.1f} {:10.4f} {:12.1f} {:10.4f}'.format(
+            count, 1e3 * pairwise_time, 1e3 * barnes_hut_time, barnes_hut_error.rms_force,
+            1e3 * cell_list_time, cell_list_error.rms_force))
+
+
+def hydrogen_gas(count, spacing=300.0, seed=0):
+    """
+    'count' hydrogen atoms on a cubic grid in reduced units, every electron on an eccentric orbit: it starts at
+    50 pm from its proton with a random direction and 40 to 90 percent of the circular speed.
+    """
+    random_state = numpy.random.default_rng(seed)
+    side = int(numpy.ceil(count ** (1 / 3)))
+    grid = numpy.stack(numpy.meshgrid(*[numpy.arange(side)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)[:count]
+    protons = grid * spacing
+    offsets = random_state.normal(size=(count, 3))
+    offsets *= 50.0 / numpy.linalg.norm(offsets, axis=1)[:, numpy.newaxis]
+    directions = numpy.cross(offsets, random_state.normal(size=(count, 3)))
+    directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+    electron_mass = 5.4857991e-4
+    speeds = random_state.uniform(0.4, 0.9, count) / numpy.sqrt(electron_mass * 50.0)
+    positions = numpy.empty((2 * count, 3))
+    positions[0::2], positions[1::2] = protons, protons + offsets
+    velocities = numpy.zeros((2 * count, 3))
+    velocities[1::2] = directions * speeds[:, numpy.newaxis]
+    masses = numpy.tile([1.007276466879, electron_mass], count)
+    charges = numpy.tile([1.0, -1.0], count)
+    return nbody.ParticleSystem(positions, velocities, masses, charges)
+
+
+def bench_integrators(count=64, duration=200.0):
+    print('integrators for {} hydrogen atoms over {} reduced time units'.format(count, duration))
+    print('{:>24} {:>10} {:>14} {:>12} {:>14}'.format('integrator', 'steps', 'forces/particle', 'time (s)',
+                                                       'energy drift'))
+    runs = [('euler', 4000, 'euler'), ('velocity verlet', 4000, 'velocity_verlet'),
+            ('leapfrog', 4000, 'leapfrog'), ('rk4', 1000, 'rk4'),
+            ('velocity verlet', 16000, 'velocity_verlet'),
+            ('block, eta 0.2', 100, integrators.BlockTimeSteps(eta=0.2)),
+            ('block, eta 0.1', 100, integrators.BlockTimeSteps(eta=0.1))]
+    for name, steps, integrator in runs:
+        system = hydrogen_gas(count)
+        integrator = integrators.get_integrator(integrator)
+        diagnostics = list()
+        elapsed, _ = _timed(nbody.simulate, system, steps, duration / steps, integrator=integrator,
+                            diagnostics=diagnostics.append, record=False)
+        print('{:>24} {:>10} {:>14.0f} {:>12.2f} {:>14.2e}'.format(
+            name, steps, integrator.force_evaluations / len(system), elapsed,
+            max(abs(d.energy_drift) for d in diagnostics)))
+
+
+def _previous_output(system, frames, path):
+    """
+    The previous output of electron_simulation: a list of position tuples per particle and step, written at the
+    end as indented JSON.
+    """
+    data = [{'positions': list(), 'velocities': list()} for _ in range(len(system))]
+    for positions in frames:
+        for i, position in enumerate(positions.tolist()):
+            data[i]['positions'].append(tuple(position))
+    with open(path, 'w') as jsonfile:
+        json.dump(data, jsonfile, separators=(',', ':'), indent=4)
+
+
+def _write_frames(system, frames, path):
+    with trajectory.TrajectoryWriter(path, len(system), len(frames)) as writer:
+        for step, positions in enumerate(frames):
+            system.positions[:] = positions
+            writer.write(step, float(step), system)
+
+
+def bench_trajectory_io(count=200, steps=2000):
+    print('trajectory output of {} particles for {} steps'.format(count, steps))
+    positions = random_plasma(count)[0] / nbody.UNIT_LENGTH
+    system = nbody.ParticleSystem(positions, numpy.zeros((count, 3)), numpy.ones(count), numpy.zeros(count))
+    frames = system.positions + numpy.cumsum(numpy.random.default_rng(0).normal(size=(steps, count, 3)), axis=0)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path, npy_path = os.path.join(directory, 'run.json'), os.path.join(directory, 'run.npy')
+        json_time, _ = _timed(_previous_output, system, frames, json_path)
+        npy_time, _ = _timed(_write_frames, system, frames, npy_path)
+        # one particle of one frame: the JSON file has to be parsed as a whole
+        json_read_time, data = _timed(lambda: json.load(open(json_path))[count // 2]['positions'][steps // 2])
+        npy_read_time, position = _timed(lambda: trajectory.Trajectory(npy_path)[steps // 2].positions[count // 2])
+        assert numpy.allclose(data, position)
+        print('{:>8} {:>12} {:>14} {:>18}'.format('', 'size (MB)', 'write (s)', 'read a frame (ms)'))
+        print('{:>8} {:12.1f} {:14.2f} {:18.2f}'.format('json', os.path.getsize(json_path) / 1e6, json_time,
+                                                         1e3 * json_read_time))
+        print('{:>8} {:12.1f} {:14.2f} {:18.2f}'.format('npy', os.path.getsize(npy_path) / 1e6, npy_time,
+                                                         1e3 * npy_read_time))
+
+
+def bench_checkpoints(count=20000, saves=10):
+    print('checkpoints of {} particles with velocity Verlet and a cell list'.format(count))
+    system = neutral_cloud(count)
+    integrator, backend = integrators.VelocityVerlet(), forces.CellListBackend(cutoff=30.0)
+    integrator.step(system, backend, 0.01)
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoints = checkpoint.Checkpoints(directory, 1, keep=2)
+        save_time, path = _timed(lambda: [checkpoints.save(step, 0.0, system, integrator, backend)
+                                          for step in range(saves)][-1])
+        restored = neutral_cloud(count)
+        restore_time, _ = _timed(checkpoints.restore, restored, integrators.VelocityVerlet(),
+                                 forces.CellListBackend(cutoff=30.0))
+        assert (restored.positions == system.positions).all()
+        step_time, _ = _timed(integrator.step, system, backend, 0.01)
+        print('  size {:.1f} MB   save {:.1f} ms   restore {:.1f} ms   one step {:.1f} ms'.format(
+            os.path.getsize(path) / 1e6, 1e3 * save_time / saves, 1e3 * restore_time, 1e3 * step_time))
+
+
+if __name__ == '__main__':
+    bench_engine()
+    bench_force_backends()
+    bench_integrators()
+    bench_trajectory_io()
+    bench_checkpoints()
@@ -0,0 +1,105 @@
+"""
+Benchmarks for the start-up time of pychem. Run from the benchmarks directory with:
+
+    PYTHONPATH=.. python bench_startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from pychem.molecule import elements
+
+
+def _previous_load_data():
+    """The previous loader, which parsed every field of elements.json when pychem.molecule was imported."""
+    with open(elements.ELEMENTS_PATH) as elements_data_file:
+        data = json.loads(elements_data_file.read())
+
+    to_element = dict()
+    element_records = dict()
+    for element, element_data in data.items():
+        to_element[element_data['z']] = element
+        to_element[element_data['symbol']] = element
+        to_element[element] = element
+        element_records[element] = elements.Element(element, element_data['symbol'], element_data['z'],
+                                                    element_data['atomic weight'],
+                                                    element_data['electronegativity'])
+    return data, to_element, element_records
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _remove_cache():
+    try:
+        os.remove(elements.CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def _fresh_load():
+    elements._table = elements._index = None
+    elements.get_element('C')
+
+
+def _subprocess_time(code, repeat):
+    """The best wall time of running 'code' in a new interpreter, in seconds."""
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, env=environment)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_element_table(repeat=20):
+    print('loading the element table (milliseconds)')
+    previous_time = min(_timed(_previous_load_data)[0] for _ in range(repeat))
+    json_times = list()
+    for _ in range(repeat):
+        _remove_cache()
+        json_times.append(_timed(_fresh_load)[0])
+    cache_time = min(_timed(_fresh_load)[0] for _ in range(repeat))
+    print('  previous, full json      {:8.2f}'.format(1e3 * previous_time))
+    print('  compact, from json       {:8.2f}'.format(1e3 * min(json_times)))
+    print('  compact, from cache      {:8.2f}'.format(1e3 * cache_time))
+
+
+def bench_isotope_table(repeat=5):
+    print('loading the isotope table (milliseconds)')
+    parse_time = min(_timed(elements._compile_isotopes)[0] for _ in range(repeat))
+
+    def fresh_load():
+        elements._isotopes = elements._isotope_index = None
+        elements.isotope_table()
+
+    fresh_load()
+    cache_time = min(_timed(fresh_load)[0] for _ in range(repeat))
+    lookups = 10**5
+    lookup_time, _ = _timed(lambda: [elements.isotope_mass(6, 13) for _ in range(lookups)])
+    print('  parse isotopes.json      {:8.2f}'.format(1e3 * parse_time))
+    print('  from cache               {:8.2f}'.format(1e3 * cache_time))
+    print('  isotope_mass (µs)        {:8.3f}'.format(1e6 * lookup_time / lookups))
+
+
+def bench_import(repeat=10):
+    print('start-up of a new interpreter (milliseconds)')
+    _fresh_load()
+    baseline = _subprocess_time('pass', repeat)
+    import_time = _subprocess_time('import pychem', repeat)
+    first_atom_time = _subprocess_time('from pychem import Molecule; Molecule(smiles="CC")', repeat)
+    print('  python                   {:8.1f}'.format(1e3 * baseline))
+    print('  import pychem            {:8.1f}'.format(1e3 * import_time))
+    print('  import and first atom    {:8.1f}'.format(1e3 * first_atom_time))
+
+
+if __name__ == '__main__':
+    bench_element_table()
+    bench_isotope_table()
+    bench_import()
@@ -5,8 +5,8 @@ from .parsers import formula as formula_parser
 
 
 class Molecule(molecule.Molecule):
-    def __init__(self, smiles=None, iupac=None, cas=None, formula=None):
+    def __init__(self, smiles=None, iupac=None, cas=None, formula=None, implicit_hydrogens=False):
         molecule.Molecule.__init__(self)
 
         if smiles:
-            smiles_parser.parse(smiles, molecule=self)
+            smiles_parser.parse(smiles, molecule=self, implicit_hydrogens=implicit_hydrogens)
@@ -0,0 +1,331 @@
+import html
+import marshal
+import math
+import os
+import re
+import sys
+from array import array
+from collections import namedtuple
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+ELEMENTS_PATH = os.path.join(DATA_DIR, 'elements.json')
+ISOTOPES_PATH = os.path.join(DATA_DIR, 'isotopes.json')
+_CACHE_VERSION = 3
+
+
+def _cache_directory():
+    """
+    The directory of the compiled tables: $PYCHEM_CACHE_DIR if it is set, otherwise a pychem directory in the
+    cache directory of the user.
+    """
+    directory = os.environ.get('PYCHEM_CACHE_DIR')
+    if directory:
+        return directory
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pychem')
+
+
+# The compiled tables are marshal files, whose format depends on the Python version, so the version is part
+# of their names. They are rebuilt when the json files change, and the tables are only kept in memory if the
+# cache directory can not be written.
+_CACHE_TAG = sys.implementation.cache_tag or 'python-{}{}'.format(*sys.version_info[:2])
+CACHE_PATH = os.path.join(_cache_directory(), 'elements-' + _CACHE_TAG + '.cache')
+ISOTOPES_CACHE_PATH = os.path.join(_cache_directory(), 'isotopes-' + _CACHE_TAG + '.cache')
+
+
+# The properties of an element that are used by Atom. Every atom refers to the record of its element
+# instead of copying the values.
+Element = namedtuple('Element', ['name', 'symbol', 'atomic_number', 'atomic_weight', 'electronegativity'])
+
+
+# The table is loaded on first use: a tuple of elements indexed by atomic number, and a dict that maps
+# atomic numbers, symbols and names to elements.
+_table = None
+_index = None
+
+
+def get_element(key):
+    """
+    Returns the Element for an atomic number, a symbol (in any case, e.g. 'cl' for aromatic SMILES) or a
+    name. Raises KeyError for unknown elements.
+    """
+    if _index is None:
+        _load()
+    try:
+        return _index[key]
+    except KeyError:
+        if isinstance(key, str) and key.capitalize() in _index:
+            return _index[key.capitalize()]
+        if isinstance(key, str) and key.lower() in _index:
+            return _index[key.lower()]
+        raise
+
+
+def element_table():
+    """
+    Returns all elements as a tuple indexed by atomic number. Index 0, and elements missing from the data,
+    are None.
+    """
+    if _table is None:
+        _load()
+    return _table
+
+
+def _load():
+    global _table, _index
+
+    rows = _read_cache(CACHE_PATH, ELEMENTS_PATH)
+    if rows is None:
+        rows = _compile_rows()
+        _write_cache(CACHE_PATH, ELEMENTS_PATH, rows)
+
+    table = [None] * (max(row[2] for row in rows) + 1)
+    index = dict()
+    for row in rows:
+        element = Element(*row)
+        table[element.atomic_number] = element
+        index[element.atomic_number] = element
+        index[element.symbol] = element
+        index[element.name] = element
+    _table, _index = tuple(table), index
+
+
+def _compile_rows():
+    """
+    Reads elements.json and keeps only the fields of Element, as a list of tuples sorted by atomic number.
+    Placeholder records without a symbol are left out.
+    """
+    import json
+    with open(ELEMENTS_PATH) as elements_data_file:
+        data = json.load(elements_data_file)
+    rows = [(name, element_data['symbol'], element_data['z'], element_data['atomic weight'],
+             element_data['electronegativity']) for name, element_data in data.items() if element_data['symbol']]
+    rows.sort(key=lambda row: row[2])
+    return rows
+
+
+####################################################################################################
+# Isotopes
+
+# One isotope of the isotope table. Masses are in u, the half-life in seconds (inf for stable isotopes, nan
+# if unknown) and the abundance is the natural mole fraction (0 for isotopes that only occur in traces or
+# not at all).
+Isotope = namedtuple('Isotope', ['symbol', 'atomic_number', 'neutron_count', 'mass', 'mass_uncertainty',
+                                 'abundance', 'half_life'])
+
+# The parsed isotopes.json in columns: a list of symbols and arrays of the numeric values, all in the same
+# order.
+IsotopeTable = namedtuple('IsotopeTable', ['symbols', 'atomic_numbers', 'neutron_counts', 'masses',
+                                           'mass_uncertainties', 'abundances', 'half_lives'])
+
+# Loaded on first use: the table, and a dict that maps (Z, N) and symbols like '52Cu' to rows of the table.
+_isotopes = None
+_isotope_index = None
+
+_SECONDS = {'ys': 1e-24, 'zs': 1e-21, 'as': 1e-18, 'fs': 1e-15, 'ps': 1e-12, 'ns': 1e-9, 'µs': 1e-6,
+            'μs': 1e-6, 'us': 1e-6, 'ms': 1e-3, 's': 1.0, 'min': 60.0, 'h': 3600.0, 'd': 86400.0,
+            'y': 31557600.0, 'a': 31557600.0, 'years': 31557600.0}
+# a value with an optional uncertainty (symmetric or as '(+26−6)') and power of ten; '#' marks estimates
+_NUMBER = re.compile(r'(\d[\d,]*(?:\.\d+)?)#?\s*(?:\((?:±|\+)?([\d.]+)(?:[−-][\d.]+)?\))?#?\s*'
+                     r'(?:×\s*10([−-]?\d+))?#?')
+_HALF_LIFE = re.compile(_NUMBER.pattern + r'\s*(ys|zs|as|fs|ps|ns|µs|μs|us|ms|min|years|s|h|d|y|a)\b')
+_ISOTOPE_SYMBOL = re.compile(r'(\d+)([A-Z][a-z]?)')
+# Isotopes that are missing from isotopes.json, as rows of the IsotopeTable.
+_MISSING_ISOTOPES = [('1H', 1, 0, 1.00782503223, 9e-11, 0.999885, math.inf)]
+
+
+def get_isotope(atomic_number, neutron_count):
+    """
+    Returns the Isotope with 'atomic_number' protons and 'neutron_count' neutrons. Raises KeyError for
+    unknown isotopes.
+    """
+    return _isotope_row(_get_isotope_index()[atomic_number, neutron_count])
+
+
+def find_isotope(symbol):
+    """
+    Returns the Isotope for a symbol like '52Cu' or '13C'. Raises KeyError for unknown isotopes.
+    """
+    return _isotope_row(_get_isotope_index()[symbol])
+
+
+def isotope_mass(atomic_number, mass_number):
+    """
+    Returns the mass in u of the isotope with 'atomic_number' and 'mass_number' (protons plus neutrons).
+    Raises KeyError for unknown isotopes.
+    """
+    # the index is loaded first: it also loads the table
+    row = _get_isotope_index()[atomic_number, mass_number - atomic_number]
+    return _isotopes.masses[row]
+
+
+def isotope_table():
+    """
+    Returns the IsotopeTable with all isotopes, sorted by atomic number and neutron count.
+    """
+    _get_isotope_index()
+    return _isotopes
+
+
+def _get_isotope_index():
+    global _isotopes, _isotope_index
+    if _isotope_index is None:
+        # the numeric columns are cached as the raw bytes of their arrays
+        columns = _read_cache(ISOTOPES_CACHE_PATH, ISOTOPES_PATH)
+        if columns is None:
+            symbols, *numeric_columns = _compile_isotopes()
+            columns = [symbols] + [array('i' if i < 2 else 'd', values).tobytes()
+                                   for i, values in enumerate(numeric_columns)]
+            _write_cache(ISOTOPES_CACHE_PATH, ISOTOPES_PATH, columns)
+        symbols = columns[0]
+        arrays = list()
+        for i, column in enumerate(columns[1:]):
+            arrays.append(array('i' if i < 2 else 'd'))
+            arrays[-1].frombytes(column)
+        table = IsotopeTable(symbols, *arrays)
+        atomic_numbers, neutron_counts = table.atomic_numbers, table.neutron_counts
+        index = dict()
+        for row, symbol in enumerate(symbols):
+            index[atomic_numbers[row], neutron_counts[row]] = row
+            index[symbol] = row
+        _isotopes, _isotope_index = table, index
+    return _isotope_index
+
+
+def _isotope_row(row):
+    table = _isotopes
+    return Isotope(table.symbols[row], table.atomic_numbers[row], table.neutron_counts[row], table.masses[row],
+                   table.mass_uncertainties[row], table.abundances[row], table.half_lives[row])
+
+
+def _compile_isotopes():
+    """
+    Parses isotopes.json into columns. The file is a list of isotope lists per element, with the values as
+    text copied from a web page: masses like '51.99718(28)#', half-lives like '3.204(7)&#160;s' and
+    footnote marks like '[n 2]'. Rows that are not a ground state with integer Z and N (nuclear isomers,
+    whose columns are shifted) and rows without a mass are left out.
+    """
+    import json
+    with open(ISOTOPES_PATH) as isotopes_data_file:
+        data = json.load(isotopes_data_file)
+
+    rows = dict()
+    for element_isotopes in data:
+        for isotope_data in element_isotopes:
+            atomic_number, neutron_count = isotope_data['z'], isotope_data['n']
+            if not isinstance(atomic_number, int) or not isinstance(neutron_count, int):
+                continue
+            symbol_match = _ISOTOPE_SYMBOL.match(isotope_data['sym'] or '')
+            if not symbol_match or int(symbol_match.group(1)) != atomic_number + neutron_count:
+                continue
+            mass, mass_uncertainty = _parse_value(isotope_data['m'])
+            if math.isnan(mass):
+                continue
+            rows[atomic_number, neutron_count] = (symbol_match.group(1) + symbol_match.group(2), atomic_number,
+                                                  neutron_count, mass, mass_uncertainty,
+                                                  _parse_abundance(isotope_data.get('mf')),
+                                                  _parse_half_life(isotope_data['hl']))
+    for row in _MISSING_ISOTOPES:
+        rows.setdefault((row[1], row[2]), row)
+    return [list(column) for column in zip(*(rows[key] for key in sorted(rows)))]
+
+
+def _clean_text(text):
+    text = html.unescape(text).replace('\xa0', ' ')
+    return re.sub(r'\[n\s*\d+\]', '', text)
+
+
+def _parse_number(match):
+    """
+    Returns the value and the uncertainty of a _NUMBER match. An uncertainty without a decimal point is in
+    units of the last digit of the value, e.g. '51.99718(28)' is 51.99718 ± 0.00028.
+    """
+    digits, uncertainty_digits, exponent = match.group(1, 2, 3)
+    digits = digits.replace(',', '')
+    value = float(digits)
+    uncertainty = 0.0
+    if uncertainty_digits:
+        uncertainty = float(uncertainty_digits)
+        if '.' not in uncertainty_digits and '.' in digits:
+            uncertainty *= 10.0 ** -len(digits.split('.')[1])
+    if exponent:
+        scale = 10.0 ** int(exponent.replace('−', '-'))
+        value *= scale
+        uncertainty *= scale
+    return value, uncertainty
+
+
+def _parse_value(text):
+    if not isinstance(text, str):
+        return (float(text), 0.0) if isinstance(text, (int, float)) else (math.nan, math.nan)
+    match = _NUMBER.match(_clean_text(text).strip(' []'))
+    if not match:
+        return math.nan, math.nan
+    return _parse_number(match)
+
+
+def _parse_abundance(text):
+    if text is None:
+        return 0.0
+    if isinstance(text, str) and _clean_text(text).strip(' []').lower() == 'trace':
+        return 0.0
+    value, _ = _parse_value(text)
+    # a few abundances are given in percent
+    return value / 100.0 if value > 1.0 else value
+
+
+def _parse_half_life(text):
+    if not isinstance(text, str):
+        return math.nan
+    text = _clean_text(text)
+    if 'stable' in text.lower():
+        return math.inf
+    match = _HALF_LIFE.search(text)
+    if not match:
+        return math.nan
+    value, _ = _parse_number(match)
+    return value * _SECONDS[match.group(4)]
+
+
+####################################################################################################
+# Compiled caches
+
+def _source_stamp(source_path):
+    # the path tells apart the installations that share a cache directory
+    stat = os.stat(source_path)
+    return _CACHE_VERSION, tuple(sys.version_info[:2]), os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size
+
+
+def _read_cache(cache_path, source_path):
+    """
+    Returns the value stored in 'cache_path', or None if there is no cache or it was made from another
+    version of 'source_path'.
+    """
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            stamp, value = marshal.load(cache_file)
+        if stamp != _source_stamp(source_path):
+            return None
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return value
+
+
+def _write_cache(cache_path, source_path, value):
+    temporary_path = cache_path + '.' + str(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temporary_path, 'wb') as cache_file:
+            marshal.dump((_source_stamp(source_path), value), cache_file)
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
@@ -0,0 +1,221 @@
+import zlib
+
+from pychem.molecule import substructure
+
+
+# rows per block in the vectorized screens, which bounds the size of the temporary arrays
+_BLOCK_ROWS = 1 << 16
+
+
+def fingerprint(item, n_bits=1024, max_length=5):
+    """
+    Returns the path fingerprint of a Molecule or a substructure.Query as an array of n_bits / 64 uint64
+    words. Every linear path of up to 'max_length' bonds sets one bit, hashed from the elements, aromaticity
+    and charges of its atoms and the types of its bonds. A query matches atoms and bonds with the same labels,
+    so a molecule that lacks a bit of the fingerprint of a query can not match it.
+
+    The fingerprint of a molecule is cached, read-only, until the molecule changes. The paths of a query leave
+    out the atom a group is attached to, which can be any element. Requires NumPy.
+    """
+    if n_bits <= 0 or n_bits % 64:
+        raise ValueError('"' + str(n_bits) + '" is not a positive multiple of 64.')
+    if isinstance(item, substructure.Query):
+        return _fingerprint(item, n_bits, max_length)
+
+    def compute():
+        words = _fingerprint(substructure._target(item), n_bits, max_length)
+        words.flags.writeable = False
+        return words
+    return item._cached(('fingerprint', n_bits, max_length), compute)
+
+
+def fingerprints(molecules, n_bits=1024, max_length=5):
+    """
+    Returns the fingerprints of 'molecules' as the rows of a 2D uint64 array.
+    """
+    import numpy
+    rows = [fingerprint(molecule, n_bits, max_length) for molecule in molecules]
+    if not rows:
+        return numpy.zeros((0, n_bits // 64), dtype=numpy.uint64)
+    return numpy.stack(rows)
+
+
+def _fingerprint(graph_view, n_bits, max_length):
+    """
+    Sets the bits of the paths of a substructure.Query or a substructure._Target, which both label their
+    atoms by symbols, aromaticity and charges and store their bonds as dicts of neighbor to bond type.
+    """
+    import numpy
+    labels = [(symbol, aromatic, charge) if symbol is not None else None
+              for symbol, aromatic, charge in zip(graph_view.symbols, graph_view.aromatic, graph_view.charges)]
+    bits = set()
+    for path in _yield_paths(labels, graph_view.neighbors, max_length):
+        bits.add(zlib.crc32(repr(path).encode()) % n_bits)
+
+    words = numpy.zeros(n_bits // 64, dtype=numpy.uint64)
+    if bits:
+        bits = numpy.fromiter(bits, dtype=numpy.uint64, count=len(bits))
+        numpy.bitwise_or.at(words, (bits // 64).astype(numpy.intp), numpy.uint64(1) << (bits % 64))
+    return words
+
+
+def _yield_paths(labels, neighbors, max_length):
+    """
+    Yields every linear path of up to 'max_length' bonds between labeled atoms once, as a tuple of alternating
+    atom labels and bond types, read in the direction that gives the smallest tuple.
+    """
+    for start, label in enumerate(labels):
+        if label is None:
+            continue
+        yield label,
+        path = [start]
+        sequence = [label]
+        branches = [iter(neighbors[start].items())]
+        while branches:
+            for atom, bond_type in branches[-1]:
+                if labels[atom] is not None and atom not in path:
+                    break
+            else:
+                branches.pop()
+                path.pop()
+                del sequence[-2:]
+                continue
+            path.append(atom)
+            sequence += (bond_type, labels[atom])
+            # every path is found from both ends; keep the one that starts at the lower index
+            if start < atom:
+                forward = tuple(sequence)
+                yield min(forward, forward[::-1])
+            if len(path) <= max_length:
+                branches.append(iter(neighbors[atom].items()))
+            else:
+                path.pop()
+                del sequence[-2:]
+
+
+def _popcount(words):
+    """
+    The number of set bits in every row of a 2D uint64 array.
+    """
+    import numpy
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(words).sum(axis=1, dtype=numpy.int64)
+    table = numpy.array([bin(byte).count('1') for byte in range(256)], dtype=numpy.uint8)
+    return table[words.view(numpy.uint8)].sum(axis=1, dtype=numpy.int64)
+
+
+class FingerprintIndex:
+    """
+    The fingerprints of a library of molecules as rows of a packed uint64 array, for substructure screens
+    and Tanimoto similarity searches that handle the whole library with a few vectorized NumPy operations.
+    Requires NumPy.
+    """
+    def __init__(self, n_bits=1024, max_length=5):
+        import numpy
+        if n_bits <= 0 or n_bits % 64:
+            raise ValueError('"' + str(n_bits) + '" is not a positive multiple of 64.')
+        self.n_bits = n_bits
+        self.max_length = max_length
+        # the rows are allocated ahead, doubling the capacity when it runs out
+        self._rows = numpy.zeros((0, n_bits // 64), dtype=numpy.uint64)
+        self._bit_counts = numpy.zeros(0, dtype=numpy.int64)
+        self._size = 0
+        self.molecules = list()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def rows(self):
+        return self._rows[:self._size]
+
+    def add(self, molecules):
+        """
+        Adds the fingerprints of 'molecules' and keeps the molecules for exact matching in search.
+        """
+        molecules = list(molecules)
+        self.add_fingerprints(fingerprints(molecules, self.n_bits, self.max_length), molecules)
+
+    def add_fingerprints(self, rows, molecules=None):
+        """
+        Adds fingerprints that were computed with the same n_bits and max_length, for example loaded from a
+        file. Without molecules the rows can be screened and ranked but not searched.
+        """
+        import numpy
+        rows = numpy.asarray(rows, dtype=numpy.uint64)
+        if rows.ndim != 2 or rows.shape[1] != self.n_bits // 64:
+            raise ValueError('The fingerprints should have ' + str(self.n_bits // 64) + ' words per row.')
+        if molecules is not None and len(molecules) != len(rows):
+            raise ValueError('There should be one molecule per fingerprint.')
+        if (molecules is None and self.molecules) or (molecules is not None and self._size != len(self.molecules)):
+            raise ValueError('Either all or none of the fingerprints should have molecules.')
+        size = self._size + len(rows)
+        if size > len(self._rows):
+            capacity = max(size, 2 * len(self._rows))
+            self._rows = numpy.concatenate([self.rows, numpy.zeros((capacity - self._size, rows.shape[1]),
+                                                                   dtype=numpy.uint64)])
+            self._bit_counts = numpy.concatenate([self._bit_counts[:self._size],
+                                                  numpy.zeros(capacity - self._size, dtype=numpy.int64)])
+        self._rows[self._size:size] = rows
+        self._bit_counts[self._size:size] = _popcount(rows)
+        self._size = size
+        if molecules is not None:
+            self.molecules.extend(molecules)
+
+    def _query_fingerprint(self, query):
+        if isinstance(query, str):
+            query = substructure.Query(query)
+        return fingerprint(query, self.n_bits, self.max_length)
+
+    def screen(self, query):
+        """
+        Returns the rows, as an array of indexes, whose fingerprints have all bits of the fingerprint of
+        'query': a superset of the rows of the molecules that match it. 'query' is a substructure.Query, a
+        pattern or a Molecule.
+        """
+        import numpy
+        query_words = self._query_fingerprint(query)
+        hits = list()
+        for start in range(0, self._size, _BLOCK_ROWS):
+            block = self._rows[start:min(start + _BLOCK_ROWS, self._size)]
+            contained = ((block & query_words) == query_words).all(axis=1)
+            hits.append(numpy.flatnonzero(contained) + start)
+        return numpy.concatenate(hits) if hits else numpy.zeros(0, dtype=numpy.intp)
+
+    def search(self, query):
+        """
+        Returns the rows of the molecules that match 'query', a substructure.Query or a pattern. Only the
+        molecules that pass the screen are matched exactly.
+        """
+        if self._size and not self.molecules:
+            raise ValueError('The index has no molecules to match.')
+        query = substructure.compile_query(query)
+        return [row for row in self.screen(query).tolist() if query.has_match(self.molecules[row])]
+
+    def similar(self, query, k=10):
+        """
+        Returns the 'k' rows most similar to 'query', a Molecule or a fingerprint, by Tanimoto similarity: the
+        number of bits set in both fingerprints divided by the number of bits set in either. Returns an array
+        of rows and an array of similarities, the most similar first and ties by row.
+        """
+        import numpy
+        if isinstance(query, numpy.ndarray):
+            query_words = numpy.asarray(query, dtype=numpy.uint64)
+        else:
+            query_words = self._query_fingerprint(query)
+        query_count = int(_popcount(query_words[numpy.newaxis])[0])
+        similarities = numpy.zeros(self._size, dtype=numpy.float64)
+        for start in range(0, self._size, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, self._size)
+            common = _popcount(self._rows[start:stop] & query_words)
+            union = self._bit_counts[start:stop] + query_count - common
+            numpy.divide(common, union, out=similarities[start:stop], where=union > 0)
+        k = min(k, self._size)
+        if k <= 0:
+            return numpy.zeros(0, dtype=numpy.intp), similarities[:0]
+        best = numpy.argpartition(-similarities, k - 1)[:k] if k < self._size else numpy.arange(self._size)
+        # the k-th similarity can be shared by rows outside the partition; take all of them and sort by row
+        threshold = similarities[best].min()
+        best = numpy.flatnonzero(similarities >= threshold)
+        best = best[numpy.lexsort((best, -similarities[best]))][:k]
+        return best, similarities[best]
@@ -1,22 +1,21 @@
-
-
-def add_bonds_to_atoms(bonds):
-    for bond in bonds:
-        for atom in bond.atoms:
-            atom.bonds.add(bond)
-            for other_atom in bond.atoms.copy():
-                if other_atom != atom:
-                    atom.surrounding_atoms.add(other_atom)
+from pychem.molecule import graph
 
 
 def yield_all_chains(atoms, max_length=100):
+    """
+    Yields every chain, a simple path as a list of atoms, of at most 'max_length' atoms in 'atoms'. The
+    number of chains grows exponentially with the size of a molecule; use list_longest_chains to find the
+    longest chains.
+    """
+    atom_set = set(atoms)
+
     def recursive(current_chain):
         yield current_chain
         if len(current_chain) >= max_length:
             return
         current_atom = current_chain[-1]
-        for other_atom in current_atom.surrounding_atoms:
-            if other_atom not in current_chain:
+        for other_atom in current_atom.adj_atoms:
+            if other_atom in atom_set and other_atom not in current_chain:
                 new_chain = current_chain.copy()
                 new_chain.append(other_atom)
                 yield from recursive(new_chain)
@@ -31,15 +30,18 @@ def list_all_chains(atoms, max_length=100):
 
 
 def yield_ending_atoms(atoms, exclude_hydrogen=True):
+    """
+    Yields the atoms in 'atoms' that are bonded to exactly one other atom in 'atoms', not counting hydrogens
+    if 'exclude_hydrogen'.
+    """
+    atom_set = set(atoms)
     for atom in atoms:
-        if atom['symbol'] == 'H' and exclude_hydrogen:
+        if atom.symbol == 'H' and exclude_hydrogen:
             continue
         real_surrounding_count = 0
-        for surrounding_atom in atom.surrounding_atoms:
-            if surrounding_atom in atoms:
+        for surrounding_atom in atom.adj_atoms:
+            if surrounding_atom in atom_set and not (exclude_hydrogen and surrounding_atom.symbol == 'H'):
                 real_surrounding_count += 1
-            if exclude_hydrogen and atom['symbol'] == 'H':
-                real_surrounding_count -= 1
         if real_surrounding_count == 1:
             yield atom
 
@@ -48,44 +50,28 @@ def list_ending_atoms(atoms, exclude_hydrogen=True):
     return list(yield_ending_atoms(atoms, exclude_hydrogen))
 
 
-def list_longest_chains(atoms, exclude_hydrogen=True, max_length=100):
-    def recursive(current_chain):
-        if len(current_chain) > max_length:
-            return
-        current_atom = current_chain[-1]
-        yielded = False
-        for other_atom in current_atom.surrounding_atoms:
-            if (not exclude_hydrogen or (other_atom not in hydrogen_atoms and exclude_hydrogen)) \
-                    and other_atom not in current_chain:
-                new_chain = current_chain.copy()
-                new_chain.append(other_atom)
-                yield from recursive(new_chain)
-                yielded = True
-        if not yielded:
-            yield current_chain
-
-    ending_atoms = list_ending_atoms(atoms, exclude_hydrogen)
-    hydrogen_atoms = [atom for atom in atoms if atom['symbol'] == 'H']
-
-    # find the longest chains, starting from the ending atoms:
-    longest_chains = list()
-    length_longest_chain = 0
-    for atom in ending_atoms:
-        chain = [atom]
-        for long_chain in recursive(chain):
-            if len(long_chain) == length_longest_chain:
-                longest_chains.append(long_chain)
-            elif len(long_chain) > length_longest_chain:
-                longest_chains = [long_chain]
-                length_longest_chain = len(long_chain)
-    return longest_chains
+def list_longest_chains(atoms, exclude_hydrogen=True, max_paths=None):
+    """
+    The longest chains of 'atoms', as lists of atoms, every chain in one direction only. See
+    graph.longest_paths: this takes linear time if the atoms form no ring, and a bounded search otherwise.
+    """
+    if exclude_hydrogen:
+        atoms = [atom for atom in atoms if atom.symbol != 'H']
+    else:
+        atoms = list(atoms)
+    if not atoms:
+        return []
+    return graph.longest_paths(atoms[0].molecule, atoms, max_paths)
 
 
 def remove_side_chains(atoms):
+    """
+    Repeatedly removes the ending atoms from 'atoms' until only rings and the chains between them remain.
+    """
     length_previous_atoms = 0
-    current_atoms = atoms.copy()
+    current_atoms = list(atoms)
     while length_previous_atoms != len(current_atoms):
-        ending_atoms = list_ending_atoms(atoms)
+        ending_atoms = list_ending_atoms(current_atoms)
         length_previous_atoms = len(current_atoms)
         for atom in ending_atoms:
             current_atoms.remove(atom)
@@ -119,14 +105,16 @@ def yield_all_rings(atoms, max_length):
 
 
 def yield_unique_rings(atoms, max_length=10):
-    unique_ring_sets = list()
-    unique_rings = list()
-    for ring in yield_all_rings(atoms, max_length):
-        ring_set = set(ring)
-        if ring_set not in unique_ring_sets:
-            unique_ring_sets.append(ring_set)
-            unique_rings.append(ring)
-    return unique_rings
+    """
+    The relevant cycles of the molecule of 'atoms' with at most 'max_length' atoms, that only consist of
+    atoms in 'atoms'.
+    """
+    atoms = set(atoms)
+    if not atoms:
+        return []
+    molecule = next(iter(atoms)).molecule
+    return [list(ring) for ring in molecule.relevant_cycles()
+            if len(ring) <= max_length and atoms.issuperset(ring)]
 
 
 def list_unique_rings(atoms, max_length=10):
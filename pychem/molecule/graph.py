@@ -1,18 +1,56 @@
-from queue import Queue
+from array import array
+from collections import deque, namedtuple
+from heapq import heapify, heappush, heappop
+from itertools import count
 
 
 class Node:
+    """
+    The edges of a node are stored lazily to keep nodes small: '_edges' is None for a node without edges,
+    the Edge itself for a node with one edge, and a list of edges otherwise. The adjacent nodes are
+    derived from the edges.
+    """
+    __slots__ = ('identifier', '_edges')
+
     def __init__(self, identifier=None):
         self.identifier = identifier
-        self.adj_nodes = set()
-        self.edges = set()
+        self._edges = None
+
+    @property
+    def edges(self):
+        edges = self._edges
+        if edges is None:
+            return ()
+        if isinstance(edges, list):
+            return edges
+        return edges,
+
+    @property
+    def adj_nodes(self):
+        return [edge.get_other_node(self) for edge in self.edges]
 
     def add_adjacent_node(self, node, edge):
-        self.adj_nodes.add(node)
-        self.edges.add(edge)
+        edges = self._edges
+        if edges is None:
+            self._edges = edge
+        elif isinstance(edges, list):
+            edges.append(edge)
+        else:
+            self._edges = [edges, edge]
+
+    def remove_adjacent_node(self, node, edge):
+        edges = self._edges
+        if edges is edge:
+            self._edges = None
+        elif isinstance(edges, list):
+            edges.remove(edge)
+            if len(edges) == 1:
+                self._edges = edges[0]
 
 
 class Edge:
+    __slots__ = ('source', 'sink', 'weight')
+
     def __init__(self, source, sink, weight=1):
         self.source = source
         self.sink = sink
@@ -30,8 +68,9 @@ class Graph:
         self.directed = directed
         self.weighted = weighted
 
-        self.nodes = set()
-        self.edges = set()
+        # dicts with None values are used as insertion-ordered sets; they take less memory than sets
+        self.nodes = dict()
+        self.edges = dict()
         self._node_ids = dict()
 
     def __len__(self):
@@ -53,18 +92,30 @@ class Graph:
         if not isinstance(node, Node):
             raise ValueError('"' + str(node) + '" is not an Node.')
         if node not in self.nodes:
-            self.nodes.add(node)
+            self.nodes[node] = None
             return True
         return False
 
     def create_node(self, node):
         if node not in self._node_ids:
-            nodenode = Node()
-            self.nodes.add(nodenode)
+            nodenode = Node(node)
+            self.nodes[nodenode] = None
             self._node_ids[node] = nodenode
             return True
         return False
 
+    def get_node(self, node):
+        """
+        Returns the Node object for 'node', which is either a Node itself or the identifier the node was
+        created with.
+        """
+        if isinstance(node, Node):
+            return node
+        try:
+            return self._node_ids[node]
+        except KeyError:
+            raise ValueError('"' + str(node) + '" is not a node in this graph.')
+
     def add_nodes(self, nodes):
         for node in nodes:
             self.add_node(node)
@@ -72,12 +123,14 @@ class Graph:
     def add_edge(self, edge):
         if not isinstance(edge, Edge):
             raise ValueError('"' + str(edge) + '" is not an Edge.')
+        if edge in self.edges:
+            return
         self.add_node(edge.source)
         self.add_node(edge.sink)
 
-        self.edges.add(edge)
+        self.edges[edge] = None
         edge.source.add_adjacent_node(edge.sink, edge)
-        if not self.directed:
+        if not self.directed and edge.sink is not edge.source:
             edge.sink.add_adjacent_node(edge.source, edge)
 
     def create_edge(self, source, sink, weight=None):
@@ -100,12 +153,37 @@ class Graph:
 
         edge = Edge(source, sink, weight)
 
-        self.edges.add(edge)
+        self.edges[edge] = None
 
         source.add_adjacent_node(sink, edge)
-        if not self.directed:
+        if not self.directed and sink is not source:
             sink.add_adjacent_node(source, edge)
 
+    def remove_edge(self, edge):
+        if edge not in self.edges:
+            raise ValueError('"' + str(edge) + '" is not an edge in this graph.')
+        del self.edges[edge]
+        edge.source.remove_adjacent_node(edge.sink, edge)
+        if not self.directed and edge.sink is not edge.source:
+            edge.sink.remove_adjacent_node(edge.source, edge)
+
+    def remove_node(self, node):
+        """
+        Removes 'node' and all edges from and to it.
+        """
+        node = self.get_node(node)
+        if node not in self.nodes:
+            raise ValueError('"' + str(node) + '" is not a node in this graph.')
+        if self.directed:
+            edges = [edge for edge in self.edges if edge.source is node or edge.sink is node]
+        else:
+            edges = list(node.edges)
+        for edge in edges:
+            self.remove_edge(edge)
+        del self.nodes[node]
+        if self._node_ids.get(node.identifier) is node:
+            del self._node_ids[node.identifier]
+
     def create_edges(self, edges):
         for edge in edges:
             source, sink = edge[0], edge[1]
@@ -131,56 +209,266 @@ class Graph:
         return new_graph
 
 
+############################################################
+#            Compressed sparse row (CSR) graph             #
+############################################################
+
+
+class CSRGraph:
+    """
+    A frozen, array-backed graph in compressed sparse row format. Nodes are the integers 0 to V-1. The
+    neighbors of node i are neighbors[offsets[i]:offsets[i+1]], the weights of those edges are found at
+    the same positions in 'weights', and 'edge_ids' holds the index of the edge every position belongs to.
+    An undirected edge is stored in both directions, under the same edge id.
+
+    If the graph was built from a Graph (or Molecule), 'nodes' and 'edges' map the indices back to the
+    original Node and Edge objects, and 'index' maps the Node objects to their indices.
+
+    All algorithms in this module accept a CSRGraph. Nodes are then given by index and the results are
+    lists indexed by node instead of dicts.
+    """
+    __slots__ = ('directed', 'weighted', 'offsets', 'neighbors', 'weights', 'edge_ids', 'edge_count',
+                 'nodes', 'edges', 'index')
+
+    def __init__(self, node_count, edges, directed=True, weighted=False, nodes=None, original_edges=None):
+        """
+        'edges' is a sequence of (source, sink) or (source, sink, weight) tuples of node indices. If
+        'weighted' is false, all weights are 1.
+        """
+        arc_sources = list()
+        arc_sinks = list()
+        arc_weights = list()
+        arc_edge_ids = list()
+        for edge_id, edge in enumerate(edges):
+            source, sink = edge[0], edge[1]
+            weight = edge[2] if weighted else 1
+            if not (0 <= source < node_count and 0 <= sink < node_count):
+                raise ValueError('Edge ' + str(edge) + ' refers to a node outside the graph.')
+            arc_sources.append(source)
+            arc_sinks.append(sink)
+            arc_weights.append(weight)
+            arc_edge_ids.append(edge_id)
+            if not directed and source != sink:
+                arc_sources.append(sink)
+                arc_sinks.append(source)
+                arc_weights.append(weight)
+                arc_edge_ids.append(edge_id)
+
+        offsets = array('l', [0]) * (node_count + 1)
+        for source in arc_sources:
+            offsets[source + 1] += 1
+        for i in range(node_count):
+            offsets[i + 1] += offsets[i]
+        order = sorted(range(len(arc_sources)), key=arc_sources.__getitem__)
+
+        weight_type = 'l' if all(isinstance(weight, int) for weight in arc_weights) else 'd'
+        self._set('directed', directed)
+        self._set('weighted', weighted)
+        self._set('offsets', memoryview(offsets).toreadonly())
+        self._set('neighbors', memoryview(array('l', [arc_sinks[i] for i in order])).toreadonly())
+        self._set('weights', memoryview(array(weight_type, [arc_weights[i] for i in order])).toreadonly())
+        self._set('edge_ids', memoryview(array('l', [arc_edge_ids[i] for i in order])).toreadonly())
+        self._set('edge_count', len(arc_edge_ids) if directed else len(set(arc_edge_ids)))
+        self._set('nodes', nodes)
+        self._set('edges', original_edges)
+        self._set('index', {node: i for i, node in enumerate(nodes)} if nodes is not None else None)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Builds a CSRGraph from a Graph or Molecule. The Node and Edge objects are kept in 'nodes' and
+        'edges', so results can be mapped back to them.
+        """
+        nodes = list(graph.yield_nodes())
+        index = {node: i for i, node in enumerate(nodes)}
+        original_edges = list(graph.yield_edges())
+        edges = [(index[edge.source], index[edge.sink], edge.weight) for edge in original_edges]
+        return cls(len(nodes), edges, directed=graph.directed, weighted=graph.weighted, nodes=nodes,
+                   original_edges=original_edges)
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CSRGraph is frozen.')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def degree(self, node):
+        return self.offsets[node + 1] - self.offsets[node]
+
+    def adj_nodes(self, node):
+        return self.neighbors[self.offsets[node]:self.offsets[node + 1]]
+
+    def node_index(self, node):
+        """
+        Returns the index of 'node', which is either an index or one of the original Node objects.
+        """
+        if isinstance(node, int):
+            return node
+        if self.index is not None and node in self.index:
+            return self.index[node]
+        raise ValueError('"' + str(node) + '" is not a node in this graph.')
+
+    def to_numpy(self):
+        """
+        Returns the offsets, neighbors, weights and edge ids as NumPy arrays that share memory with this
+        graph. Requires NumPy.
+        """
+        import numpy
+        return tuple(numpy.asarray(buffer) for buffer in (self.offsets, self.neighbors, self.weights, self.edge_ids))
+
+    def transpose(self):
+        """
+        Returns the CSRGraph with every edge reversed, with the same nodes and edge ids. An undirected graph is
+        its own transpose.
+        """
+        if not self.directed:
+            return self
+        edges = [None] * self.edge_count
+        for node in range(len(self)):
+            for slot in range(self.offsets[node], self.offsets[node + 1]):
+                edges[self.edge_ids[slot]] = (self.neighbors[slot], node, self.weights[slot])
+        return CSRGraph(len(self), edges, directed=True, weighted=self.weighted, nodes=self.nodes,
+                        original_edges=self.edges)
+
+
 ############################################################
 #                  Dijkstra's algorithm                    #
 ############################################################
 
 
-def dijkstra(graph, source, sink=None, _allow_direct_edge=True):
+def dijkstra(graph, source, sink=None, _allow_direct_edge=True, targets=None):
     """
     Dijkstra's algorithm for finding the shortest paths in a weighted graph starting with node 'source'.
     If the graph contains negative edges, it is better to use the Bellman-Ford algorithm.
-    Worst case performance: O(V²)
+    Worst case performance: O((V+E)*log(V))
+
+    'source' can also be a list, tuple or set of nodes. The search then starts from all of them at once, so
+    every distance is the distance to the closest source.
 
     If a node 'sink' is specified, the algorithm terminates if the weight of the shortest path to that
-    node is known. This is useful if you only need to know the path to that node.
+    node is known. This is useful if you only need to know the path to that node. A collection of nodes
+    'targets' works the same way: the algorithm terminates once the paths to all of them are known.
+
+    Nodes can be given as Node objects or as the identifiers they were created with. In the latter case the
+    returned dicts are keyed by identifier too. For a CSRGraph, nodes are indices and lists are returned.
 
     '_allow_direct_edge' is a parameter useful for the algorithm that finds non-reducible cycles.
     """
-    unvisited_nodes = set()
-    distance = dict()
-    predecessor = dict()
-    for node in graph.yield_nodes():
-        distance[node] = float('inf')
-        predecessor[node] = None
-        unvisited_nodes.add(node)
-    distance[source] = 0
-
-    while unvisited_nodes:
-        closest_node = None
-        lowest_distance = float('inf')
-        for node in unvisited_nodes:
-            if distance[node] < lowest_distance:
-                lowest_distance = distance[node]
-                closest_node = node
-        current_node = closest_node
-        if current_node is None:
-            break
-        unvisited_nodes.remove(current_node)
+    if isinstance(graph, CSRGraph):
+        return _dijkstra_csr(graph, source, sink, _allow_direct_edge, targets)
+
+    sources, by_identifier = _resolve_nodes(graph, source)
+    remaining_targets = set()
+    if targets is not None:
+        remaining_targets.update(graph.get_node(node) for node in targets)
+    if sink is not None:
+        sink = graph.get_node(sink)
+        remaining_targets.add(sink)
+    skip_direct_edge = sink is not None and not _allow_direct_edge
+
+    distance = dict.fromkeys(graph.yield_nodes(), float('inf'))
+    predecessor = dict.fromkeys(graph.yield_nodes(), None)
+
+    # The heap contains (distance, tiebreak, node) entries. Instead of decreasing the key of a node, a new
+    # entry is pushed and outdated entries are skipped when they are popped (lazy deletion).
+    heap = list()
+    tiebreak = count()
+    for node in sources:
+        distance[node] = 0
+        heappush(heap, (0, next(tiebreak), node))
+
+    while heap:
+        current_distance, _, current_node = heappop(heap)
+        if current_distance > distance[current_node]:
+            continue
 
-        # if the sink node is picked from unvisited_nodes it is certain its lowest weight path is known
-        if current_node == sink:
-            break
+        # if a target node is popped from the heap it is certain its lowest weight path is known
+        if current_node in remaining_targets:
+            remaining_targets.remove(current_node)
+            if not remaining_targets:
+                break
 
         for edge in current_node.edges:
             adj_node = edge.get_other_node(current_node)
-            if current_node == source and adj_node == sink and not _allow_direct_edge:
+            if skip_direct_edge and adj_node == sink and current_node in sources:
                 continue
-            new_dist = distance[current_node] + edge.weight
+            new_dist = current_distance + edge.weight
             if new_dist < distance[adj_node]:
                 distance[adj_node] = new_dist
                 predecessor[adj_node] = current_node
+                heappush(heap, (new_dist, next(tiebreak), adj_node))
 
+    if by_identifier:
+        return _to_identifiers(distance, predecessor)
+    return distance, predecessor
+
+
+def _dijkstra_csr(graph, source, sink, allow_direct_edge, targets):
+    sources = _csr_nodes(graph, source)
+    offsets, neighbors, weights = graph.offsets, graph.neighbors, graph.weights
+    remaining_targets = set()
+    if targets is not None:
+        remaining_targets.update(graph.node_index(node) for node in targets)
+    if sink is not None:
+        sink = graph.node_index(sink)
+        remaining_targets.add(sink)
+    skip_direct_edge = sink is not None and not allow_direct_edge
+    source_set = set(sources)
+
+    distance = [float('inf')] * len(graph)
+    predecessor = [None] * len(graph)
+    heap = list()
+    for node in sources:
+        distance[node] = 0
+        heap.append((0, node))
+    heapify(heap)
+
+    while heap:
+        current_distance, current_node = heappop(heap)
+        if current_distance > distance[current_node]:
+            continue
+        if current_node in remaining_targets:
+            remaining_targets.remove(current_node)
+            if not remaining_targets:
+                break
+
+        for slot in range(offsets[current_node], offsets[current_node + 1]):
+            adj_node = neighbors[slot]
+            if skip_direct_edge and adj_node == sink and current_node in source_set:
+                continue
+            new_dist = current_distance + weights[slot]
+            if new_dist < distance[adj_node]:
+                distance[adj_node] = new_dist
+                predecessor[adj_node] = current_node
+                heappush(heap, (new_dist, adj_node))
+
+    return distance, predecessor
+
+
+def _csr_nodes(graph, nodes):
+    if not isinstance(nodes, (list, tuple, set, frozenset)):
+        nodes = [nodes]
+    return [graph.node_index(node) for node in nodes]
+
+
+def _resolve_nodes(graph, nodes):
+    """
+    Returns a list of Node objects for a single node or a list, tuple or set of nodes, and whether the
+    nodes were given by identifier.
+    """
+    if not isinstance(nodes, (list, tuple, set, frozenset)):
+        nodes = [nodes]
+    by_identifier = not all(isinstance(node, Node) for node in nodes)
+    return [graph.get_node(node) for node in nodes], by_identifier
+
+
+def _to_identifiers(distance, predecessor):
+    distance = {node.identifier: node_distance for node, node_distance in distance.items()}
+    predecessor = {node.identifier: (pred.identifier if pred is not None else None)
+                   for node, pred in predecessor.items()}
     return distance, predecessor
 
 
@@ -189,91 +477,495 @@ def dijkstra(graph, source, sink=None, _allow_direct_edge=True):
 ############################################################
 
 
-def bellman_ford(graph, source, sink=None, _allow_direct_edge=True):
+class NegativeCycleError(ValueError):
+    """
+    Raised by bellman_ford if a negative cycle can be reached from the source. 'cycle' holds the nodes of
+    one such cycle, in the direction of its edges.
+    """
+    def __init__(self, cycle):
+        ValueError.__init__(self, 'Graph contains negative cycles!')
+        self.cycle = cycle
+
+
+def bellman_ford(graph, source, sink=None, _allow_direct_edge=True, spfa=False):
     """
     The Bellman-Ford algorithm for finding the shortest paths in a weighted graph starting with node 'source'.
     This algorithm can be used with graphs with negative weighted edges, as long as the graph does not contain
-    negative cycles. If negative cycles are encountered the algorithm raises a ValueError.
+    negative cycles. If negative cycles are encountered the algorithm raises a NegativeCycleError, a
+    ValueError with the nodes of the cycle in its 'cycle' attribute.
     Worst case performance: O(V*E)
 
+    The relaxation passes stop as soon as a pass changes nothing. With 'spfa' only the nodes whose distance
+    changed are scanned again, in FIFO order (the queue-based Shortest Path Faster Algorithm), which is
+    usually much faster on sparse graphs; negative cycles are then found in the predecessor pointers.
+
     This algorithm can't be sped up by specifying a sink node. It is still included for consistency between
     the shortest path algorithms.
 
+    Nodes can be given as Node objects or as the identifiers they were created with, as in dijkstra. Nodes
+    that can't be reached have distance None. For a CSRGraph, nodes are indices and lists are returned.
+
     '_allow_direct_edge' is a parameter useful for the algorithm that finds non-reducible cycles.
     """
-    distance = dict()
-    predecessor = dict()
-    edges = list()
-    for edge in graph.edges:
-        if (edge.source == source and edge.sink == sink) or (edge.sink == source and edge.source == sink) \
-                and not _allow_direct_edge:
-            continue
-        edges.append(edge)
-    for node in graph.yield_nodes():
-        distance[node] = None
-        predecessor[node] = None
-    distance[source] = 0
+    if isinstance(graph, CSRGraph):
+        csr = graph
+        source = graph.node_index(source)
+        if sink is not None:
+            sink = graph.node_index(sink)
+    else:
+        nodes, by_identifier = _resolve_nodes(graph, source if sink is None else [source, sink])
+        csr = CSRGraph.from_graph(graph)
+        source = csr.index[nodes[0]]
+        sink = csr.index[nodes[1]] if sink is not None else None
+
+    relax = _bellman_ford_queue if spfa else _bellman_ford_passes
+    try:
+        distance, predecessor = relax(csr, source, sink, _allow_direct_edge)
+    except NegativeCycleError as error:
+        if isinstance(graph, CSRGraph):
+            raise
+        cycle = [csr.nodes[node] for node in error.cycle]
+        if by_identifier:
+            cycle = [node.identifier for node in cycle]
+        raise NegativeCycleError(cycle) from None
+
+    if isinstance(graph, CSRGraph):
+        return distance, predecessor
+    nodes = csr.nodes
+    distance = dict(zip(nodes, distance))
+    predecessor = {node: (nodes[pred] if pred is not None else None) for node, pred in zip(nodes, predecessor)}
+    if by_identifier:
+        return _to_identifiers(distance, predecessor)
+    return distance, predecessor
 
-    for _ in range(len(graph) - 1):
-        for edge in edges:
-            if distance[edge.source] is not None:
-                if distance[edge.sink] is None or distance[edge.source] + edge.weight < distance[edge.sink]:
-                    distance[edge.sink] = distance[edge.source] + edge.weight
-                    predecessor[edge.sink] = edge.source
-            if not graph.directed:
-                if distance[edge.sink] is not None:
-                    if distance[edge.source] is None or distance[edge.sink] + edge.weight < distance[edge.source]:
-                        distance[edge.source] = distance[edge.sink] + edge.weight
-                        predecessor[edge.source] = edge.sink
-
-    for edge in edges:
-        if distance[edge.source] and distance[edge.source] + edge.weight < distance[edge.sink]:
-            raise ValueError('Graph contains negative cycles!')
-        if not graph.directed:
-            if distance[edge.sink] and distance[edge.sink] + edge.weight < distance[edge.source]:
-                raise ValueError('Graph contains negative cycles!')
 
+def _skipped_arc(source, sink, allow_direct_edge):
+    """
+    Returns the (node, adj_node) pairs of the direct edge between 'source' and 'sink' if that edge should not
+    be used, an empty tuple otherwise.
+    """
+    if allow_direct_edge or sink is None:
+        return ()
+    return (source, sink), (sink, source)
+
+
+def _bellman_ford_passes(graph, source, sink, allow_direct_edge):
+    offsets, neighbors, weights = graph.offsets, graph.neighbors, graph.weights
+    skipped = _skipped_arc(source, sink, allow_direct_edge)
+    node_count = len(graph)
+    distance = [None] * node_count
+    predecessor = [None] * node_count
+    distance[source] = 0
+
+    # after pass k all shortest paths with at most k edges are known, so a pass without changes is the last.
+    # Changes after node_count - 1 passes mean there is a negative cycle, which then (or after a few more
+    # passes) shows up as a cycle of predecessor pointers.
+    passes = 0
+    while True:
+        changed = False
+        for node in range(node_count):
+            node_distance = distance[node]
+            if node_distance is None:
+                continue
+            for slot in range(offsets[node], offsets[node + 1]):
+                adj_node = neighbors[slot]
+                new_dist = node_distance + weights[slot]
+                if (distance[adj_node] is None or new_dist < distance[adj_node]) and \
+                        (node, adj_node) not in skipped:
+                    distance[adj_node] = new_dist
+                    predecessor[adj_node] = node
+                    changed = True
+        if not changed:
+            return distance, predecessor
+        passes += 1
+        if passes >= node_count:
+            cycle_node = _find_predecessor_cycle(predecessor)
+            if cycle_node is not None:
+                raise NegativeCycleError(_predecessor_cycle(predecessor, cycle_node))
+
+
+def _bellman_ford_queue(graph, source, sink, allow_direct_edge):
+    offsets, neighbors, weights = graph.offsets, graph.neighbors, graph.weights
+    skipped = _skipped_arc(source, sink, allow_direct_edge)
+    node_count = len(graph)
+    distance = [None] * node_count
+    predecessor = [None] * node_count
+    queued = bytearray(node_count)
+    distance[source] = 0
+    queued[source] = 1
+    fifo = deque([source])
+    relaxations = 0
+
+    while fifo:
+        node = fifo.popleft()
+        queued[node] = 0
+        node_distance = distance[node]
+        for slot in range(offsets[node], offsets[node + 1]):
+            adj_node = neighbors[slot]
+            new_dist = node_distance + weights[slot]
+            if (distance[adj_node] is None or new_dist < distance[adj_node]) and (node, adj_node) not in skipped:
+                distance[adj_node] = new_dist
+                predecessor[adj_node] = node
+                if not queued[adj_node]:
+                    queued[adj_node] = 1
+                    fifo.append(adj_node)
+                relaxations += 1
+                # a cycle of predecessor pointers is always a negative cycle, and with a negative cycle one
+                # is always there after a finite number of relaxations (Cherkassky and Goldberg); looking
+                # for it every node_count relaxations costs amortized O(1) per relaxation
+                if relaxations == node_count:
+                    relaxations = 0
+                    cycle_node = _find_predecessor_cycle(predecessor)
+                    if cycle_node is not None:
+                        raise NegativeCycleError(_predecessor_cycle(predecessor, cycle_node))
     return distance, predecessor
 
 
+def _find_predecessor_cycle(predecessor):
+    """
+    Returns a node on a cycle of predecessor pointers, or None if there is no such cycle. Every node is
+    walked over once.
+    """
+    walk = array('l', [-1]) * len(predecessor)
+    for start in range(len(predecessor)):
+        node = start
+        while node is not None and walk[node] == -1:
+            walk[node] = start
+            node = predecessor[node]
+        if node is not None and walk[node] == start:
+            return node
+    return None
+
+
+def _predecessor_cycle(predecessor, node):
+    """
+    Returns the cycle of predecessor pointers through 'node', in the direction of the edges.
+    """
+    cycle = [node]
+    other_node = predecessor[node]
+    while other_node != node:
+        cycle.append(other_node)
+        other_node = predecessor[other_node]
+    cycle.reverse()
+    return cycle
+
+
 ############################################################
 #                          BFS                             #
 ############################################################
 
 
-def bfs_shortest_paths(graph, source, sink=None, _allow_direct_edge=True):
+def bfs_shortest_paths(graph, source, sink=None, _allow_direct_edge=True, targets=None):
     """
     Breadth-first search for finding the shortest paths in an unweighted or weighted graph starting with
     node 'source'. This algorithm finds the paths with the least amount of edges to the other nodes. It does
     not take edge weight into account and is more efficient than Dijkstra and Bellman-Ford.
-    Worst case performance: O(V)
+    Worst case performance: O(V+E)
 
-    If a node 'sink' is specified, the algorithm terminates if the weight of the shortest path to that
-    node is known. This is useful if you only need to know the path to that node.
+    'source' can also be a list, tuple or set of nodes, as in dijkstra. If a node 'sink' or a collection of
+    nodes 'targets' is specified, the algorithm terminates once the paths to all of them are known.
+
+    Only the nodes that were reached are in the returned dicts; the sources have no predecessor. Nodes can be
+    given as Node objects or as identifiers, as in dijkstra. For a CSRGraph the distances and predecessors
+    are lists, with None for the nodes that were not reached.
 
     '_allow_direct_edge' is a parameter useful for the algorithm that finds non-reducible cycles.
     """
-    visited_nodes = {source}
+    if isinstance(graph, CSRGraph):
+        return _bfs_csr(graph, source, sink, _allow_direct_edge, targets)
+
+    sources, by_identifier = _resolve_nodes(graph, source)
+    remaining_targets = set()
+    if targets is not None:
+        remaining_targets.update(graph.get_node(node) for node in targets)
+    if sink is not None:
+        sink = graph.get_node(sink)
+        remaining_targets.add(sink)
+    skip_direct_edge = sink is not None and not _allow_direct_edge
+    source_set = set(sources)
+    remaining_targets.difference_update(source_set)
+
+    distance = dict.fromkeys(sources, 0)
     predecessor = dict()
-    distance = {source: 0}
-    bfs_queue = Queue()
-    bfs_queue.put(source)
-    while not bfs_queue.empty():
-        current_node = bfs_queue.get()
-        for adj_node in graph.adj_nodes(current_node):
-            if adj_node == sink and current_node == source and not _allow_direct_edge:
+    bfs_queue = deque(sources)
+    while bfs_queue and (remaining_targets or sink is None and targets is None):
+        current_node = bfs_queue.popleft()
+        next_distance = distance[current_node] + 1
+        for edge in current_node.edges:
+            adj_node = edge.get_other_node(current_node)
+            if adj_node in distance:
                 continue
-            if adj_node not in visited_nodes:
-                predecessor[adj_node] = current_node
-                distance[adj_node] = distance[current_node] + 1
-                visited_nodes.add(adj_node)
-                bfs_queue.put(adj_node)
-            if adj_node == sink:
-                if _allow_direct_edge or current_node != source:
+            if skip_direct_edge and adj_node == sink and current_node in source_set:
+                continue
+            distance[adj_node] = next_distance
+            predecessor[adj_node] = current_node
+            bfs_queue.append(adj_node)
+            if adj_node in remaining_targets:
+                remaining_targets.remove(adj_node)
+                if not remaining_targets:
                     break
+
+    if by_identifier:
+        distance = {node.identifier: node_distance for node, node_distance in distance.items()}
+        predecessor = {node.identifier: pred.identifier for node, pred in predecessor.items()}
+    return distance, predecessor
+
+
+def _bfs_csr(graph, source, sink, allow_direct_edge, targets):
+    sources = _csr_nodes(graph, source)
+    offsets, neighbors = graph.offsets, graph.neighbors
+    remaining_targets = set()
+    if targets is not None:
+        remaining_targets.update(graph.node_index(node) for node in targets)
+    if sink is not None:
+        sink = graph.node_index(sink)
+        remaining_targets.add(sink)
+    skip_direct_edge = sink is not None and not allow_direct_edge
+    source_set = set(sources)
+    remaining_targets.difference_update(source_set)
+    stop_early = sink is not None or targets is not None
+
+    distance = [None] * len(graph)
+    predecessor = [None] * len(graph)
+    for node in sources:
+        distance[node] = 0
+    bfs_queue = deque(sources)
+    if stop_early and not remaining_targets:
+        return distance, predecessor
+    while bfs_queue:
+        current_node = bfs_queue.popleft()
+        next_distance = distance[current_node] + 1
+        for slot in range(offsets[current_node], offsets[current_node + 1]):
+            adj_node = neighbors[slot]
+            if distance[adj_node] is not None:
+                continue
+            if skip_direct_edge and adj_node == sink and current_node in source_set:
+                continue
+            predecessor[adj_node] = current_node
+            distance[adj_node] = next_distance
+            bfs_queue.append(adj_node)
+            if adj_node in remaining_targets:
+                remaining_targets.remove(adj_node)
+                if not remaining_targets:
+                    return distance, predecessor
     return distance, predecessor
 
 
+def bidirectional_bfs(graph, source, sink):
+    """
+    Finds a path with the least amount of edges from 'source' to 'sink' by searching from both ends at once,
+    always expanding the smaller frontier by one level. Only the nodes near the two balls around the source
+    and the sink are visited, which is much less than a full search in large graphs.
+
+    Returns a list of nodes starting with 'source' and ending with 'sink', or an empty list if there is no
+    path. Nodes can be given as Node objects or identifiers, as in dijkstra; for a CSRGraph they are indices.
+    The search backwards needs the incoming edges of directed graphs: for a CSRGraph they are taken from
+    graph.transpose(), for a Graph they are collected from all edges first.
+    """
+    if isinstance(graph, CSRGraph):
+        source, sink = graph.node_index(source), graph.node_index(sink)
+        forward = _csr_neighbors(graph)
+        backward = _csr_neighbors(graph.transpose()) if graph.directed else forward
+        return _bidirectional_bfs(forward, backward, source, sink)
+
+    (source, sink), by_identifier = _resolve_nodes(graph, [source, sink])
+    forward = _node_neighbors
+    backward = forward
+    if graph.directed:
+        incoming = dict()
+        for edge in graph.yield_edges():
+            incoming.setdefault(edge.sink, list()).append(edge.source)
+        backward = lambda node: incoming.get(node, ())
+    path = _bidirectional_bfs(forward, backward, source, sink)
+    if by_identifier:
+        path = [node.identifier for node in path]
+    return path
+
+
+def _csr_neighbors(graph):
+    offsets, neighbors = graph.offsets, graph.neighbors
+    return lambda node: neighbors[offsets[node]:offsets[node + 1]]
+
+
+def _node_neighbors(node):
+    return [edge.get_other_node(node) for edge in node.edges]
+
+
+def _bidirectional_bfs(forward, backward, source, sink):
+    if source == sink:
+        return [source]
+    # the predecessors found by the forward search and the successors found by the backward search
+    predecessor = {source: None}
+    successor = {sink: None}
+    forward_frontier = [source]
+    backward_frontier = [sink]
+    meeting_node = None
+    while forward_frontier and backward_frontier and meeting_node is None:
+        # All nodes on the frontier have the same distance, so the first node that is reached from both
+        # sides lies on a shortest path.
+        if len(forward_frontier) <= len(backward_frontier):
+            frontier, adj_nodes, found, other_found = forward_frontier, forward, predecessor, successor
+        else:
+            frontier, adj_nodes, found, other_found = backward_frontier, backward, successor, predecessor
+        next_frontier = list()
+        for node in frontier:
+            for adj_node in adj_nodes(node):
+                if adj_node in found:
+                    continue
+                found[adj_node] = node
+                if adj_node in other_found:
+                    meeting_node = adj_node
+                    break
+                next_frontier.append(adj_node)
+            if meeting_node is not None:
+                break
+        if frontier is forward_frontier:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+
+    if meeting_node is None:
+        return []
+    path = list()
+    node = meeting_node
+    while node is not None:
+        path.append(node)
+        node = predecessor[node]
+    path.reverse()
+    node = successor[meeting_node]
+    while node is not None:
+        path.append(node)
+        node = successor[node]
+    return path
+
+
+def bfs_levels(graph, source):
+    """
+    Level-synchronous breadth-first search on a CSRGraph: all nodes of a level are expanded at once into the
+    next level. 'source' can be a node index or a collection of them. With NumPy, the expansion of a level is
+    vectorized over the CSR arrays; without it, the levels are expanded in Python.
+
+    Returns the distance of every node in edges, -1 for nodes that can't be reached, as a NumPy array if
+    NumPy is available and an array('l') otherwise.
+    """
+    sources = _csr_nodes(graph, source)
+    try:
+        import numpy
+    except ImportError:
+        return _bfs_levels_python(graph, sources)
+
+    offsets, neighbors = (numpy.asarray(buffer) for buffer in (graph.offsets, graph.neighbors))
+    distance = numpy.full(len(graph), -1, dtype=numpy.int64)
+    frontier = numpy.unique(numpy.asarray(sources, dtype=numpy.int64))
+    distance[frontier] = 0
+    level = 0
+    while frontier.size:
+        level += 1
+        starts = offsets[frontier]
+        counts = offsets[frontier + 1] - starts
+        total = int(counts.sum())
+        if not total:
+            break
+        # the slots of all neighbors of the frontier: starts[i], starts[i] + 1, ... for every frontier node
+        slots = numpy.arange(total) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+        adj_nodes = neighbors[slots]
+        adj_nodes = numpy.unique(adj_nodes[distance[adj_nodes] < 0])
+        distance[adj_nodes] = level
+        frontier = adj_nodes
+    return distance
+
+
+def _bfs_levels_python(graph, sources):
+    offsets, neighbors = graph.offsets, graph.neighbors
+    distance = array('l', [-1]) * len(graph)
+    frontier = list()
+    for node in sources:
+        if distance[node] < 0:
+            distance[node] = 0
+            frontier.append(node)
+    level = 0
+    while frontier:
+        level += 1
+        next_frontier = list()
+        for node in frontier:
+            for adj_node in neighbors[offsets[node]:offsets[node + 1]]:
+                if distance[adj_node] < 0:
+                    distance[adj_node] = level
+                    next_frontier.append(adj_node)
+        frontier = next_frontier
+    return distance
+
+
+############################################################
+#               All-pairs shortest paths                   #
+############################################################
+
+
+def distance_matrix(graph, weighted=False):
+    """
+    Returns the shortest path distance between every pair of nodes as an n×n NumPy array, with the nodes in
+    the order of graph.yield_nodes() (by index for a CSRGraph). Requires NumPy.
+
+    Without 'weighted' the distances count edges. They are found with a breadth-first search from all nodes
+    at once: the frontier is an array of (source, node) pairs and every level is one vectorized expansion of
+    all pairs over the CSR arrays, so the total work is O(VE) like a search from every node. The matrix has
+    the smallest unsigned type that fits the node count (uint8 up to 254 nodes, then uint16 and uint32), and
+    unreachable pairs hold the largest value of that type.
+
+    With 'weighted' the distances are sums of edge weights, found with the Floyd-Warshall algorithm as n
+    vectorized row updates. The matrix is float64 with inf for unreachable pairs. A negative cycle raises a
+    ValueError.
+    """
+    import numpy
+    csr = graph if isinstance(graph, CSRGraph) else CSRGraph.from_graph(graph)
+    node_count = len(csr)
+    if weighted:
+        return _floyd_warshall(csr)
+
+    dtype = numpy.uint8 if node_count < 255 else numpy.uint16 if node_count < 65535 else numpy.uint32
+    unreachable = numpy.iinfo(dtype).max
+    distance = numpy.full((node_count, node_count), unreachable, dtype=dtype)
+    numpy.fill_diagonal(distance, 0)
+    offsets, neighbors, _, _ = csr.to_numpy()
+    offsets = offsets.astype(numpy.int64)
+    neighbors = neighbors.astype(numpy.int64)
+
+    sources = numpy.arange(node_count, dtype=numpy.int64)
+    nodes = sources
+    level = 0
+    while len(nodes):
+        level += 1
+        starts = offsets[nodes]
+        counts = offsets[nodes + 1] - starts
+        total = int(counts.sum())
+        if not total:
+            break
+        # the slots of all neighbors of the frontier: starts[i], starts[i] + 1, ... for every pair i
+        slots = numpy.arange(total) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+        sources = numpy.repeat(sources, counts)
+        nodes = neighbors[slots]
+        new = distance[sources, nodes] == unreachable
+        keys = numpy.unique(sources[new] * node_count + nodes[new])
+        sources, nodes = numpy.divmod(keys, node_count)
+        distance[sources, nodes] = level
+    return distance
+
+
+def _floyd_warshall(graph):
+    import numpy
+    node_count = len(graph)
+    offsets, neighbors, weights, _ = graph.to_numpy()
+    distance = numpy.full((node_count, node_count), numpy.inf)
+    sources = numpy.repeat(numpy.arange(node_count), numpy.diff(offsets))
+    numpy.minimum.at(distance, (sources, neighbors), weights.astype(numpy.float64))
+    numpy.fill_diagonal(distance, numpy.minimum(distance.diagonal(), 0))
+    for node in range(node_count):
+        numpy.minimum(distance, distance[:, node, None] + distance[None, node, :], out=distance)
+    if (distance.diagonal() < 0).any():
+        raise ValueError('Graph contains negative cycles!')
+    return distance
+
+
 ############################################################
 #            generalizing path find algorithm              #
 ############################################################
@@ -282,22 +974,28 @@ def bfs_shortest_paths(graph, source, sink=None, _allow_direct_edge=True):
 def find_shortest_path(graph, source, sink, alg='bellmanford', _allow_direct_edge=True):
     """
     'alg' is the parameter that determines what path-finding algorithm is used. Valid options are; 'dijkstra',
-    'bellmanford', and 'bfs'. Note: bfs does not take edge weight into account but finds the path with the
-    lowest amount of edges.
+    'bellmanford', 'bfs' and 'bidirectional'. Note: bfs does not take edge weight into account but finds the
+    path with the lowest amount of edges. 'bidirectional' finds such a path too, searching from both ends; it
+    always allows the direct edge.
 
     '_allow_direct_edge' determines if an edge from node_from to node_to also counts as valid path. This option
     is essential for finding non reducible cycles.
 
     returns a list of nodes starting with node_from, ending with node_to.
     """
+    if alg.lower() == 'bidirectional':
+        return bidirectional_bfs(graph, source, sink)
     algorithm = _choose_path_find_algorithm(alg)
     _, predecessors = algorithm(graph, source, sink=sink, _allow_direct_edge=_allow_direct_edge)
     node = sink
     path = [node]
     while node != source:
-        if node not in predecessors:
+        try:
+            node = predecessors[node]
+        except KeyError:
+            return []
+        if node is None:
             return []
-        node = predecessors[node]
         path.append(node)
     path.reverse()
     return path
@@ -315,60 +1013,307 @@ def _choose_path_find_algorithm(string):
         raise ValueError('"' + string + '" is not recognized as a path finding algorithm. Valid options are:\n'
                                         ' - dijkstra\n'
                                         ' - bellmanford\n'
-                                        ' - bfs')
+                                        ' - bfs\n'
+                                        ' - bidirectional')
     return algorithm
 
 
 ############################################################
-#                Ford-Fulkerson algorithm                  #
+#                  Maximum flow algorithms                 #
 ############################################################
 
 
+# The result of max_flow: the value of the maximum flow, the flow through every edge, the edges of a minimum
+# cut as (node, adj_node) pairs from the source side to the sink side, and the nodes on the source side.
+MaxFlow = namedtuple('MaxFlow', ['value', 'flows', 'min_cut', 'source_side'])
+
+
+def max_flow(graph, source, sink, algorithm='dinic', force_unweighted=False):
+    """
+    Finds the maximum flow from 'source' to 'sink' in a flow network graph, with the edge weights as
+    capacities, and a minimum cut: the edges that are the bottleneck for the maximum flow. The cut is taken
+    between the nodes that are reachable from the source in the residual graph and all other nodes, so its
+    capacity equals the maximum flow. In an undirected graph every edge can carry flow in both directions.
+
+    'algorithm' is 'dinic' (Dinic's algorithm, O(V²E)) or 'push_relabel' (FIFO push-relabel with global
+    relabeling, O(V³)). If 'force_unweighted' is true, all edges have capacity one.
+
+    Returns a MaxFlow. For a Graph, 'flows' is a dict from Edge to flow and the nodes are Node objects, or
+    identifiers if 'source' and 'sink' were given by identifier. For a CSRGraph, 'flows' is a list indexed by
+    edge id and the nodes are indices. In an undirected graph, the flow of an edge is the amount that passes
+    through it in either direction.
+    """
+    if isinstance(graph, CSRGraph):
+        csr = graph
+        source, sink = graph.node_index(source), graph.node_index(sink)
+    else:
+        (source_node, sink_node), by_identifier = _resolve_nodes(graph, [source, sink])
+        csr = CSRGraph.from_graph(graph)
+        source, sink = csr.index[source_node], csr.index[sink_node]
+    if source == sink:
+        raise ValueError('The source and the sink should be different nodes.')
+    if algorithm not in _MAX_FLOW_ALGORITHMS:
+        raise ValueError('"' + str(algorithm) + '" is not a valid max-flow algorithm.')
+
+    network = _flow_network(csr, force_unweighted)
+    value = _MAX_FLOW_ALGORITHMS[algorithm](network, source, sink)
+    flows, min_cut, source_side = _flow_result(csr, network, source)
+
+    if not isinstance(graph, CSRGraph):
+        nodes = csr.nodes
+        flows = dict(zip(csr.edges, flows))
+        if by_identifier:
+            nodes = [node.identifier for node in nodes]
+        min_cut = [(nodes[node], nodes[adj_node]) for node, adj_node in min_cut]
+        source_side = {nodes[node] for node in source_side}
+    return MaxFlow(value, flows, min_cut, source_side)
+
+
 def ford_fulkerson(graph, source, sink, force_unweighted=False):
     """
-    The Ford-Fulkerson algorithm finds the maximum flow between the source node and the sink node in a
-    flow network graph. It also finds the 'minimum cut', a list of nodes that are the bottleneck for the
-    maximum flow.
+    Finds the maximum flow between the source node and the sink node in a flow network graph, and the
+    'minimum cut', a list of (node, adj_node) edges that are the bottleneck for the maximum flow. This is
+    max_flow with Dinic's algorithm; see max_flow for the flow through every edge.
 
     If 'force_unweighted' is true, all edges have flow rate one.
     """
-    flow = dict()
-    capacity = dict()
-    backwards_edges = set()
-    for node in graph:
-        for adj_node, edge_weight in graph[node]:
-            if not graph.weighted or force_unweighted:
-                edge_weight = 1
-            capacity[(node, adj_node)] = edge_weight
-            flow[(node, adj_node)] = 0
-            flow[(adj_node, node)] = 0
-            backwards_edges.add((adj_node, node))
-
-    path = _find_ford_fulkerson_path(graph, source, sink, flow, [], force_unweighted)
-    while path is not None:
-        residuals = [capacity[edge] - flow[edge] for edge in path]
-        min_flow = min(residuals)
-        for node_from, node_to in path:
-            flow[(node_from, node_to)] += min_flow
-            flow[(node_to, node_from)] -= min_flow
-        path = _find_ford_fulkerson_path(graph, source, sink, flow, [])
-
-    min_cut = [edge for edge, flow_rate in flow.items() if edge in capacity and capacity[edge] == flow_rate]
-    max_flow = sum(flow[(source, adj_node)] for adj_node, _ in graph[source])
-    return max_flow, min_cut
-
-
-def _find_ford_fulkerson_path(graph, source, sink, flow, path, force_unweighted=False):
-    if source == sink:
-        return path
-    for adj_node, edge_weight in graph[source]:
-        if not graph.weighted or force_unweighted:
-            edge_weight = 1
-        residual = edge_weight - flow[(source, adj_node)]
-        if residual > 0 and (source, adj_node) not in path:
-            result = _find_ford_fulkerson_path(graph, adj_node, sink, flow, path + [(source, adj_node)])
-            if result is not None:
-                return result
+    result = max_flow(graph, source, sink, force_unweighted=force_unweighted)
+    return result.value, result.min_cut
+
+
+def _flow_network(graph, force_unweighted):
+    """
+    Builds the residual graph of a CSRGraph. Every edge gets an arc in its own direction and a reverse arc,
+    both stored in CSR layout: the arcs of node n are first[n] up to first[n + 1], 'pair' holds the reverse
+    of every arc and 'edge_arcs' the forward arc of every edge (-1 for self-loops, which cannot carry flow).
+    In a directed graph the reverse arc starts with capacity zero, in an undirected graph both arcs get the
+    capacity of the edge.
+
+    Returns first, heads, residual, pair, edge_arcs and the capacities of the edges.
+    """
+    node_count = len(graph)
+    offsets, neighbors, weights, edge_ids = graph.offsets, graph.neighbors, graph.weights, graph.edge_ids
+    unit_capacity = force_unweighted or not graph.weighted
+    typecode = 'l' if unit_capacity else weights.format
+
+    edge_count = graph.edge_count
+    tails = array('l', [0]) * (2 * edge_count)
+    capacities = array(typecode, [0]) * edge_count
+    has_arcs = bytearray(edge_count)
+    # logical arc 2e is the forward arc of edge e and 2e + 1 its reverse
+    for node in range(node_count):
+        for slot in range(offsets[node], offsets[node + 1]):
+            adj_node = neighbors[slot]
+            edge_id = edge_ids[slot]
+            if adj_node == node or has_arcs[edge_id]:
+                continue
+            has_arcs[edge_id] = 1
+            tails[2 * edge_id] = node
+            tails[2 * edge_id + 1] = adj_node
+            capacities[edge_id] = 1 if unit_capacity else weights[slot]
+
+    first = array('l', [0]) * (node_count + 1)
+    for edge_id in range(edge_count):
+        if has_arcs[edge_id]:
+            first[tails[2 * edge_id] + 1] += 1
+            first[tails[2 * edge_id + 1] + 1] += 1
+    for node in range(node_count):
+        first[node + 1] += first[node]
+
+    arc_count = first[node_count]
+    heads = array('l', [0]) * arc_count
+    residual = array(typecode, [0]) * arc_count
+    pair = array('l', [0]) * arc_count
+    edge_arcs = array('l', [-1]) * edge_count
+    fill = array('l', first)
+    for edge_id in range(edge_count):
+        if not has_arcs[edge_id]:
+            continue
+        tail, head = tails[2 * edge_id], tails[2 * edge_id + 1]
+        forward_arc, reverse_arc = fill[tail], fill[head]
+        fill[tail] += 1
+        fill[head] += 1
+        heads[forward_arc], heads[reverse_arc] = head, tail
+        pair[forward_arc], pair[reverse_arc] = reverse_arc, forward_arc
+        residual[forward_arc] = capacities[edge_id]
+        if not graph.directed:
+            residual[reverse_arc] = capacities[edge_id]
+        edge_arcs[edge_id] = forward_arc
+    return first, heads, residual, pair, edge_arcs, capacities
+
+
+def _dinic(network, source, sink):
+    """
+    Dinic's algorithm: a breadth-first search labels the nodes with their distance from the source in the
+    residual graph, then a depth-first search saturates all shortest augmenting paths (a blocking flow).
+    'current' remembers the next arc to try for every node, so no arc is scanned twice within a phase.
+    """
+    first, heads, residual, pair = network[:4]
+    node_count = len(first) - 1
+    total_flow = 0
+    while True:
+        level = array('l', [-1]) * node_count
+        level[source] = 0
+        bfs_queue = deque([source])
+        while bfs_queue:
+            node = bfs_queue.popleft()
+            next_level = level[node] + 1
+            for arc in range(first[node], first[node + 1]):
+                adj_node = heads[arc]
+                if residual[arc] > 0 and level[adj_node] < 0:
+                    level[adj_node] = next_level
+                    bfs_queue.append(adj_node)
+        if level[sink] < 0:
+            return total_flow
+
+        current = array('l', first)
+        path = array('l')
+        node = source
+        while True:
+            if node == sink:
+                pushed = min(residual[arc] for arc in path)
+                for arc in path:
+                    residual[arc] -= pushed
+                    residual[pair[arc]] += pushed
+                total_flow += pushed
+                # continue from the tail of the first saturated arc
+                for i, arc in enumerate(path):
+                    if not residual[arc]:
+                        break
+                del path[i:]
+                node = heads[pair[arc]]
+                continue
+
+            arc, end = current[node], first[node + 1]
+            next_level = level[node] + 1
+            while arc < end and not (residual[arc] > 0 and level[heads[arc]] == next_level):
+                arc += 1
+            current[node] = arc
+            if arc < end:
+                path.append(arc)
+                node = heads[arc]
+            elif node == source:
+                break
+            else:
+                # a dead end: retreat and skip the arc that led here
+                arc = path.pop()
+                node = heads[pair[arc]]
+                current[node] += 1
+
+
+def _push_relabel(network, source, sink):
+    """
+    The push-relabel algorithm with FIFO selection of active nodes. Heights are recomputed exactly with a
+    breadth-first search (global relabeling) at the start and after every node_count relabels.
+    """
+    first, heads, residual, pair = network[:4]
+    node_count = len(first) - 1
+    excess = [0] * node_count
+    height = array('l', [0]) * node_count
+    active = deque()
+
+    for arc in range(first[source], first[source + 1]):
+        capacity = residual[arc]
+        adj_node = heads[arc]
+        if capacity > 0 and adj_node != source:
+            residual[arc] = 0
+            residual[pair[arc]] += capacity
+            if not excess[adj_node] and adj_node != sink:
+                active.append(adj_node)
+            excess[adj_node] += capacity
+            excess[source] -= capacity
+
+    _global_relabel(network, height, source, sink)
+    current = array('l', first)
+    relabels = 0
+    while active:
+        if relabels >= node_count:
+            _global_relabel(network, height, source, sink)
+            current = array('l', first)
+            relabels = 0
+        node = active.popleft()
+        arc, end = current[node], first[node + 1]
+        node_height = height[node]
+        while excess[node] > 0:
+            if arc == end:
+                node_height = min(height[heads[arc]] for arc in range(first[node], end) if residual[arc] > 0) + 1
+                height[node] = node_height
+                arc = first[node]
+                relabels += 1
+                continue
+            adj_node = heads[arc]
+            if residual[arc] > 0 and node_height == height[adj_node] + 1:
+                pushed = min(excess[node], residual[arc])
+                residual[arc] -= pushed
+                residual[pair[arc]] += pushed
+                excess[node] -= pushed
+                if not excess[adj_node] and adj_node != source and adj_node != sink:
+                    active.append(adj_node)
+                excess[adj_node] += pushed
+                if not residual[arc]:
+                    arc += 1
+            else:
+                arc += 1
+        current[node] = arc
+    return excess[sink]
+
+
+def _global_relabel(network, height, source, sink):
+    """
+    Sets the height of every node to its distance to the sink in the residual graph, or, for nodes that
+    cannot reach the sink, to node_count plus their distance to the source.
+    """
+    first, heads, residual, pair = network[:4]
+    node_count = len(first) - 1
+    unreached = 2 * node_count
+    height[:] = array('l', [unreached]) * node_count
+    height[sink] = 0
+    height[source] = node_count
+    for root in (sink, source):
+        bfs_queue = deque([root])
+        while bfs_queue:
+            node = bfs_queue.popleft()
+            next_height = height[node] + 1
+            for arc in range(first[node], first[node + 1]):
+                adj_node = heads[arc]
+                if height[adj_node] == unreached and residual[pair[arc]] > 0:
+                    height[adj_node] = next_height
+                    bfs_queue.append(adj_node)
+
+
+_MAX_FLOW_ALGORITHMS = {'dinic': _dinic, 'push_relabel': _push_relabel}
+
+
+def _flow_result(graph, network, source):
+    """
+    Returns the flow through every edge, the minimum cut as (node, adj_node) pairs and the source side of
+    the cut, from the residual graph of a maximum flow.
+    """
+    first, heads, residual, pair, edge_arcs, capacities = network
+    reached = bytearray(len(graph))
+    reached[source] = 1
+    bfs_queue = deque([source])
+    while bfs_queue:
+        node = bfs_queue.popleft()
+        for arc in range(first[node], first[node + 1]):
+            adj_node = heads[arc]
+            if residual[arc] > 0 and not reached[adj_node]:
+                reached[adj_node] = 1
+                bfs_queue.append(adj_node)
+
+    flows = [0] * len(edge_arcs)
+    min_cut = list()
+    for edge_id, arc in enumerate(edge_arcs):
+        if arc < 0:
+            continue
+        flows[edge_id] = abs(capacities[edge_id] - residual[arc])
+        tail, head = heads[pair[arc]], heads[arc]
+        if reached[tail] and not reached[head]:
+            min_cut.append((tail, head))
+        elif not graph.directed and reached[head] and not reached[tail]:
+            min_cut.append((head, tail))
+    source_side = {node for node in range(len(graph)) if reached[node]}
+    return flows, min_cut, source_side
 
 
 ############################################################
@@ -379,9 +1324,8 @@ def _find_ford_fulkerson_path(graph, source, sink, flow, path, force_unweighted=
 def yield_end_nodes(graph):
     if graph.directed:
         raise ValueError('Graph should be undirected.')
-    for node in graph:
-        edges = graph[node]
-        if len(edges) == 1:
+    for node in graph.yield_nodes():
+        if _degree(node) == 1:
             yield node
 
 
@@ -401,29 +1345,23 @@ def get_node_degrees(graph):
         return _get_node_degrees_undirected(graph)
 
 
+def _degree(node):
+    # a self-loop adds two to the degree, but is stored once
+    return sum(2 if edge.source is edge.sink else 1 for edge in node.edges)
+
+
 def _get_node_degrees_undirected(graph):
-    degrees = dict()
-    for node in graph:
-        edges = graph[node]
-        degrees[node] = len(edges)
-    return degrees
+    return {node: _degree(node) for node in graph.yield_nodes()}
 
 
 def _get_node_degrees_directed(graph):
-    out_degrees = dict()
-    in_degrees = dict()
-    if graph.directed:
-        for node in graph:
-            in_degrees[node] = 0
-    for node in graph:
-        edges = graph[node]
-        out_degrees[node] = len(edges)
-        for other_node, _ in graph:
-            in_degrees[other_node] += 1
-    in_out_degrees = dict()
-    for node in out_degrees:
-        in_out_degrees[node] = (out_degrees[node], in_degrees[node])
-    return in_out_degrees
+    """
+    Returns a dict mapping every node to its (out-degree, in-degree).
+    """
+    in_degrees = {node: 0 for node in graph.yield_nodes()}
+    for edge in graph.yield_edges():
+        in_degrees[edge.sink] += 1
+    return {node: (len(node.edges), in_degree) for node, in_degree in in_degrees.items()}
 
 
 ############################################################
@@ -431,74 +1369,172 @@ def _get_node_degrees_directed(graph):
 ############################################################
 
 
-def get_all_degree2_chains(graph):
+def reduce_graph(graph):
     """
-    Works unless the graph is a cycle containing only degree-2 nodes. Also does not work if graph is a chain with
-    self edging nodes at both ends.
+    Reduces an undirected graph to what matters for cycles: the trees that hang off it are removed
+    (_remove_degree1_nodes) and every chain of degree-2 nodes is replaced by a single edge with the length
+    of the chain as weight (_merge_degree2_nodes). The cycles of the reduced graph correspond one to one to
+    the cycles of 'graph', with the same length by edge weight, and _demerge_degree2_nodes maps them back.
+
+    Returns the reduced graph and a dict that maps its edges to their chains.
+    """
+    return _merge_degree2_nodes(graph, _remove_degree1_nodes(graph))
+
+
+def get_all_degree2_chains(graph, nodes=None):
+    """
+    Splits the edges of an undirected graph into chains: paths whose inner nodes have degree 2 and whose
+    end nodes do not. A cycle of only degree-2 nodes becomes a chain that starts and ends at the same node.
+    Only the nodes in 'nodes' (all nodes by default) and the edges between them are used.
     :param graph: The graph containing all the nodes and edges.
-    :return: list containing lists of chained nodes. First and last elements are not-degree-2 nodes
+    :param nodes: The nodes to use, e.g. from _remove_degree1_nodes.
+    :return: list containing lists of chained nodes. Every edge between the nodes is in exactly one chain.
     """
     if graph.directed:
         raise ValueError('Graph should be undirected.')
 
-    node_degrees = get_node_degrees(graph)
-    marked_nodes = set()
+    nodes = list(graph.yield_nodes()) if nodes is None else list(nodes)
+    node_set = set(nodes)
+    degrees = {node: sum(2 if edge.source is edge.sink else 1 for edge in node.edges
+                         if edge.get_other_node(node) in node_set) for node in nodes}
+    used_edges = set()
     chains = list()
 
-    for node in graph:
-        if node in marked_nodes:
-            continue
-
-        adj_nodes = [node for node, _ in graph[node]]
-        is_intersection_node = False
-        if node_degrees[node] != 2:
-            is_intersection_node = True
-
-        if is_intersection_node:
-            for adj_node in adj_nodes:
-                if adj_node not in marked_nodes and node_degrees[adj_node] == 2:
-                    new_chain = _build_degree2_chain(graph, adj_node, [node])
-                    for chain_node in new_chain[1:-1]:
-                        marked_nodes.add(chain_node)
-                    chains.append(new_chain)
+    for node in nodes:
+        if degrees[node] != 2:
+            for edge in node.edges:
+                if edge not in used_edges and edge.get_other_node(node) in node_set:
+                    chains.append(_build_degree2_chain(node, edge, degrees, node_set, used_edges))
+    # what is left are cycles of degree-2 nodes
+    for node in nodes:
+        for edge in node.edges:
+            if edge not in used_edges and edge.get_other_node(node) in node_set:
+                chains.append(_build_degree2_chain(node, edge, degrees, node_set, used_edges))
     return chains
 
 
-def _build_degree2_chain(graph, node, chain):
+def _build_degree2_chain(node, edge, degrees, node_set, used_edges):
     """
-    :param graph: The graph containing all the nodes and edges.
-    :param node: A 2-degree node which becomes the second element in the chain.
-    :param chain: This is a bit weird, but chain must be a non-degree2 node adjacent to node.
-    :return: list starting and ending with a non-degree-2 node and all degree-2 node in between.
+    Follows 'edge' from 'node' through degree-2 nodes until a node of another degree, or 'node' itself, is
+    reached, and marks the edges on the way as used.
+    :return: list starting with 'node' and ending with the node where the chain stops.
     """
-    chain.append(node)
-    if len(graph[node]) != 2:
-        return chain
-    for other_node, _ in graph[node]:
-        if other_node == node:
-            return chain
-        if other_node not in chain:
-            return _build_degree2_chain(graph, other_node, chain)
-
-
-def _merge_degree2_nodes(graph):
-    new_graph = Graph()
-    chains = get_all_degree2_chains(graph)
-    # todo
-
+    chain = [node]
+    used_edges.add(edge)
+    current_node = edge.get_other_node(node)
+    while degrees[current_node] == 2 and current_node is not node:
+        chain.append(current_node)
+        edge = next(other_edge for other_edge in current_node.edges
+                    if other_edge is not edge and other_edge.get_other_node(current_node) in node_set)
+        used_edges.add(edge)
+        current_node = edge.get_other_node(current_node)
+    chain.append(current_node)
+    return chain
+
+
+def _merge_degree2_nodes(graph, nodes=None):
+    """
+    Builds an undirected, weighted graph with a node for every end of a chain of get_all_degree2_chains and
+    an edge for every chain, with the number of edges in the chain as weight. The identifier of every new
+    node is the node of 'graph' that it stands for. Nodes without edges are left out.
 
-def _demerge_degree2_nodes(graph):
-    pass
+    Returns the new graph and a dict that maps its edges to their chains.
+    """
+    merged_graph = Graph(directed=False, weighted=True)
+    merged_nodes = dict()
+    chains = dict()
+    for chain in get_all_degree2_chains(graph, nodes):
+        for end in (chain[0], chain[-1]):
+            if end not in merged_nodes:
+                merged_nodes[end] = Node(end)
+                merged_graph.add_node(merged_nodes[end])
+        edge = Edge(merged_nodes[chain[0]], merged_nodes[chain[-1]], len(chain) - 1)
+        merged_graph.add_edge(edge)
+        chains[edge] = chain
+    return merged_graph, chains
+
+
+def _demerge_degree2_nodes(cycle_nodes, cycle_edges, chains):
+    """
+    Maps a cycle of a graph from _merge_degree2_nodes back to the original nodes. The cycle is given as its
+    nodes and the edges between them: edge i joins node i and node i+1, the last edge joins the last and
+    the first node.
+    """
+    original_nodes = list()
+    for node, edge in zip(cycle_nodes, cycle_edges):
+        chain = chains[edge]
+        if chain[0] is not node.identifier:
+            chain = chain[::-1]
+        original_nodes.extend(chain[:-1])
+    return original_nodes
 
 
 def _remove_degree1_nodes(graph, recursive=True):
-    pass
+    """
+    Returns the nodes of an undirected graph without the nodes of degree 0 or 1. With 'recursive', nodes
+    that get degree 1 when their neighbors are removed are removed as well, so only the nodes on cycles and
+    on paths between cycles (the 2-core) remain.
+    """
+    degrees = _get_node_degrees_undirected(graph)
+    removed = {node for node, degree in degrees.items() if degree < 2}
+    queue = list(removed)
+    if recursive:
+        for node in queue:
+            for other_node in node.adj_nodes:
+                if other_node not in removed:
+                    degrees[other_node] -= 1
+                    if degrees[other_node] < 2:
+                        removed.add(other_node)
+                        queue.append(other_node)
+    return [node for node in graph.yield_nodes() if node not in removed]
 
 
 def chordless_cycles(graph):
-    for node_from in graph:
-        for node_to, _ in graph[node_from]:
-            candidated = list()
+    """
+    Yields every chordless cycle of an undirected graph as a tuple of nodes: the cycles where no two nodes
+    are joined by an edge that is not part of the cycle. Every cycle is built once, from its lowest node, by
+    extending paths through higher nodes as long as they have no chords. Only the 2-core of the graph is
+    searched.
+    """
+    nodes = _remove_degree1_nodes(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    neighbors = [set() for _ in nodes]
+    for i, node in enumerate(nodes):
+        for other_node in node.adj_nodes:
+            if other_node in index and other_node is not node:
+                neighbors[i].add(index[other_node])
+                neighbors[index[other_node]].add(i)
+
+    # blocked[node] counts the inner nodes of the path that are adjacent to node; such a node would be a chord
+    blocked = [0] * len(nodes)
+    for start in range(len(nodes)):
+        for second in neighbors[start]:
+            if second < start:
+                continue
+            path = [start, second]
+            on_path = {start, second}
+            iterators = [iter(neighbors[second])]
+            while iterators:
+                node = next(iterators[-1], None)
+                if node is None:
+                    iterators.pop()
+                    on_path.remove(path.pop())
+                    if len(path) > 1:
+                        for other in neighbors[path[-1]]:
+                            blocked[other] -= 1
+                    continue
+                if node <= start or node in on_path or blocked[node]:
+                    continue
+                if start in neighbors[node]:
+                    # the cycle closes; the other direction is found from the other neighbor of start
+                    if second < node:
+                        yield tuple(nodes[i] for i in path) + (nodes[node],)
+                    continue
+                for other in neighbors[path[-1]]:
+                    blocked[other] += 1
+                path.append(node)
+                on_path.add(node)
+                iterators.append(iter(neighbors[node]))
 
 
 ############################################################
@@ -510,45 +1546,589 @@ def tarjan(graph):
     """
     Tarjan's strongly connected components algorithm. The algorithm finds all SCCs in a graph.
 
-    A list of SCC sets is returned
+    A list of SCC sets is returned, in the order in which they are completed: every SCC comes before the
+    SCCs that have edges into it. For a CSRGraph the SCCs are sets of node indices.
+
+    The search uses an explicit stack instead of recursion, so it is not limited by the recursion limit; see
+    scc_labels, which also avoids building a set per component for very large graphs.
     """
-    i = [0]
-    stack = list()
-    onstack = set()
-    index = dict()
-    lowlink = dict()
+    nodes, _, _, _ = _adjacency_arrays(graph)
+    count, labels = scc_labels(graph)
+    sccs = [set() for _ in range(count)]
+    if isinstance(graph, CSRGraph):
+        for node, label in enumerate(labels):
+            sccs[label].add(node)
+    else:
+        for node, label in zip(nodes, labels):
+            sccs[label].add(node)
+    return sccs
 
-    scc_list = list()
-    for node in graph:
-        if node not in index:
-            for scc in _tarjan_strongconnect(graph, node, i, stack, onstack, index, lowlink):
-                scc_list.append(scc)
-    return scc_list
-
-
-def _tarjan_strongconnect(graph, node, i, stack, onstack, index, lowlink):
-    index[node] = i[0]
-    lowlink[node] = i[0]
-    i[0] += 1
-    stack.append(node)
-    onstack.add(node)
-
-    for adj_node, _ in graph[node]:
-        if adj_node not in index:
-            yield from _tarjan_strongconnect(graph, adj_node, i, stack, onstack, index, lowlink)
-        elif adj_node in onstack:
-            lowlink[node] = min(lowlink[node], lowlink[adj_node])
-
-    if lowlink[node] == index[node]:
-        scc = set()
-        other_node = stack.pop()
-        onstack.remove(other_node)
-        scc.add(other_node)
-        while other_node != node:
-            other_node = stack.pop()
-            onstack.remove(other_node)
-            scc.add(other_node)
-        yield scc
+
+def scc_labels(graph):
+    """
+    Labels every node with the number of its strongly connected component, with Pearce's single-array
+    version of Tarjan's algorithm: 'rindex' holds the visit index of a node while it is on the stack and
+    its component once it is done, so no lowlink or on-stack arrays are needed.
+
+    Returns the number of components and an array with the component of every node index (in the order of
+    graph.yield_nodes() for a Graph). Components are numbered in the order in which they are completed.
+    """
+    _, offsets, neighbors, _ = _adjacency_arrays(graph)
+    node_count = len(offsets) - 1
+    # visit indices count up from 1 and component numbers count down from node_count - 1 (Pearce); both
+    # fit in the same array because a finished node never compares lower than an active one
+    rindex = array('l', [0]) * node_count
+    is_root = bytearray(node_count)
+    stack = array('l')
+    # the explicit call stack: the visited nodes and, per node, the position of the next neighbor to visit
+    work_nodes = array('l')
+    work_slots = array('l')
+    visit_index = 1
+    component = node_count - 1
+
+    for start in range(node_count):
+        if rindex[start]:
+            continue
+        rindex[start] = visit_index
+        visit_index += 1
+        is_root[start] = 1
+        work_nodes.append(start)
+        work_slots.append(offsets[start])
+        while work_nodes:
+            node = work_nodes[-1]
+            slot = work_slots[-1]
+            end = offsets[node + 1]
+            while slot < end:
+                adj_node = neighbors[slot]
+                slot += 1
+                if not rindex[adj_node]:
+                    work_slots[-1] = slot
+                    rindex[adj_node] = visit_index
+                    visit_index += 1
+                    is_root[adj_node] = 1
+                    work_nodes.append(adj_node)
+                    work_slots.append(offsets[adj_node])
+                    break
+                if rindex[adj_node] < rindex[node]:
+                    rindex[node] = rindex[adj_node]
+                    is_root[node] = 0
+            else:
+                work_nodes.pop()
+                work_slots.pop()
+                if is_root[node]:
+                    visit_index -= 1
+                    while stack and rindex[node] <= rindex[stack[-1]]:
+                        rindex[stack.pop()] = component
+                        visit_index -= 1
+                    rindex[node] = component
+                    component -= 1
+                else:
+                    stack.append(node)
+                if work_nodes:
+                    parent = work_nodes[-1]
+                    if rindex[node] < rindex[parent]:
+                        rindex[parent] = rindex[node]
+                        is_root[parent] = 0
+
+    last_component = node_count - 1
+    for node in range(node_count):
+        rindex[node] = last_component - rindex[node]
+    return last_component - component, rindex
+
+
+def _adjacency_arrays(graph):
+    """
+    Returns the nodes, offsets, neighbors and edge ids of 'graph' in CSR layout. A CSRGraph is returned as
+    is, with None for the nodes. For a Graph, the nodes are numbered in the order of yield_nodes and the
+    edges in the order of yield_edges.
+    """
+    if isinstance(graph, CSRGraph):
+        return None, graph.offsets, graph.neighbors, graph.edge_ids
+    nodes = list(graph.yield_nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edge_index = {edge: i for i, edge in enumerate(graph.yield_edges())}
+    offsets = array('l', [0]) * (len(nodes) + 1)
+    neighbors = array('l')
+    edge_ids = array('l')
+    for i, node in enumerate(nodes):
+        for edge in node.edges:
+            neighbors.append(index[edge.get_other_node(node)])
+            edge_ids.append(edge_index[edge])
+        offsets[i + 1] = len(neighbors)
+    return nodes, offsets, neighbors, edge_ids
+
+
+############################################################
+#       Biconnected components and bridges                 #
+############################################################
+
+
+def biconnected_components(graph):
+    """
+    Splits the edges of an undirected graph into biconnected components (Hopcroft-Tarjan, with an explicit
+    stack). In a molecule, a component with more than one bond is a ring system and a component of a single
+    bond is a bridge, a bond that is not in any ring. Self-loops are not in any component.
+
+    Returns a list of sets of edges; for a CSRGraph the edges are edge ids.
+    """
+    components, _ = _biconnected_components(graph)
+    return components
+
+
+def bridges(graph):
+    """
+    Returns the bridges of an undirected graph: the edges whose removal disconnects the graph. For a
+    CSRGraph these are edge ids.
+    """
+    _, bridge_list = _biconnected_components(graph, components=False)
+    return bridge_list
+
+
+def _biconnected_components(graph, components=True):
+    """
+    Returns the biconnected components, or None if 'components' is false, and the bridges of 'graph'.
+    """
+    if graph.directed:
+        raise ValueError('Graph should be undirected.')
+    _, offsets, neighbors, edge_ids = _adjacency_arrays(graph)
+    node_count = len(offsets) - 1
+    discovery = array('l', [-1]) * node_count
+    low = array('l', [0]) * node_count
+    edge_stack = array('l')
+    # the explicit call stack: the visited nodes, the position of their next neighbor and the edge by which
+    # they were reached
+    work_nodes = array('l')
+    work_slots = array('l')
+    work_edges = array('l')
+    component_list = list() if components else None
+    bridge_list = list()
+    time = 0
+
+    for root in range(node_count):
+        if discovery[root] != -1:
+            continue
+        discovery[root] = low[root] = time
+        time += 1
+        work_nodes.append(root)
+        work_slots.append(offsets[root])
+        work_edges.append(-1)
+        while work_nodes:
+            node = work_nodes[-1]
+            slot = work_slots[-1]
+            parent_edge = work_edges[-1]
+            end = offsets[node + 1]
+            while slot < end:
+                adj_node = neighbors[slot]
+                edge_id = edge_ids[slot]
+                slot += 1
+                if edge_id == parent_edge:
+                    continue
+                if discovery[adj_node] == -1:
+                    work_slots[-1] = slot
+                    edge_stack.append(edge_id)
+                    discovery[adj_node] = low[adj_node] = time
+                    time += 1
+                    work_nodes.append(adj_node)
+                    work_slots.append(offsets[adj_node])
+                    work_edges.append(edge_id)
+                    break
+                if discovery[adj_node] < discovery[node]:
+                    # a back edge; edges to descendants were already seen from the other side
+                    edge_stack.append(edge_id)
+                    if discovery[adj_node] < low[node]:
+                        low[node] = discovery[adj_node]
+            else:
+                work_nodes.pop()
+                work_slots.pop()
+                work_edges.pop()
+                if not work_nodes:
+                    continue
+                parent = work_nodes[-1]
+                if low[node] < low[parent]:
+                    low[parent] = low[node]
+                if low[node] >= discovery[parent]:
+                    component = set()
+                    edge_id = None
+                    while edge_id != parent_edge:
+                        edge_id = edge_stack.pop()
+                        if components:
+                            component.add(edge_id)
+                    if components:
+                        component_list.append(component)
+                    if low[node] > discovery[parent]:
+                        bridge_list.append(parent_edge)
+
+    if not isinstance(graph, CSRGraph):
+        edges = graph.get_edges()
+        if components:
+            component_list = [{edges[edge_id] for edge_id in component} for component in component_list]
+        bridge_list = [edges[edge_id] for edge_id in bridge_list]
+    return component_list, bridge_list
+
+
+############################################################
+#                  Longest simple paths                    #
+############################################################
+
+
+def longest_paths(graph, nodes=None, max_paths=None, max_steps=1000000):
+    """
+    Finds the longest simple paths of an undirected graph, or of the subgraph induced by 'nodes'. Components
+    that are trees are solved in linear time: two BFS passes find a diameter, and every longest path of a
+    tree runs through the middle of that diameter. Components with cycles are searched depth-first from every
+    node; that search stops after 'max_steps' path extensions in total and then returns the longest paths it
+    found so far.
+
+    Returns a list of paths as lists of nodes, every path in one direction only and at most 'max_paths' of
+    them. A component of a single node is a path of one node.
+    """
+    if graph.directed:
+        raise ValueError('Graph should be undirected.')
+    if nodes is None:
+        nodes, by_identifier = list(graph.yield_nodes()), False
+    else:
+        nodes, by_identifier = _resolve_nodes(graph, nodes)
+        nodes = list(dict.fromkeys(nodes))
+    index = {node: i for i, node in enumerate(nodes)}
+    adjacency = [list(dict.fromkeys(index[adj_node] for adj_node in node.adj_nodes
+                                    if adj_node in index and adj_node is not node))
+                 for node in nodes]
+
+    best_length = -1
+    best_paths = list()
+    budget = max_steps
+    seen = bytearray(len(nodes))
+    for start in range(len(nodes)):
+        if seen[start]:
+            continue
+        component = _component(adjacency, start, seen)
+        if len(component) <= best_length:
+            continue
+        edge_count = sum(len(adjacency[node]) for node in component) // 2
+        if edge_count == len(component) - 1:
+            length, paths = _tree_longest_paths(adjacency, component, max_paths)
+        else:
+            length, paths, budget = _bounded_longest_paths(adjacency, component, max_paths, budget)
+        if length > best_length:
+            best_length, best_paths = length, paths
+        elif length == best_length:
+            best_paths.extend(paths)
+    if max_paths is not None:
+        del best_paths[max_paths:]
+
+    if by_identifier:
+        return [[nodes[node].identifier for node in path] for path in best_paths]
+    return [[nodes[node] for node in path] for path in best_paths]
+
+
+def _component(adjacency, start, seen):
+    seen[start] = 1
+    component = [start]
+    for node in component:
+        for adj_node in adjacency[node]:
+            if not seen[adj_node]:
+                seen[adj_node] = 1
+                component.append(adj_node)
+    return component
+
+
+def _tree_bfs(adjacency, root, blocked=None):
+    """
+    BFS over a tree from 'root' that does not enter 'blocked'. Returns the nodes in BFS order, their parents
+    and their depths.
+    """
+    order = [root]
+    parent = {root: None}
+    depth = {root: 0}
+    for node in order:
+        for adj_node in adjacency[node]:
+            if adj_node not in parent and adj_node != blocked:
+                parent[adj_node] = node
+                depth[adj_node] = depth[node] + 1
+                order.append(adj_node)
+    return order, parent, depth
+
+
+def _walk_up(parent, node):
+    path = [node]
+    while parent[node] is not None:
+        node = parent[node]
+        path.append(node)
+    return path
+
+
+def _tree_longest_paths(adjacency, component, max_paths):
+    """
+    Returns the length and all longest paths of a tree. All longest paths share the center of the tree, so
+    they pair the deepest nodes of two different branches of the center node, or of both sides of the center
+    edge.
+    """
+    if len(component) == 1:
+        return 0, [component]
+    end = _tree_bfs(adjacency, component[0])[0][-1]
+    order, parent, depth = _tree_bfs(adjacency, end)
+    diameter = depth[order[-1]]
+    diameter_path = _walk_up(parent, order[-1])
+    radius = diameter // 2
+
+    if diameter % 2 == 0:
+        center = diameter_path[radius]
+        order, parent, depth = _tree_bfs(adjacency, center)
+        branch = {center: None}
+        branch_ends = dict()
+        for node in order[1:]:
+            branch[node] = node if parent[node] == center else branch[parent[node]]
+            if depth[node] == radius:
+                branch_ends.setdefault(branch[node], list()).append(node)
+        groups = list(branch_ends.values())
+        pairs = ((end1, end2) for i, group in enumerate(groups) for other_group in groups[i + 1:]
+                 for end1 in group for end2 in other_group)
+        parents1 = parents2 = parent
+    else:
+        center1, center2 = diameter_path[radius], diameter_path[radius + 1]
+        order1, parents1, depth1 = _tree_bfs(adjacency, center1, center2)
+        order2, parents2, depth2 = _tree_bfs(adjacency, center2, center1)
+        ends1 = [node for node in order1 if depth1[node] == radius]
+        ends2 = [node for node in order2 if depth2[node] == radius]
+        pairs = ((end1, end2) for end1 in ends1 for end2 in ends2)
+
+    paths = list()
+    for end1, end2 in pairs:
+        if max_paths is not None and len(paths) >= max_paths:
+            break
+        half2 = _walk_up(parents2, end2)
+        if diameter % 2 == 0:
+            half2.pop()
+        paths.append(_walk_up(parents1, end1) + half2[::-1])
+    return diameter, paths
+
+
+def _bounded_longest_paths(adjacency, component, max_paths, budget):
+    """
+    Depth-first search over all simple paths of a component with cycles, for at most 'budget' extensions.
+    Returns the length of the longest paths found, the paths and the remaining budget.
+    """
+    best_length = 0
+    found = {(component[0],): None}
+    for start in component:
+        path = [start]
+        slots = [0]
+        on_path = {start}
+        while path and budget > 0:
+            node = path[-1]
+            slot = slots[-1]
+            if slot == len(adjacency[node]):
+                path.pop()
+                slots.pop()
+                on_path.discard(node)
+                continue
+            slots[-1] += 1
+            adj_node = adjacency[node][slot]
+            if adj_node in on_path:
+                continue
+            budget -= 1
+            path.append(adj_node)
+            slots.append(0)
+            on_path.add(adj_node)
+            if len(path) - 1 < best_length:
+                continue
+            if len(path) - 1 > best_length:
+                best_length = len(path) - 1
+                found = dict()
+            if max_paths is None or len(found) < max_paths:
+                # store every path in one direction only, the one that starts at the lower index
+                found[tuple(path) if path[0] < path[-1] else tuple(reversed(path))] = None
+        if budget <= 0:
+            break
+    return best_length, [list(path) for path in found], budget
+
+
+############################################################
+#       Canonical ranking by partition refinement          #
+############################################################
+
+
+def canonical_ranks(graph, node_invariant, edge_invariant=None, nodes=None):
+    """
+    Ranks the nodes of an undirected graph canonically: isomorphic graphs get the same rank for corresponding
+    nodes, regardless of the order in which the nodes and edges were added.
+
+    'node_invariant' maps a node to a sortable value that is the same for equivalent nodes, like its element
+    and charge. 'edge_invariant' does the same for an edge. The nodes are first partitioned by invariant and
+    the partition is then refined by the classes of the adjacent nodes and the invariants of the edges to them
+    (Morgan / extended connectivity style) until it is stable.
+
+    Only the nodes whose neighbors changed class are re-examined, and a splitting class keeps its id for the
+    largest part, so every node changes class O(log(V)) times and the total work is near-linear.
+
+    Classes that refinement can not split, as in symmetric cages, are split by individualization: every member
+    of the first such class is singled out in turn and the partition is refined again, down to single nodes.
+    Of all these rankings the one under which the edges, as sorted (rank, rank, invariant) triples, are the
+    smallest is kept. Rankings with the same edges are related by an automorphism of the graph, and the
+    automorphisms found this way skip the branches that would give the same rankings again. Classes of twins,
+    nodes with the same neighbors like the hydrogens of a methyl group, are split without a search.
+
+    If 'nodes' is given, only those nodes are ranked and edges to other nodes are ignored.
+
+    Returns a dict mapping every node to its rank, starting at 0. Nodes are ordered by invariant first.
+    """
+    nodes = list(graph.yield_nodes()) if nodes is None else list(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    neighbors = [[(index[edge.get_other_node(node)], edge_invariant(edge) if edge_invariant else 0)
+                  for edge in node.edges if edge.get_other_node(node) in index] for node in nodes]
+    edges = [(i, j, edge) for i, node_neighbors in enumerate(neighbors) for j, edge in node_neighbors if i < j]
+
+    invariants = [node_invariant(node) for node in nodes]
+    initial_rank = {invariant: rank for rank, invariant in enumerate(sorted(set(invariants)))}
+    class_id = [initial_rank[invariant] for invariant in invariants]
+    classes = [set() for _ in initial_rank]
+    for i, node_class in enumerate(class_id):
+        classes[node_class].add(i)
+    ambiguous_classes = [node_class for node_class, members in enumerate(classes) if len(members) > 1]
+
+    # the first and the best ranking found so far, as (edges, ranks), and the automorphisms found
+    leaves = dict()
+    automorphisms = list()
+
+    def leaf(leaf_class_id):
+        order = sorted(range(len(nodes)), key=lambda i: (initial_rank[invariants[i]], leaf_class_id[i]))
+        ranks = [0] * len(nodes)
+        for rank, i in enumerate(order):
+            ranks[i] = rank
+        certificate = sorted((min(ranks[i], ranks[j]), max(ranks[i], ranks[j]), edge) for i, j, edge in edges)
+        if not leaves:
+            leaves['first'] = leaves['best'] = certificate, ranks
+            return
+        for known_certificate, known_ranks in (leaves['first'], leaves['best']):
+            if certificate == known_certificate:
+                automorphisms.append(_rank_automorphism(known_ranks, ranks))
+                return
+        if certificate < leaves['best'][0]:
+            leaves['best'] = certificate, ranks
+
+    def search(search_class_id, search_classes, search_ambiguous, changed, fixed):
+        while True:
+            while changed:
+                changed = _refine_partition(neighbors, search_class_id, search_classes, changed, search_ambiguous)
+            while search_ambiguous and len(search_classes[search_ambiguous[0]]) < 2:
+                heappop(search_ambiguous)
+            if not search_ambiguous:
+                leaf(search_class_id)
+                return
+            cell = search_ambiguous[0]
+            members = sorted(search_classes[cell])
+            if any(sorted(neighbors[i]) != sorted(neighbors[members[0]]) for i in members[1:]):
+                break
+            # twins, like the hydrogens of a methyl group, have the same neighbors and can be swapped with
+            # each other alone, so any order of them gives the same ranking: single them all out
+            for i in members[1:]:
+                search_classes[cell].remove(i)
+                search_class_id[i] = len(search_classes)
+                search_classes.append({i})
+            changed = members[1:]
+        explored = list()
+        for chosen in sorted(search_classes[cell]):
+            if explored and _in_explored_orbit(chosen, explored, fixed, automorphisms):
+                continue
+            explored.append(chosen)
+            branch_class_id = search_class_id[:]
+            branch_classes = [set(members) for members in search_classes]
+            branch_classes[cell].remove(chosen)
+            branch_class_id[chosen] = len(branch_classes)
+            branch_classes.append({chosen})
+            search(branch_class_id, branch_classes, search_ambiguous[:], [chosen], fixed + [chosen])
+
+    search(class_id, classes, ambiguous_classes, range(len(nodes)), [])
+    ranks = leaves['best'][1] if leaves else []
+    return {node: ranks[i] for i, node in enumerate(nodes)}
+
+
+def _rank_automorphism(known_ranks, ranks):
+    """
+    The automorphism that maps every node to the node with the same rank in the known ranking.
+    """
+    by_rank = [0] * len(known_ranks)
+    for i, rank in enumerate(known_ranks):
+        by_rank[rank] = i
+    return [by_rank[rank] for rank in ranks]
+
+
+def _in_explored_orbit(chosen, explored, fixed, automorphisms):
+    """
+    Whether an automorphism that keeps the 'fixed' nodes in place maps 'chosen' to an explored node, whose
+    branch then gives the same rankings.
+    """
+    generators = [automorphism for automorphism in automorphisms if all(automorphism[i] == i for i in fixed)]
+    explored = set(explored)
+    orbit = {chosen}
+    queue = [chosen]
+    while queue:
+        i = queue.pop()
+        for automorphism in generators:
+            image = automorphism[i]
+            if image in explored:
+                return True
+            if image not in orbit:
+                orbit.add(image)
+                queue.append(image)
+    return False
+
+
+def _refine_partition(neighbors, class_id, classes, changed, ambiguous_classes):
+    """
+    One refinement round. All members of a class had the same neighbor classes before the nodes in 'changed'
+    got a new class, so only their neighbors need a new signature. The other members of a class share the
+    signature of any one of them. Returns the nodes that got a new class.
+    """
+    def signature(i):
+        return tuple(sorted((class_id[j], edge) for j, edge in neighbors[i]))
+
+    touched = dict()
+    for i in changed:
+        for j, _ in neighbors[i]:
+            if len(classes[class_id[j]]) > 1:
+                touched.setdefault(class_id[j], set()).add(j)
+
+    # the signatures of all classes are computed before any node changes class
+    splits = list()
+    for node_class in sorted(touched):
+        members = classes[node_class]
+        touched_members = touched[node_class]
+        groups = dict()
+        for i in touched_members:
+            groups.setdefault(signature(i), list()).append(i)
+        untouched_signature = None
+        if len(touched_members) < len(members):
+            untouched_signature = signature(next(i for i in members if i not in touched_members))
+            groups.setdefault(untouched_signature, list())
+        if len(groups) > 1:
+            splits.append((node_class, touched_members, groups, untouched_signature))
+
+    new_changed = list()
+    for node_class, touched_members, groups, untouched_signature in splits:
+        members = classes[node_class]
+        untouched_count = len(members) - len(touched_members)
+
+        def group_size(key):
+            return len(groups[key]) + (untouched_count if key == untouched_signature else 0)
+
+        keys = sorted(groups)
+        kept_key = max(keys, key=group_size)
+        for key in keys:
+            if key == kept_key:
+                continue
+            moved = groups[key]
+            if key == untouched_signature:
+                moved = moved + [i for i in members if i not in touched_members]
+            new_class = len(classes)
+            classes.append(set(moved))
+            members.difference_update(moved)
+            for i in moved:
+                class_id[i] = new_class
+            new_changed.extend(moved)
+            if len(moved) > 1:
+                heappush(ambiguous_classes, new_class)
+    return new_changed
 
 
 ############################################################
@@ -584,6 +2164,307 @@ def get_non_reducible_cycles(graph, alg='bellmanford'):
     return nrc_lists
 
 
+############################################################
+#       Ring perception: SSSR and relevant cycles          #
+############################################################
+
+
+# The rings of an undirected graph. 'sssr' is a minimum cycle basis (the smallest set of smallest rings) of
+# 'cyclomatic_number' cycles, 'relevant_cycles' is the union of all minimum cycle bases. Every cycle is a
+# tuple of nodes in ring order.
+RingInfo = namedtuple('RingInfo', ['cyclomatic_number', 'sssr', 'relevant_cycles'])
+
+
+def cyclomatic_number(graph):
+    """
+    The number of independent cycles of an undirected graph: edges - nodes + connected components.
+    """
+    _, adjacency, _, self_loops = _ring_graph(graph, weighted=False)
+    return _cyclomatic_number(adjacency, self_loops)
+
+
+def sssr(graph):
+    return perceive_rings(graph).sssr
+
+
+def relevant_cycles(graph):
+    return perceive_rings(graph).relevant_cycles
+
+
+def perceive_rings(graph, reduce=True):
+    """
+    Finds the SSSR and the relevant cycles of an undirected graph in polynomial time, following Vismara
+    (1997). For every node r, a shortest path search through the nodes that come before r gives the shortest
+    paths from r. Every relevant cycle belongs to a family of cycles that consist of two such paths that
+    only share r, closed by one edge (odd cycles) or by two edges through a common node (even cycles). One
+    prototype per family is tested for linear independence over GF(2), in order of length, with the edge
+    sets as bits of an integer. The families of the relevant prototypes are expanded to get all relevant
+    cycles.
+
+    With 'reduce', the search runs on the graph given by reduce_graph and the cycles are mapped back to the
+    nodes of 'graph', which is much faster for graphs with long chains. Ring sizes are the number of nodes
+    either way; the edge weights of 'graph' are not used.
+
+    Returns a RingInfo.
+    """
+    if reduce:
+        reduced, chains = reduce_graph(graph)
+        nodes, adjacency, weights, self_loops = _ring_graph(reduced, weighted=True)
+        edges = reduced.get_edges()
+    else:
+        nodes, adjacency, weights, self_loops = _ring_graph(graph, weighted=False)
+    cycle_count, sssr_cycles, relevant = _perceive_rings(adjacency, weights, self_loops)
+
+    def to_nodes(cycle):
+        cycle_nodes, cycle_edges = cycle
+        if not reduce:
+            return tuple(nodes[i] for i in cycle_nodes)
+        return tuple(_demerge_degree2_nodes([nodes[i] for i in cycle_nodes], [edges[i] for i in cycle_edges],
+                                            chains))
+
+    return RingInfo(cycle_count, tuple(to_nodes(cycle) for cycle in sssr_cycles),
+                    tuple(to_nodes(cycle) for cycle in relevant))
+
+
+def _ring_graph(graph, weighted):
+    """
+    Returns the nodes of 'graph', the adjacency as lists of (node index, edge index) per node index, the
+    edge weights (all 1 unless 'weighted') and the self-loops as (node index, edge index). Edge direction is
+    ignored. Parallel edges are kept, since they make cycles of their own.
+    """
+    nodes = list(graph.yield_nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    adjacency = [list() for _ in nodes]
+    weights = list()
+    self_loops = list()
+    for edge_index, edge in enumerate(graph.yield_edges()):
+        weights.append(edge.weight if weighted else 1)
+        u, v = index[edge.source], index[edge.sink]
+        if u == v:
+            self_loops.append((u, edge_index))
+        else:
+            adjacency[u].append((v, edge_index))
+            adjacency[v].append((u, edge_index))
+    return nodes, adjacency, weights, self_loops
+
+
+def _cyclomatic_number(adjacency, self_loops):
+    components = 0
+    seen = [False] * len(adjacency)
+    for start in range(len(adjacency)):
+        if seen[start]:
+            continue
+        components += 1
+        seen[start] = True
+        stack = [start]
+        while stack:
+            for other, _ in adjacency[stack.pop()]:
+                if not seen[other]:
+                    seen[other] = True
+                    stack.append(other)
+    edge_count = sum(len(adjacent) for adjacent in adjacency) // 2 + len(self_loops)
+    return edge_count - len(adjacency) + components
+
+
+def _perceive_rings(adjacency, weights, self_loops):
+    """
+    Returns the cyclomatic number, the SSSR and the relevant cycles of a weighted multigraph given as by
+    _ring_graph. Every cycle is a list of node indices and a list of edge indices, where edge i joins node
+    i and node i+1 and the last edge joins the last and the first node.
+    """
+    cycle_count = _cyclomatic_number(adjacency, self_loops)
+    if cycle_count == 0:
+        return 0, [], []
+
+    # a self-loop is a cycle family of its own
+    families = [(weights[edge], ([node], [edge]), None) for node, edge in self_loops]
+    for root in range(len(adjacency)):
+        if len(adjacency[root]) > 1:
+            families.extend(_cycle_families(adjacency, weights, root))
+    families.sort(key=lambda family: family[0])
+
+    basis = dict()
+    sssr_cycles = list()
+    relevant = list()
+    group_start = 0
+    while group_start < len(families) and len(basis) < cycle_count:
+        length = families[group_start][0]
+        group_end = group_start
+        while group_end < len(families) and families[group_end][0] == length:
+            group_end += 1
+        # a cycle is relevant if it is not a sum of shorter cycles, which the basis so far spans
+        shorter_basis = dict(basis)
+        for family in families[group_start:group_end]:
+            prototype = family[1]
+            bits = _cycle_bits(prototype[1])
+            if not _reduce_bits(bits, shorter_basis):
+                continue
+            relevant.append(family)
+            bits = _reduce_bits(bits, basis)
+            if bits:
+                basis[bits.bit_length() - 1] = bits
+                sssr_cycles.append(prototype)
+        group_start = group_end
+
+    # in multigraphs a cycle can be in more than one family
+    relevant_cycles = list()
+    seen = set()
+    for family in relevant:
+        for cycle in _expand_family(family):
+            bits = _cycle_bits(cycle[1])
+            if bits not in seen:
+                seen.add(bits)
+                relevant_cycles.append(cycle)
+    return cycle_count, sssr_cycles, relevant_cycles
+
+
+def _cycle_families(adjacency, weights, root):
+    """
+    Yields the cycle families with 'root' as the highest node, as (length, prototype, expansion). The cycles
+    of a family consist of a shortest path from the root to each of two ends, joined by one closing edge
+    (odd cycles) or by two closing edges through a middle node (even cycles). 'expansion' holds what
+    _expand_family needs: the predecessors on the shortest paths, the ends, the middle node (None for odd
+    cycles) and the closing edges.
+    """
+    # Dijkstra from the root through lower nodes only. A node is usable if this gives a shortest path in
+    # the whole graph; the predecessors of a usable node are usable as well.
+    distance = {root: 0}
+    predecessors = {root: []}
+    order = list()
+    settled = set()
+    heap = [(0, root)]
+    while heap:
+        node_distance, node = heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        order.append(node)
+        for other, edge in adjacency[node]:
+            if other > root:
+                continue
+            other_distance = node_distance + weights[edge]
+            if other not in distance or other_distance < distance[other]:
+                distance[other] = other_distance
+                predecessors[other] = [(node, edge)]
+                heappush(heap, (other_distance, other))
+            elif other_distance == distance[other]:
+                predecessors[other].append((node, edge))
+    true_distance = _shortest_distances(adjacency, weights, root, settled)
+    usable = {node for node in order if distance[node] == true_distance[node]}
+
+    paths = {root: ([root], [])}
+    for node in order[1:]:
+        if node in usable:
+            predecessor, edge = predecessors[node][0]
+            path_nodes, path_edges = paths[predecessor]
+            paths[node] = (path_nodes + [node], path_edges + [edge])
+
+    for node in order[1:]:
+        if node not in usable:
+            continue
+        lower = list()
+        for other, edge in adjacency[node]:
+            if other not in usable:
+                continue
+            if distance[other] + weights[edge] == distance[node]:
+                lower.append((other, edge))
+            elif distance[node] + weights[edge] != distance[other] and (other == root or other < node) and \
+                    _disjoint_paths(paths[node][0], paths[other][0]):
+                prototype = _join_paths(paths[node], None, [edge], paths[other])
+                yield distance[node] + weights[edge] + distance[other], prototype, \
+                    (predecessors, root, node, other, None, [edge])
+        for i, (first, first_edge) in enumerate(lower):
+            for second, second_edge in lower[i+1:]:
+                if _disjoint_paths(paths[first][0], paths[second][0]):
+                    prototype = _join_paths(paths[first], node, [first_edge, second_edge], paths[second])
+                    yield 2 * distance[node], prototype, \
+                        (predecessors, root, first, second, node, [first_edge, second_edge])
+
+
+def _shortest_distances(adjacency, weights, source, targets):
+    """
+    The distances from 'source' in the whole graph. The search stops once the distances of all nodes in
+    'targets' are final.
+    """
+    distance = {source: 0}
+    settled = set()
+    remaining = len(targets)
+    heap = [(0, source)]
+    while heap and remaining > 0:
+        node_distance, node = heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if node in targets:
+            remaining -= 1
+        for other, edge in adjacency[node]:
+            other_distance = node_distance + weights[edge]
+            if other not in distance or other_distance < distance[other]:
+                distance[other] = other_distance
+                heappush(heap, (other_distance, other))
+    return distance
+
+
+def _disjoint_paths(first_path, second_path):
+    """Whether two paths from the same root only share the root."""
+    return not set(first_path[1:]).intersection(second_path[1:])
+
+
+def _join_paths(first_path, middle, closing_edges, second_path):
+    """
+    Joins two paths from the same root into a cycle: the first path, the middle node if there is one, and
+    the second path backwards, with the closing edges in between.
+    """
+    cycle_nodes = first_path[0] + ([middle] if middle is not None else []) + second_path[0][:0:-1]
+    return cycle_nodes, first_path[1] + closing_edges + second_path[1][::-1]
+
+
+def _cycle_bits(cycle_edges):
+    bits = 0
+    for edge in cycle_edges:
+        bits |= 1 << edge
+    return bits
+
+
+def _reduce_bits(bits, basis):
+    """Reduces 'bits' by a GF(2) basis keyed by leading bit; returns 0 if 'bits' is in its span."""
+    while bits:
+        leading_bit = bits.bit_length() - 1
+        if leading_bit not in basis:
+            return bits
+        bits ^= basis[leading_bit]
+    return 0
+
+
+def _expand_family(family):
+    """
+    Yields every cycle of a family: every combination of shortest paths from the root to both ends that
+    only share the root.
+    """
+    _, prototype, expansion = family
+    if expansion is None:
+        yield prototype
+        return
+    predecessors, root, first, second, middle, closing_edges = expansion
+    second_paths = list(_all_shortest_paths(predecessors, root, second))
+    for first_path in _all_shortest_paths(predecessors, root, first):
+        for second_path in second_paths:
+            if _disjoint_paths(first_path[0], second_path[0]):
+                yield _join_paths(first_path, middle, closing_edges, second_path)
+
+
+def _all_shortest_paths(predecessors, root, node):
+    """Yields every path from 'root' to 'node' along 'predecessors', as a list of nodes and of edges."""
+    stack = [([node], [])]
+    while stack:
+        reversed_nodes, reversed_edges = stack.pop()
+        if reversed_nodes[-1] == root:
+            yield reversed_nodes[::-1], reversed_edges[::-1]
+            continue
+        for predecessor, edge in predecessors[reversed_nodes[-1]]:
+            stack.append((reversed_nodes + [predecessor], reversed_edges + [edge]))
+
+
 ############################################################
 #                                                          #
 ############################################################
@@ -1,52 +1,118 @@
-import codecs
 import hashlib
-import json
+from array import array
+from collections import namedtuple
 
-from pychem.molecule import graph
+from pychem.molecule import elements, graph
+from pychem.molecule.elements import Element
 
 
-def _load_data():
-    with open('../pychem/data/elements.json') as elements_data_file:
-        data = json.loads(elements_data_file.read())
+BOND_ELECTRONS = {'-': 1, '=': 2, '#': 3, '$': 4, ':': 1}
 
-    to_element = dict()
-    for element, element_data in data.items():
-        to_element[element_data['z']] = element
-        to_element[element_data['symbol']] = element
-        to_element[element] = element
 
-    return data, to_element
-
-
-ELEMENTS_DATA, TRANSLATE_ELEMENT = _load_data()
+def __getattr__(name):
+    # The element tables used to be built at import time under these names. They are built on first access
+    # and then set as globals, so later accesses do not get here.
+    if name == 'ELEMENTS':
+        value = {element.name: element for element in elements.element_table() if element is not None}
+    elif name == 'TRANSLATE_ELEMENT':
+        value = dict()
+        for element in elements.element_table():
+            if element is not None:
+                for key in (element.atomic_number, element.symbol, element.name):
+                    value[key] = element.name
+    else:
+        raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+    globals()[name] = value
+    return value
 
 
 class Atom(graph.Node):
-    def __init__(self, element, molecule, isotope=None, charge=0, aromatic=None, isomer=None):
-        graph.Node.__init__(self)
+    __slots__ = ('molecule', '_element', 'isotope', 'charge', 'aromatic', 'isomer', '_hydrogen_count')
 
-        self.adj_atoms = self.adj_nodes
-        self.bonds = self.edges
+    def __init__(self, element, molecule, isotope=None, charge=0, aromatic=None, isomer=None, hydrogen_count=0):
+        graph.Node.__init__(self)
 
         self.molecule = molecule
 
         try:
-            self.element = TRANSLATE_ELEMENT[element.capitalize()]
-            element_data = ELEMENTS_DATA[self.element]
+            self._element = elements.get_element(element)
         except KeyError:
             raise ValueError('"' + str(element) + '" is not a valid element.')
 
+        if isotope:
+            try:
+                elements.isotope_mass(self._element.atomic_number, isotope)
+            except KeyError:
+                raise ValueError('"' + str(isotope) + '" is not a known isotope of ' + self._element.name + '.')
         self.isotope = isotope
         self.charge = charge
         self.aromatic = aromatic
         self.isomer = isomer
+        self._hydrogen_count = hydrogen_count
+
+    @property
+    def element(self):
+        return self._element.name
+
+    @property
+    def symbol(self):
+        return self._element.symbol
+
+    @property
+    def atomic_number(self):
+        return self._element.atomic_number
+
+    @property
+    def atomic_weight(self):
+        return self._element.atomic_weight
+
+    @property
+    def mass(self):
+        """
+        The monoisotopic mass of the isotope of the atom if it has one, its standard atomic weight otherwise.
+        """
+        if self.isotope:
+            return elements.isotope_mass(self._element.atomic_number, self.isotope)
+        return self._element.atomic_weight
+
+    @property
+    def electronegativity(self):
+        return self._element.electronegativity
 
-        self.symbol = element_data['symbol']
-        self.atomic_number = element_data['z']
-        self.atomic_weight = element_data['atomic weight']
-        self.electronegativity = element_data['electronegativity']
+    @property
+    def adj_atoms(self):
+        return self.adj_nodes
+
+    @property
+    def bonds(self):
+        return self.edges
+
+    @property
+    def hydrogen_count(self):
+        """
+        The number of implicit hydrogens: hydrogens that are counted on this atom instead of being separate
+        atoms in the molecule.
+        """
+        return self._hydrogen_count
+
+    @hydrogen_count.setter
+    def hydrogen_count(self, hydrogen_count):
+        self._hydrogen_count = hydrogen_count
+        if self.molecule is not None:
+            self.molecule._cache.clear()
+
+    @property
+    def total_hydrogen_count(self):
+        """
+        The number of implicit hydrogens plus the number of explicit hydrogen atoms bonded to this atom.
+        """
+        return self._hydrogen_count + sum(1 for atom in self.adj_nodes if _is_plain_hydrogen(atom))
 
     def fill_hydrogen(self):
+        """
+        Sets the implicit hydrogen count to the number of hydrogens that fill the valence of the atom. Only
+        atoms of the organic subset (B, C, N, O, P, S and the halogens) get hydrogens.
+        """
         if self.symbol not in ['B', 'C', 'N', 'O', 'P', 'S', 'F', 'Cl', 'Br', 'I']:
             return
 
@@ -57,33 +123,73 @@ class Atom(graph.Node):
         if self.aromatic:
             h_to_add -= 1
 
-        for _ in range(4 - abs(4 - h_to_add)):
-            hydrogen = Atom('H', self.molecule)
-            bond = Bond(self, hydrogen)
-            self.molecule.add_atom(hydrogen)
-            self.molecule.add_bond(bond)
+        self.hydrogen_count = max(0, 4 - abs(4 - h_to_add))
 
     def adjacent_atoms(self):
         return self.adj_nodes
 
-    def bonds(self):
-        return self.edges
-
 
 class Bond(graph.Edge):
+    __slots__ = ('bond_type',)
+
     def __init__(self, atom1, atom2, bond_type='-'):
         """
         Supported bond types are; 'normal', 'double', 'triple', 'quadruple', and 'aromatic'.
         """
         graph.Edge.__init__(self, atom1, atom2)
-        bond_electrons = {'-': 1, '=': 2, '#': 3, '$': 4, ':': 1}
-        self.electron_count = bond_electrons[bond_type]
+        if bond_type not in BOND_ELECTRONS:
+            raise ValueError('"' + str(bond_type) + '" is not a valid bond type.')
         self.bond_type = bond_type
 
+    @property
+    def electron_count(self):
+        return BOND_ELECTRONS[self.bond_type]
+
     def atoms(self):
         return self.sink, self.source
 
 
+def _is_plain_hydrogen(atom):
+    """
+    Whether 'atom' is an ordinary hydrogen atom bonded to a single heavier atom, which could just as well be
+    an implicit hydrogen of that atom.
+    """
+    if atom.symbol != 'H' or atom.isotope or atom.charge or len(atom.bonds) != 1:
+        return False
+    return atom.bonds[0].get_other_node(atom).symbol != 'H'
+
+
+def _heavy_degree(atom):
+    return sum(1 for other_atom in atom.adj_nodes if not _is_plain_hydrogen(other_atom))
+
+
+def _atom_invariant(atom):
+    return (-atom.atomic_number, atom.charge or 0, atom.isotope or 0, len(atom.bonds), atom.hydrogen_count,
+            int(bool(atom.aromatic)))
+
+
+# The hashes are computed on the atoms other than plain hydrogens, with the hydrogens counted per atom, so
+# a molecule has the same hashes with explicit and with implicit hydrogens.
+def _constitution_invariant(atom):
+    return -atom.atomic_number, _heavy_degree(atom), atom.total_hydrogen_count
+
+
+def _isomer_invariant(atom):
+    return -atom.atomic_number, _heavy_degree(atom), atom.total_hydrogen_count, atom.charge or 0, atom.isotope or 0
+
+
+def _bond_invariant(bond):
+    return bond.electron_count
+
+
+# A number per bond type for the hashes, which unlike the electron count tells aromatic and single bonds apart.
+_BOND_CODES = {bond_type: code for code, bond_type in enumerate(BOND_ELECTRONS)}
+
+
+def _bond_code(bond):
+    return _BOND_CODES[bond.bond_type]
+
+
 class Molecule(graph.Graph):
     def __init__(self):
         graph.Graph.__init__(self, directed=False, weighted=False)
@@ -92,12 +198,44 @@ class Molecule(graph.Graph):
         self.bonds = self.edges
         self.electrons = set()
 
-        self.mass = 0
         self.charge = 0
 
+        # results derived from the structure, like canonical ranks and hashes; cleared on every change
+        self._cache = dict()
+
     def __iter__(self):
         yield from (atom for atom in self.nodes)
 
+    def __getstate__(self):
+        """
+        Molecules are pickled as flat lists of atoms and bonds. Pickling the linked Atom and Bond objects
+        directly recurses once per bond and fails on all but the smallest molecules.
+        """
+        atoms = list(self.atoms)
+        index = {atom: i for i, atom in enumerate(atoms)}
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ('nodes', 'edges', 'atoms', 'bonds', '_node_ids', '_cache')}
+        state['atoms'] = [(atom.symbol, atom.isotope, atom.charge, atom.aromatic, atom.isomer, atom.hydrogen_count)
+                          for atom in atoms]
+        state['bonds'] = [(index[bond.source], index[bond.sink], bond.bond_type) for bond in self.bonds]
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        atom_states = state.pop('atoms')
+        bond_states = state.pop('bonds')
+        Molecule.__init__(self)
+        self.__dict__.update(state)
+
+        atoms = list()
+        for symbol, isotope, charge, aromatic, isomer, hydrogen_count in atom_states:
+            atom = Atom(symbol, self, isotope=isotope, charge=charge, aromatic=aromatic, isomer=isomer,
+                        hydrogen_count=hydrogen_count)
+            self.add_node(atom)
+            atoms.append(atom)
+        for source, sink, bond_type in bond_states:
+            self.add_edge(Bond(atoms[source], atoms[sink], bond_type=bond_type))
+
     def yield_bonds(self):
         yield from (bond for bond in self.edges)
 
@@ -113,68 +251,173 @@ class Molecule(graph.Graph):
     def add_atom(self, atom):
         if not isinstance(atom, Atom):
             raise ValueError('"' + str(atom) + '" not of type Atom.')
-        if atom not in self.nodes:
-            self.mass += atom.atomic_weight
+        self._cache.clear()
         self.add_node(atom)
 
     def add_bond(self, bond):
         if not isinstance(bond, Bond):
             raise ValueError('"' + str(bond) + '" not of type Bond.')
+        self._cache.clear()
         self.add_edge(bond)
 
-    def _atom_priority_list(self):
-        atom_priority_list = list()
-
-        # Calculate distance order per atom:
-        distance_order = dict()
-        for atom in self:
-            distance = 0
-            distance_order[atom] = {distance: {atom}}
-            used_atoms = {atom}
-            while True:
-                next_atoms = set()
-                for other_atom in distance_order[atom][distance]:
-                    for adjacent_atom in other_atom.adjacent_atoms:
-                        if adjacent_atom not in used_atoms:
-                            next_atoms.add(adjacent_atom)
-                            used_atoms.add(adjacent_atom)
-                distance += 1
-                distance_order[atom][distance] = next_atoms
-                if not next_atoms:
-                    break
-
-        # Initiate atom_priority_list:
-        for atom in self:
-            atom_priority_list.append([atom, -atom.atomic_number, atom.charge or 0])
-
-        # Build the rest of atom_priority_list:
-        distance = 1
-        while True:
-            go_to_next_iteration = False
-            for item in atom_priority_list:
-                atom = item[0]
-                distance_score = 0
-                if distance in distance_order[atom]:
-                    go_to_next_iteration = True
-                    for other_atom in distance_order[atom][distance]:
-                        distance_score -= other_atom.atomic_number
-                item.append(distance_score)
-            if not go_to_next_iteration:
-                break
-            distance += 1
-
-        # Order the list and return only the atoms:
-        for i in reversed(range(1, distance+3)):
-            atom_priority_list.sort(key=lambda x: x[i])
-        only_atoms = list()
-        for item in atom_priority_list:
-            only_atoms.append(item[0])
-        return only_atoms
+    def remove_atom(self, atom):
+        self._cache.clear()
+        self.remove_node(atom)
+
+    def remove_bond(self, bond):
+        self._cache.clear()
+        self.remove_edge(bond)
+
+    def add_hydrogens(self):
+        """
+        Replaces the implicit hydrogens of every atom by explicit hydrogen atoms.
+        """
+        for atom in list(self.atoms):
+            for _ in range(atom.hydrogen_count):
+                hydrogen = Atom('H', self)
+                self.add_atom(hydrogen)
+                self.add_bond(Bond(atom, hydrogen))
+            atom.hydrogen_count = 0
+
+    def remove_hydrogens(self):
+        """
+        Replaces every ordinary hydrogen atom bonded to a heavier atom by an implicit hydrogen of that atom.
+        Hydrogens with an isotope or a charge, and hydrogens bonded to hydrogen, stay explicit.
+        """
+        for atom in list(self.atoms):
+            if _is_plain_hydrogen(atom):
+                heavy_atom = atom.bonds[0].get_other_node(atom)
+                self.remove_atom(atom)
+                heavy_atom.hydrogen_count += 1
+
+    @property
+    def mass(self):
+        hydrogen_weight = elements.get_element(1).atomic_weight
+        return self._cached('mass', lambda: sum(atom.mass + atom.hydrogen_count * hydrogen_weight
+                                                for atom in self.atoms))
+
+    def formula(self):
+        """
+        Returns the molecular formula in Hill notation: carbon first, then hydrogen, then the other elements
+        alphabetically. Without carbon, all elements are alphabetical. Implicit hydrogens are counted.
+        """
+        counts = dict()
+        for atom in self.atoms:
+            counts[atom.symbol] = counts.get(atom.symbol, 0) + 1
+            if atom.hydrogen_count:
+                counts['H'] = counts.get('H', 0) + atom.hydrogen_count
+        symbols = sorted(counts)
+        if 'C' in counts:
+            symbols = ['C'] + [symbol for symbol in ['H'] if symbol in counts] + \
+                      [symbol for symbol in symbols if symbol not in ('C', 'H')]
+        return ''.join(symbol + (str(counts[symbol]) if counts[symbol] > 1 else '') for symbol in symbols)
+
+    def _cached(self, key, compute):
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    def canonical_ranks(self):
+        """
+        Returns a dict mapping every atom to its canonical rank. Two molecules with the same structure get the
+        same ranks for corresponding atoms, however they were built. Heavier atoms come first.
+        """
+        return self._cached('canonical_ranks',
+                            lambda: graph.canonical_ranks(self, _atom_invariant, _bond_invariant))
+
+    def canonical_order(self):
+        """
+        Returns the atoms ordered by canonical rank.
+        """
+        ranks = self.canonical_ranks()
+        return sorted(ranks, key=ranks.get)
+
+    def ring_info(self):
+        """
+        Returns the graph.RingInfo of the molecule: the cyclomatic number, the smallest set of smallest rings
+        and the relevant cycles, with every ring as a tuple of atoms in ring order.
+        """
+        return self._cached('ring_info', lambda: graph.perceive_rings(self))
+
+    def cyclomatic_number(self):
+        return self.ring_info().cyclomatic_number
+
+    def sssr(self):
+        return self.ring_info().sssr
+
+    def relevant_cycles(self):
+        return self.ring_info().relevant_cycles
+
+    def ring_systems(self):
+        """
+        Returns the ring systems of the molecule as a tuple of frozensets of atoms: fused and bridged rings
+        share a ring system; spiro rings, which only share an atom, and rings joined by a chain or a single
+        bond do not.
+        """
+        return self._cached('ring_systems', lambda: tuple(
+            frozenset(atom for bond in component for atom in bond.atoms())
+            for component in graph.biconnected_components(self) if len(component) > 1))
+
+    def chain_bonds(self):
+        """
+        Returns the bonds that are not in any ring: the side chains and the linkers between ring systems.
+        """
+        return self._cached('chain_bonds', lambda: tuple(graph.bridges(self)))
+
+    def longest_carbon_chains(self, include_rings=False):
+        """
+        Returns the longest chains of carbon atoms as a tuple of tuples of atoms, every chain in one direction
+        only. Ring atoms are left out unless 'include_rings', so the chains are found in linear time; with
+        ring atoms the search is bounded, see graph.longest_paths.
+        """
+        def compute():
+            if include_rings:
+                carbon_atoms = [atom for atom in self.atoms if atom.symbol == 'C']
+            else:
+                ring_atoms = set().union(*self.ring_systems())
+                carbon_atoms = [atom for atom in self.atoms if atom.symbol == 'C' and atom not in ring_atoms]
+            return tuple(tuple(chain) for chain in graph.longest_paths(self, carbon_atoms))
+        return self._cached(('longest_carbon_chains', include_rings), compute)
+
+    def distance_matrix(self):
+        """
+        Returns the topological distance, in bonds, between every pair of atoms as a read-only NumPy array in
+        the order of self.atoms. See graph.distance_matrix for the type of the matrix. The matrix is cached
+        until the molecule changes. Requires NumPy.
+        """
+        def compute():
+            matrix = graph.distance_matrix(self)
+            matrix.flags.writeable = False
+            return matrix
+        return self._cached('distance_matrix', compute)
+
+    def wiener_index(self):
+        """
+        The sum of the distances between all pairs of atoms other than plain hydrogens.
+        """
+        return int(topological_descriptors([self]).wiener_indices[0])
+
+    def diameter(self):
+        """
+        The largest distance between two connected atoms other than plain hydrogens.
+        """
+        return int(topological_descriptors([self]).diameters[0])
+
+    def eccentricities(self):
+        """
+        Returns a dict with the largest distance from every atom other than plain hydrogens to another such
+        atom it is connected to.
+        """
+        heavy_atoms = [atom for atom in self.atoms if not _is_plain_hydrogen(atom)]
+        return dict(zip(heavy_atoms, topological_descriptors([self]).eccentricities[0].tolist()))
 
     def bond_table(self, include_bonds=True):
         bond_table = list()
 
-        atom_priority_list = self.atom_priority_list
+        ranks = self.canonical_ranks()
+        atom_priority_list = sorted(ranks, key=ranks.get)
 
         atom_numbering = dict()
         atom_to_string = dict()
@@ -187,60 +430,88 @@ class Molecule(graph.Graph):
 
         for atom in atom_priority_list:
             # sort the other_atom variable based on priority:
-            adjacent_atoms = atom.bonds
-            other_atoms = list()
-            for other_atom in atom_priority_list:
-                if other_atom in adjacent_atoms:
-                    other_atoms.append(other_atom)
-
-            for other_atom in other_atoms:
+            for bond in sorted(atom.bonds, key=lambda bond: ranks[bond.get_other_node(atom)]):
+                other_atom = bond.get_other_node(atom)
+                # every bond is listed once, from the atom with the highest priority
+                if ranks[other_atom] < ranks[atom]:
+                    continue
                 bond_string = ''
                 if include_bonds:
-                    bond_type = atom.bonds[other_atom]
-                    bond_string = ',' + bond_type
-                entry = (atom_to_string[atom] + ',' + atom_to_string[other_atom] + bond_string + '\n')
-                other_entry = (atom_to_string[other_atom] + ',' + atom_to_string[atom] + bond_string + '\n')
-                if other_entry not in bond_table:
-                    bond_table.append(entry)
+                    bond_string = ',' + bond.bond_type
+                bond_table.append(atom_to_string[atom] + ',' + atom_to_string[other_atom] + bond_string + '\n')
         return ''.join(bond_table)
 
     def hash_molecule(self):
-        md5 = hashlib.md5()
-        md5.update(self.bond_table(include_bonds=False).encode('utf-8'))
-        return codecs.encode(md5.digest(), 'hex')
+        """
+        Returns a 16 byte digest of the elements, the connectivity of the atoms and the bond types. Molecules
+        with the same structure have the same digest, whatever the order of their atoms and bonds. The digest
+        is cached until the molecule changes.
+        """
+        return self._cached('hash_molecule', lambda: self._digest(_constitution_invariant))
 
     def hash_isomer(self):
-        md5 = hashlib.md5()
-        non_hashed_string = self.bond_table(include_bonds=False)
-
-        charges = ''
-        chiralities = ''
-        for atom in self.atom_priority_list:
-            charges += str(atom.charge)
-
-        non_hashed_string += charges + chiralities
-        md5.update(non_hashed_string.encode('utf-8'))
-        return codecs.encode(md5.digest(), 'hex')
-
-    def _fill_hydrogen(self):
-        bond_electrons = {'-': 1, '=': 2, '#': 3, '$': 4, ':': 1}
+        """
+        Like hash_molecule, but charges and isotopes are taken into account as well.
+        """
+        return self._cached('hash_isomer', lambda: self._digest(_isomer_invariant))
 
-        for atom in self.atoms.copy():
-            try:
-                hydrogen_to_add = atom.hydrogen_count
-            except AttributeError:
-                hydrogen_to_add = 0
-                if atom.symbol in ['B', 'C', 'N', 'O', 'P', 'S', 'F', 'Cl', 'Br', 'I']:
-                    bonded_electrons = 0
-                    for bond in atom.bonds.values():
-                        bonded_electrons += bond_electrons[bond]
-                    if atom.aromatic:
-                        bonded_electrons += 1
-                    hydrogen_to_add = 18 - (atom.group + bonded_electrons)
-                    if atom.charge:
-                        hydrogen_to_add += atom.charge
-
-            for _ in range(hydrogen_to_add):
-                hydrogen = Atom('H', self)
-                self.add_atom(hydrogen)
-                self.add_bond(atoms={atom, hydrogen})
+    def _digest(self, atom_invariant):
+        """
+        Hashes the atom invariants in canonical order, followed by the bonds as (rank, rank, bond type)
+        triples of canonical ranks. The values are packed into a single array of integers, so no strings are
+        built. Plain hydrogen atoms are only counted in the invariants of the atoms they are bonded to.
+        """
+        heavy_atoms = [atom for atom in self.atoms if not _is_plain_hydrogen(atom)]
+        ranks = graph.canonical_ranks(self, atom_invariant, _bond_code, nodes=heavy_atoms)
+        values = array('q', [len(ranks)])
+        for atom in sorted(ranks, key=ranks.get):
+            values.extend(atom_invariant(atom))
+        rank_triples = list()
+        for bond in self.bonds:
+            if bond.source not in ranks or bond.sink not in ranks:
+                continue
+            source_rank, sink_rank = ranks[bond.source], ranks[bond.sink]
+            if source_rank < sink_rank:
+                rank_triples.append((source_rank, sink_rank, _bond_code(bond)))
+            else:
+                rank_triples.append((sink_rank, source_rank, _bond_code(bond)))
+        rank_triples.sort()
+        for rank_triple in rank_triples:
+            values.extend(rank_triple)
+        return hashlib.blake2b(values.tobytes(), digest_size=16).digest()
+
+
+# Descriptors of the distance matrices of a batch of molecules, over the atoms other than plain hydrogens:
+# arrays with the Wiener index and the diameter of every molecule, and per molecule an array with the
+# eccentricity of every such atom, in the order of molecule.atoms.
+TopologicalDescriptors = namedtuple('TopologicalDescriptors', ['wiener_indices', 'diameters', 'eccentricities'])
+
+
+def topological_descriptors(molecules):
+    """
+    Computes the Wiener index, the diameter and the atom eccentricities of a batch of molecules at once. The
+    distance matrices of the molecules, without plain hydrogens, are padded into a single array, so every
+    descriptor is one NumPy reduction over the whole batch. Pairs of atoms that are not connected, like the
+    ions of a salt, are left out. Requires NumPy.
+    """
+    import numpy
+    matrices = list()
+    for molecule in molecules:
+        heavy_indices = [i for i, atom in enumerate(molecule.atoms) if not _is_plain_hydrogen(atom)]
+        matrix = molecule.distance_matrix()
+        if len(heavy_indices) < len(matrix):
+            matrix = matrix[numpy.ix_(heavy_indices, heavy_indices)]
+        matrices.append(matrix)
+
+    size = max((len(matrix) for matrix in matrices), default=0)
+    dtype = numpy.result_type(numpy.uint8, *(matrix.dtype for matrix in matrices))
+    batch = numpy.zeros((len(matrices), size, size), dtype=dtype)
+    for i, matrix in enumerate(matrices):
+        unreachable = numpy.iinfo(matrix.dtype).max
+        batch[i, :len(matrix), :len(matrix)] = numpy.where(matrix == unreachable, 0, matrix)
+
+    eccentricities = batch.max(axis=2)
+    wiener_indices = batch.sum(axis=(1, 2), dtype=numpy.int64) // 2
+    diameters = eccentricities.max(axis=1, initial=0)
+    return TopologicalDescriptors(wiener_indices, diameters,
+                                  [eccentricities[i, :len(matrix)] for i, matrix in enumerate(matrices)])
@@ -1,4 +1,5 @@
 from pychem.molecule.molecule import Molecule
+from pychem.molecule import substructure
 
 import json
 import os
@@ -12,41 +13,63 @@ with open(DATA_DIR + 'carbon_prefixes.json') as jf:
     CARBON_PREFIXES = json.load(jf)
 
 
+_FUNCTIONAL_GROUPS = None
+
+
+def functional_groups():
+    """
+    Returns a dict with a compiled substructure.Query for every group in group_nomeclature.json that has a
+    formula. The queries are compiled on first use.
+    """
+    global _FUNCTIONAL_GROUPS
+    if _FUNCTIONAL_GROUPS is None:
+        with open(DATA_DIR + 'group_nomeclature.json') as jf:
+            groups = json.load(jf)
+        _FUNCTIONAL_GROUPS = {name: substructure.Query(group['formula'])
+                              for name, group in groups.items() if group and group.get('formula')}
+    return _FUNCTIONAL_GROUPS
+
+
+def find_functional_groups(molecules):
+    """
+    Yields for every molecule a dict with the number of times every functional group occurs in it, leaving out
+    the groups that do not occur. All groups are matched in a single pass over the molecules.
+    """
+    names = list(functional_groups())
+    for counts in substructure.match_all(functional_groups().values(), molecules, count=True):
+        yield {name: group_count for name, group_count in zip(names, counts) if group_count}
+
+
 def parse_from(name_string):
     pass
 
 
-def parse_to(bonds, atoms):
-    parent_chain = _find_parent_chain(bonds, atoms)
-    side_chains = _find_side_chains(bonds, atoms, parent_chain)
+def parse_to(molecule):
+    parent_chain = _find_parent_chain(molecule)
+    side_chains = _find_side_chains(molecule, parent_chain)
 
 
-def _find_parent_chain(bonds, atoms):
+def _find_parent_chain(molecule):
+    """
+    The parent chain: the longest acyclic carbon chain, and of chains of equal length the one with the most
+    substituents. Returns None if the molecule has no acyclic carbon atoms.
+    """
 
     # todo: if cyclic...
 
-    carbon_atoms = set()
-    for atom in atoms:
-        if atom['symbol'] == 'C':
-            carbon_atoms.add(atom)
-    carbon_bonds = geometrics.list_active_bonds(bonds, carbon_atoms)
-
-    parent_chain_candidates = list()
-    best_substituent_count = 0
-    for carbon_chain in geometrics.list_longest_chains(carbon_bonds, carbon_atoms):
-        substituent_count = 0
-        for bond in bonds:
-            for atom in bond.atoms:
-                if atom['symbol'] != 'H' and atom in carbon_chain:
-                    substituent_count += 1
-        if substituent_count == best_substituent_count:
-            pass
-        else:
-            parent_chain_candidates = [carbon_chain]
-            best_substituent_count = substituent_count
-
-
-def _find_side_chains(bonds, atoms, parent_chain):
+    parent_chain_candidates = molecule.longest_carbon_chains()
+    if not parent_chain_candidates:
+        return None
+    return max(parent_chain_candidates, key=_substituent_count)
+
+
+def _substituent_count(carbon_chain):
+    chain_atoms = set(carbon_chain)
+    return sum(1 for atom in carbon_chain for other_atom in atom.adj_atoms
+               if other_atom.symbol != 'H' and other_atom not in chain_atoms)
+
+
+def _find_side_chains(molecule, parent_chain):
     pass
 
 
@@ -1,95 +1,240 @@
+import os
+from collections import deque, namedtuple
+
 from pychem.molecule.molecule import Molecule, Atom, Bond
 
 
-def parse(smiles_string, molecule=None):
+# The result of parsing one line of bulk input. If parsing failed, 'molecule' is None and 'error' holds the
+# exception.
+SmilesRecord = namedtuple('SmilesRecord', ['line_number', 'identifier', 'smiles', 'molecule', 'error'])
+
+
+def parse(smiles_string, molecule=None, implicit_hydrogens=False):
+    """
+    Parses 'smiles_string' into 'molecule', or into a new Molecule. Atoms of the organic subset get the
+    hydrogens that fill their valence, bracket atoms get the hydrogens that are written in the bracket.
+
+    With 'implicit_hydrogens' the hydrogens are only counted on the atoms they are bonded to, otherwise
+    they are added as explicit atoms.
+    """
     if molecule is None:
         molecule = Molecule()
-    _parse_from_smiles(molecule, smiles_string)
-    for atom in molecule.atoms.copy():
+    for atom in _parse_from_smiles(molecule, smiles_string):
         atom.fill_hydrogen()
+    if not implicit_hydrogens:
+        molecule.add_hydrogens()
     return molecule
 
 
-def _parse_from_smiles(molecule, smiles_string, _active_atom=None, _labels=None):
-    active_atom = _active_atom
-    if _labels is None:
-        labels = dict()
-    else:
-        labels = _labels
-
-    bond_type = '-'
-    for token in _tokenize_smiles(smiles_string):
-        if token[0] == '(':
-            _parse_from_smiles(molecule, token[1:-1], _active_atom=active_atom, _labels=labels)
-        elif token[0] == '[':
-            isotope, element, h_count, charge, chirality = _parse_smiles_parenthesis(token)
-            new_atom = Atom(element, molecule, isotope=isotope, charge=charge, aromatic=element.islower())
-            new_atom.h_count = h_count
-            molecule.add_atom(new_atom)
-            if active_atom:
-                bond = Bond(active_atom, new_atom, bond_type=bond_type)
-                molecule.add_bond(bond)
-            active_atom = new_atom
-            bond_type = '-'
-        elif token.lower() in ['b', 'c', 'n', 'o', 'p', 's', 'f', 'cl', 'br', 'i']:
-            new_atom = Atom(token, molecule, aromatic=token.islower())
-            molecule.add_atom(new_atom)
-            if active_atom:
-                bond = Bond(active_atom, new_atom, bond_type=bond_type)
-                molecule.add_bond(bond)
-            active_atom = new_atom
-            bond_type = '-'
-        elif token[0] == '%':
-            label = token[1:]
-            if label not in labels:
-                labels[label] = active_atom
+def parse_many(lines, workers=None, chunk_size=256, ordered=True, transform=None, executor=None,
+               max_pending=None, implicit_hydrogens=True):
+    """
+    Parses an iterable of lines with one SMILES each, optionally followed by whitespace and an identifier,
+    and yields a SmilesRecord for every non-empty line. The lines are read lazily, so memory use does not
+    grow with the input.
+
+    The lines are parsed in chunks of 'chunk_size' by a ProcessPoolExecutor with 'workers' processes (the
+    number of CPUs by default), or by 'executor' if one is given. With 'workers' equal to 0 everything is
+    parsed in this process. At most 'max_pending' chunks (twice the number of workers by default) are in
+    flight at any time. If 'ordered' is false, records are yielded as soon as their chunk is done instead
+    of in input order.
+
+    'transform' is applied to every parsed molecule in the worker and its result is yielded instead of the
+    molecule, e.g. Molecule.hash_molecule to only get the hashes back. It must be picklable.
+
+    The molecules are parsed with implicit hydrogens by default, which keeps them about four times smaller.
+
+    A line that fails to parse does not stop the stream; its record has the exception in 'error'.
+    """
+    chunks = _chunks(_split_smiles_lines(lines), chunk_size)
+    if executor is None and workers == 0:
+        for chunk in chunks:
+            yield from _parse_chunk(chunk, transform, implicit_hydrogens)
+        return
+
+    own_executor = executor is None
+    if own_executor:
+        # imported here, because concurrent.futures makes importing pychem noticeably slower
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    if max_pending is None:
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    pending = deque() if ordered else set()
+    try:
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                yield from _collect_chunks(pending, ordered)
+            future = executor.submit(_parse_chunk, chunk, transform, implicit_hydrogens)
+            if ordered:
+                pending.append(future)
             else:
-                bond = Bond(active_atom, labels[label], bond_type=bond_type)
-                molecule.add_bond(bond)
-                bond_type = '-'
-        elif token in ['-', '=', '#', '$', ':']:
-            bond_type = token
+                pending.add(future)
+        while pending:
+            yield from _collect_chunks(pending, ordered)
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def parse_file(path, **kwargs):
+    """
+    Parses a file with one SMILES per line, see parse_many for the options.
+    """
+    with open(path) as smiles_file:
+        yield from parse_many(smiles_file, **kwargs)
+
+
+def _split_smiles_lines(lines):
+    for line_number, line in enumerate(lines, 1):
+        fields = line.split(None, 1)
+        if not fields:
+            continue
+        identifier = fields[1].strip() if len(fields) > 1 else None
+        yield line_number, identifier, fields[0]
 
 
-def _tokenize_smiles(smiles_string):
+def _chunks(iterable, chunk_size):
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def _parse_chunk(chunk, transform, implicit_hydrogens):
+    records = list()
+    for line_number, identifier, smiles_string in chunk:
+        try:
+            molecule = parse(smiles_string, implicit_hydrogens=implicit_hydrogens)
+            if transform is not None:
+                molecule = transform(molecule)
+        except Exception as error:
+            records.append(SmilesRecord(line_number, identifier, smiles_string, None, error))
+        else:
+            records.append(SmilesRecord(line_number, identifier, smiles_string, molecule, None))
+    return records
+
+
+def _collect_chunks(pending, ordered):
+    """
+    Waits for the oldest chunk if the output is ordered, or for any chunk otherwise, and returns its records.
+    """
+    if ordered:
+        return pending.popleft().result()
+    from concurrent.futures import FIRST_COMPLETED, wait
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    records = list()
+    for future in done:
+        pending.remove(future)
+        records.extend(future.result())
+    return records
+
+
+ORGANIC_SUBSET = {'B', 'C', 'N', 'O', 'P', 'S', 'F', 'Cl', 'Br', 'I', 'b', 'c', 'n', 'o', 'p', 's'}
+
+
+def _parse_from_smiles(molecule, smiles_string):
+    """
+    Reads 'smiles_string' in a single pass and adds its atoms and bonds to 'molecule' as they are read. Open
+    branches are kept on an explicit stack instead of being parsed recursively, so deeply branched SMILES
+    take linear time and do not hit the recursion limit.
+
+    Returns the atoms of the organic subset, whose hydrogens are not written in the SMILES.
+    """
+    organic_atoms = list()
+    active_atom = None
+    bond_type = None
+    branches = list()
+    ring_bonds = dict()
+
     index = 0
-    while index < len(smiles_string):
-        if smiles_string[index] == '(':
-            right_brack = index
-            while index < len(smiles_string):
-                right_brack = smiles_string.find(')', right_brack) + 1
-                if right_brack == 0:
-                    raise ValueError
-                bracketed_string = smiles_string[index:right_brack]
-                if bracketed_string.count('(') == bracketed_string.count(')'):
-                    yield bracketed_string
-                    index = right_brack
-                    break
-        elif smiles_string[index] == '[':
+    length = len(smiles_string)
+    while index < length:
+        char = smiles_string[index]
+        if char == '[':
             right_brack = smiles_string.find(']', index) + 1
             if right_brack == 0:
-                raise ValueError
-            yield smiles_string[index:right_brack]
+                raise ValueError('Bracket atom at position ' + str(index) + ' is not closed.')
+            isotope, element, h_count, charge, chirality = _parse_smiles_parenthesis(
+                smiles_string[index:right_brack])
+            new_atom = Atom(element, molecule, isotope=isotope, charge=charge, aromatic=element.islower(),
+                            isomer=chirality or None, hydrogen_count=h_count)
             index = right_brack
-        elif smiles_string[index] == '%':
-            label_string = '%'
-            while index + 1 < len(smiles_string):
+        elif char in ORGANIC_SUBSET:
+            element = smiles_string[index:index+2]
+            if element not in ('Cl', 'Br'):
+                element = char
+            new_atom = Atom(element, molecule, aromatic=element.islower())
+            organic_atoms.append(new_atom)
+            index += len(element)
+        elif char == '(':
+            if active_atom is None:
+                raise ValueError('Branch at position ' + str(index) + ' does not follow an atom.')
+            branches.append(active_atom)
+            index += 1
+            continue
+        elif char == ')':
+            if not branches:
+                raise ValueError('Unmatched ")" at position ' + str(index) + '.')
+            active_atom = branches.pop()
+            index += 1
+            continue
+        elif char in '-=#$:':
+            bond_type = char
+            index += 1
+            continue
+        elif char in '/\\':
+            # directional single bonds; the cis/trans information is not stored
+            bond_type = '-'
+            index += 1
+            continue
+        elif char == '.':
+            active_atom = None
+            bond_type = None
+            index += 1
+            continue
+        elif char in '0123456789%':
+            label_position = index
+            if char == '%':
+                label = smiles_string[index+1:index+3]
+                if len(label) != 2 or not label.isdigit():
+                    raise ValueError('Ring label at position ' + str(index) + ' should have two digits.')
+                index += 3
+            else:
+                label = char
                 index += 1
-                if smiles_string[index] in '0123456789':
-                    label_string += smiles_string[index]
-                else:
-                    break
-            yield label_string
-        else:
-            if smiles_string[index] in '0123456789':
-                yield '%' + smiles_string[index]
+            if active_atom is None:
+                raise ValueError('Ring label "' + label + '" does not follow an atom.')
+            if label in ring_bonds:
+                other_atom, other_bond_type = ring_bonds.pop(label)
+                if other_atom is active_atom:
+                    raise ValueError('Ring label "' + label + '" at position ' + str(label_position)
+                                     + ' closes on the atom that opened it.')
+                molecule.add_bond(Bond(other_atom, active_atom, bond_type=bond_type or other_bond_type or '-'))
             else:
-                element_string = smiles_string[index]
-                if index+1 < len(smiles_string) and smiles_string[index+1].islower():
-                    element_string += smiles_string[index+1]
-                    index += 1
-                yield element_string
-            index += 1
+                ring_bonds[label] = (active_atom, bond_type)
+            bond_type = None
+            continue
+        elif char in ' \t\r\n':
+            break
+        else:
+            raise ValueError('Unexpected character "' + char + '" at position ' + str(index) + '.')
+
+        molecule.add_atom(new_atom)
+        if active_atom is not None:
+            molecule.add_bond(Bond(active_atom, new_atom, bond_type=bond_type or '-'))
+        active_atom = new_atom
+        bond_type = None
+
+    if branches:
+        raise ValueError('Unmatched "(" in "' + smiles_string + '".')
+    if ring_bonds:
+        raise ValueError('Ring labels ' + ', '.join(sorted(ring_bonds)) + ' are not closed.')
+    return organic_atoms
 
 
 def _parse_smiles_parenthesis(token):
@@ -116,6 +261,20 @@ def _parse_smiles_parenthesis(token):
             break
         element += token[index]
         index += 1
+    # parse the chirality from the token:
+    if index < len(token) and token[index] == '@':
+        chirality += '@'
+        index += 1
+        if index < len(token) and token[index] == '@':
+            chirality += '@'
+            index += 1
+        if index+1 < len(token) and token[index:index+2] in ['TH', 'AL', 'SP', 'TB', 'OH']:
+            # TH: Tetrahedral, AL: Allenal, SP: Square Planar, TB: Trigonal Bipyramidal, OH: Octahedral
+            chirality += token[index:index+2]
+            index += 2
+            while index < len(token) and token[index] in '0123456789':
+                chirality += token[index]
+                index += 1
     # parse the hydrogen count from the token:
     if index < len(token) and token[index] == 'H':
         index += 1
@@ -123,8 +282,7 @@ def _parse_smiles_parenthesis(token):
         while index < len(token) and token[index] in '0123456789':
             h_count_string += token[index]
             index += 1
-        if h_count_string:
-            h_count = int(h_count_string)
+        h_count = int(h_count_string) if h_count_string else 1
     # parse the charge from the token:
     if index < len(token) and token[index] in '-+':
         charge_string = ''
@@ -137,15 +295,4 @@ def _parse_smiles_parenthesis(token):
                 charge *= -1
         except ValueError:
             charge = charge_string.count('+') - charge_string.count('-')
-    # parse the chirality from the token:
-    if index < len(token) and token[index] == '@':
-        chirality += '@'
-        index += 1
-        if index < len(token) and token[index] == '@':
-            chirality += '@'
-            index += 1
-        if index+1 < len(token) and token[index:index+2] in ['TH', 'AL', 'SP', 'TB', 'OH']:
-            # TH: Tetrahedral, AL: Allenal, SP: Square Planar, TB: Trigonal Bipyramidal, OH: Octahedral
-            chirality += token[index:index+2]
-
     return isotope, element, h_count, charge, chirality
@@ -0,0 +1,254 @@
+from collections import Counter
+
+from pychem.molecule.molecule import BOND_ELECTRONS, Molecule, _is_plain_hydrogen
+from pychem.molecule.parsers import smiles
+
+
+class Query:
+    """
+    A substructure query compiled from a SMILES pattern or a molecule, to be matched against many molecules.
+
+    Query atoms match atoms of the same element, aromaticity and charge with at least as many neighbors other
+    than hydrogen. Query bonds match bonds of the same type; bonds between two aromatic atoms count as
+    aromatic bonds. The hydrogens written in bracket atoms, and all hydrogens of a query molecule, are a
+    minimum; atoms of the organic subset match any number of hydrogens.
+
+    A pattern that starts with a bond, like '-C(=O)O', is a group: it is attached by that bond to any atom
+    other than hydrogen, its atoms have no other neighbors and at least the hydrogens that fill their valence.
+    So '-C(=O)O' matches a carboxylic acid and not an ester.
+
+    The atoms are matched in an order that starts at a heteroatom if there is one and always extends the
+    match along a bond (VF2), so every candidate atom is a neighbor of an atom that is already matched.
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        attachment = None
+        organic_atoms = ()
+        if isinstance(pattern, str):
+            if pattern and pattern[0] in '-=#$:':
+                attachment, pattern = pattern[0], pattern[1:]
+            molecule = Molecule()
+            organic_atoms = smiles._parse_from_smiles(molecule, pattern)
+            for atom in organic_atoms:
+                atom.fill_hydrogen()
+            pattern = molecule
+        self.exact_degree = attachment is not None
+        atoms = [atom for atom in pattern.atoms if not _is_plain_hydrogen(atom)]
+        if not atoms:
+            raise ValueError('"' + str(self.pattern) + '" has no atoms to match.')
+        index = {atom: i for i, atom in enumerate(atoms)}
+
+        self.symbols = [atom.symbol for atom in atoms]
+        self.aromatic = [bool(atom.aromatic) for atom in atoms]
+        self.charges = [atom.charge or 0 for atom in atoms]
+        self.hydrogens = [atom.total_hydrogen_count for atom in atoms]
+        if not self.exact_degree:
+            for atom in organic_atoms:
+                self.hydrogens[index[atom]] = 0
+        bonds = {i: dict() for i in range(len(atoms))}
+        for bond in pattern.bonds:
+            if bond.source in index and bond.sink in index:
+                source, sink = index[bond.source], index[bond.sink]
+                bonds[source][sink] = bonds[sink][source] = _bond_key(bond)
+        if attachment is not None:
+            # the atom the pattern is attached to: any element, one valence of the first atom
+            wildcard = len(atoms)
+            self.symbols.append(None)
+            self.aromatic.append(None)
+            self.charges.append(None)
+            self.hydrogens.append(0)
+            self.hydrogens[0] = max(0, self.hydrogens[0] - BOND_ELECTRONS[attachment])
+            bonds[wildcard] = {0: attachment}
+            bonds[0][wildcard] = attachment
+        self.neighbors = [bonds[i] for i in range(len(self.symbols))]
+        self.degrees = [len(neighbors) for neighbors in self.neighbors]
+        self.element_counts = Counter(symbol for symbol in self.symbols if symbol is not None)
+        self._compile_order(bonds)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _compile_order(self, bonds):
+        """
+        Orders the query atoms for the search: every atom follows an atom it is bonded to if it can, and the
+        most connected atoms come first. Every position stores the position of the atom it extends, the bond
+        to it, and the bonds to the other atoms earlier in the order.
+        """
+        order = list()
+        placed = dict()
+        while len(order) < len(self.symbols):
+            frontier = [i for i in range(len(self.symbols)) if i not in placed
+                        and any(other in placed for other in bonds[i])]
+            if not frontier:
+                # the first atom of a fragment: carbon is the most common element in the targets
+                frontier = [i for i in range(len(self.symbols)) if i not in placed]
+                new_atom = min(frontier, key=lambda i: (self.symbols[i] is None, self.symbols[i] == 'C',
+                                                        -self.degrees[i], i))
+            else:
+                new_atom = max(frontier, key=lambda i: (sum(1 for other in bonds[i] if other in placed),
+                                                        self.symbols[i] is not None, self.degrees[i], -i))
+            placed[new_atom] = len(order)
+            order.append(new_atom)
+
+        self.order = order
+        self.parents = list()
+        self.parent_bonds = list()
+        self.back_bonds = list()
+        for position, atom in enumerate(order):
+            earlier = sorted((placed[other], bond_key) for other, bond_key in bonds[atom].items()
+                             if placed[other] < position)
+            if earlier:
+                self.parents.append(earlier[0][0])
+                self.parent_bonds.append(earlier[0][1])
+                self.back_bonds.append(earlier[1:])
+            else:
+                self.parents.append(-1)
+                self.parent_bonds.append(None)
+                self.back_bonds.append(())
+
+    def has_match(self, molecule):
+        return next(self._search(_target(molecule)), None) is not None
+
+    def find_matches(self, molecule, unique=True, max_matches=None):
+        """
+        Returns the matches in 'molecule' as tuples of atoms in the order of the query atoms, with the atom
+        the pattern is attached to last. With 'unique', matches of the same set of atoms are returned once.
+        """
+        target = _target(molecule)
+        matches = list()
+        seen = set()
+        for mapping in self._search(target):
+            if max_matches is not None and len(matches) >= max_matches:
+                break
+            if unique:
+                key = frozenset(mapping)
+                if key in seen:
+                    continue
+                seen.add(key)
+            matches.append(tuple(target.atoms[target_atom] for target_atom in mapping))
+        return matches
+
+    def count_matches(self, molecule, unique=True):
+        return len(self.find_matches(molecule, unique))
+
+    def _search(self, target):
+        """
+        Yields every mapping of the query atoms, in query atom order, onto indexes of target atoms.
+        """
+        for symbol, query_count in self.element_counts.items():
+            if target.element_counts[symbol] < query_count:
+                return
+        if len(self.symbols) > len(target.atoms):
+            return
+
+        size = len(self.order)
+        mapped = [-1] * size
+        used = bytearray(len(target.atoms))
+        candidates = [None] * size
+        candidates[0] = iter(self._candidates(target, mapped, 0))
+        position = 0
+        while position >= 0:
+            if mapped[position] >= 0:
+                used[mapped[position]] = 0
+                mapped[position] = -1
+            for target_atom in candidates[position]:
+                if not used[target_atom] and self._feasible(target, mapped, position, target_atom):
+                    break
+            else:
+                position -= 1
+                continue
+            mapped[position] = target_atom
+            used[target_atom] = 1
+            if position + 1 == size:
+                mapping = [0] * size
+                for query_position, query_atom in enumerate(self.order):
+                    mapping[query_atom] = mapped[query_position]
+                yield mapping
+            else:
+                position += 1
+                candidates[position] = iter(self._candidates(target, mapped, position))
+
+    def _candidates(self, target, mapped, position):
+        parent = self.parents[position]
+        if parent < 0:
+            symbol = self.symbols[self.order[position]]
+            return range(len(target.atoms)) if symbol is None else target.by_symbol.get(symbol, ())
+        parent_bond = self.parent_bonds[position]
+        return [target_atom for target_atom, bond_key in target.neighbors[mapped[parent]].items()
+                if bond_key == parent_bond]
+
+    def _feasible(self, target, mapped, position, target_atom):
+        query_atom = self.order[position]
+        symbol = self.symbols[query_atom]
+        if symbol is not None:
+            if (target.symbols[target_atom] != symbol or target.aromatic[target_atom] != self.aromatic[query_atom]
+                    or target.charges[target_atom] != self.charges[query_atom]):
+                return False
+        neighbors = target.neighbors[target_atom]
+        if target.hydrogens[target_atom] < self.hydrogens[query_atom] or len(neighbors) < self.degrees[query_atom]:
+            return False
+        if self.exact_degree and symbol is not None and len(neighbors) != self.degrees[query_atom]:
+            return False
+        for earlier, bond_key in self.back_bonds[position]:
+            if neighbors.get(mapped[earlier]) != bond_key:
+                return False
+        return True
+
+
+def _bond_key(bond):
+    if bond.bond_type == ':' or (bond.bond_type == '-' and bond.source.aromatic and bond.sink.aromatic):
+        return ':'
+    return bond.bond_type
+
+
+class _Target:
+    """
+    The atoms of a molecule other than plain hydrogens, with the properties queries match on, indexed for
+    the search. It is cached on the molecule until the molecule changes.
+    """
+    __slots__ = ('atoms', 'symbols', 'aromatic', 'charges', 'hydrogens', 'neighbors', 'by_symbol',
+                 'element_counts')
+
+    def __init__(self, molecule):
+        self.atoms = [atom for atom in molecule.atoms if not _is_plain_hydrogen(atom)]
+        index = {atom: i for i, atom in enumerate(self.atoms)}
+        self.symbols = [atom.symbol for atom in self.atoms]
+        self.aromatic = [bool(atom.aromatic) for atom in self.atoms]
+        self.charges = [atom.charge or 0 for atom in self.atoms]
+        self.hydrogens = [atom.total_hydrogen_count for atom in self.atoms]
+        self.neighbors = [dict() for _ in self.atoms]
+        for bond in molecule.bonds:
+            if bond.source in index and bond.sink in index:
+                source, sink = index[bond.source], index[bond.sink]
+                self.neighbors[source][sink] = self.neighbors[sink][source] = _bond_key(bond)
+        self.by_symbol = dict()
+        for i, symbol in enumerate(self.symbols):
+            self.by_symbol.setdefault(symbol, list()).append(i)
+        self.element_counts = Counter(self.symbols)
+
+
+def _target(molecule):
+    return molecule._cached('substructure_target', lambda: _Target(molecule))
+
+
+def compile_query(pattern):
+    """
+    Returns 'pattern' as a Query; a Query is returned as it is.
+    """
+    if isinstance(pattern, Query):
+        return pattern
+    return Query(pattern)
+
+
+def match_all(queries, molecules, count=False):
+    """
+    Matches every query against every molecule in a single pass over the molecules, which may be a
+    generator. The queries are compiled once. Yields for every molecule a list with, for every query,
+    whether it matches, or the number of unique matches if 'count'.
+    """
+    queries = [compile_query(query) for query in queries]
+    for molecule in molecules:
+        if count:
+            yield [query.count_matches(molecule) for query in queries]
+        else:
+            yield [query.has_match(molecule) for query in queries]
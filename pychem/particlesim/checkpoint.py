@@ -0,0 +1,174 @@
+from collections import namedtuple
+import json
+import os
+import random
+import re
+import tempfile
+
+
+# The simulation state restored from a checkpoint file: the number of steps done and the simulated time.
+Restored = namedtuple('Restored', ['path', 'step', 'time'])
+
+_NAME_PATTERN = re.compile(r'^checkpoint-(\d+)\.npz$')
+
+
+class Checkpoints:
+    """
+    Periodic binary checkpoints of a simulation in 'directory', one .npz file per checkpoint: the particle
+    arrays, the step counter and the time, the states of the integrator, the force backend, the trajectory
+    writer and the conservation monitor, and the states of the random generators: Python's random module and
+    'rng', a numpy.random.Generator, if given. Restoring the latest checkpoint continues the simulation exactly
+    as if it had not been interrupted.
+
+    A checkpoint is written every 'interval' steps to a temporary file that replaces the final name only when
+    it is complete, so an interruption never leaves a broken checkpoint. After every checkpoint the oldest are
+    removed but the last 'keep' ones, and with 'keep_every' also those of every 'keep_every'-th step.
+    Requires NumPy.
+    """
+    def __init__(self, directory, interval, keep=3, keep_every=None, rng=None):
+        if interval < 1:
+            raise ValueError('"' + str(interval) + '" is not a valid checkpoint interval.')
+        if keep < 1:
+            raise ValueError('At least one checkpoint should be kept.')
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.keep_every = keep_every
+        self.rng = rng
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, step):
+        return os.path.join(self.directory, 'checkpoint-{:012d}.npz'.format(step))
+
+    def steps(self):
+        """
+        The steps of the checkpoints in the directory, in increasing order.
+        """
+        steps = list()
+        for name in os.listdir(self.directory):
+            match = _NAME_PATTERN.match(name)
+            if match:
+                steps.append(int(match.group(1)))
+        return sorted(steps)
+
+    def latest(self):
+        """
+        The path of the checkpoint of the latest step, or None if there is none.
+        """
+        steps = self.steps()
+        return self.path(steps[-1]) if steps else None
+
+    def due(self, step):
+        """
+        Whether a checkpoint is due after 'step' steps.
+        """
+        return step % self.interval == 0
+
+    def save(self, step, time, system, integrator, backend, writer=None, monitor=None):
+        """
+        Writes the checkpoint after 'step' steps and prunes the old ones. Returns its path.
+        """
+        import numpy
+        arrays = {'system/positions': system.positions, 'system/velocities': system.velocities,
+                  'system/masses': system.masses, 'system/charges': system.charges}
+        for prefix, component in (('integrator', integrator), ('backend', backend), ('monitor', monitor)):
+            if component is not None:
+                for key, value in component.get_state().items():
+                    arrays[prefix + '/' + key] = numpy.asarray(value)
+        metadata = {'step': step, 'time': time, 'integrator': type(integrator).__name__,
+                    'backend': type(backend).__name__, 'random': _random_state(),
+                    'rng': self.rng.bit_generator.state if self.rng is not None else None,
+                    'frames': writer.count if writer is not None else None}
+        # a JSON string array loads without pickle
+        arrays['metadata'] = numpy.array(json.dumps(metadata))
+
+        if writer is not None:
+            # the frames a checkpoint refers to should be on disk before the checkpoint
+            writer.flush()
+        path = self.path(step)
+        descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', prefix='checkpoint-', dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as checkpoint_file:
+                numpy.savez(checkpoint_file, **arrays)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        _sync_directory(self.directory)
+        self.prune()
+        return path
+
+    def prune(self):
+        """
+        Removes the checkpoints the retention policy does not keep.
+        """
+        steps = self.steps()
+        for step in steps[:-self.keep]:
+            if self.keep_every is None or step % self.keep_every:
+                os.remove(self.path(step))
+
+    def restore(self, system, integrator, backend, writer=None, monitor=None, path=None):
+        """
+        Loads the latest checkpoint, or the one at 'path', into 'system' and the other parts of the simulation,
+        which should be set up as the run that wrote it, and sets the random generators. A 'monitor' of a run
+        that was checkpointed without one measures the drifts from the restored state. The trajectory of
+        'writer' is cut back to the frames written when the checkpoint was. Returns a Restored, or None if
+        there is no checkpoint.
+        """
+        import numpy
+        path = path or self.latest()
+        if path is None:
+            return None
+        with numpy.load(path) as checkpoint:
+            arrays = {key: checkpoint[key] for key in checkpoint.files}
+        metadata = json.loads(str(arrays.pop('metadata')))
+        if metadata['integrator'] != type(integrator).__name__ or metadata['backend'] != type(backend).__name__:
+            raise ValueError('"' + path + '" was written with a ' + metadata['integrator'] + ' and a '
+                             + metadata['backend'] + '.')
+        if (arrays['system/masses'].shape != system.masses.shape
+                or not (arrays['system/masses'] == system.masses).all()
+                or not (arrays['system/charges'] == system.charges).all()):
+            raise ValueError('"' + path + '" is a checkpoint of other particles.')
+
+        system.positions[:] = arrays['system/positions']
+        system.velocities[:] = arrays['system/velocities']
+        for prefix, component in (('integrator', integrator), ('backend', backend), ('monitor', monitor)):
+            if component is None:
+                continue
+            state = {key[len(prefix) + 1:]: value for key, value in arrays.items() if key.startswith(prefix + '/')}
+            if state:
+                component.set_state(state)
+            elif component is monitor:
+                # the run was checkpointed without diagnostics: they start from the restored state
+                monitor.measure(system)
+        if writer is not None and metadata['frames'] is not None:
+            writer.truncate(metadata['frames'])
+        version, internal_state, gauss_next = metadata['random']
+        random.setstate((version, tuple(internal_state), gauss_next))
+        if self.rng is not None and metadata['rng'] is not None:
+            self.rng.bit_generator.state = metadata['rng']
+        return Restored(path, metadata['step'], metadata['time'])
+
+
+def _random_state():
+    version, internal_state, gauss_next = random.getstate()
+    return [version, list(internal_state), gauss_next]
+
+
+def _sync_directory(directory):
+    """
+    Makes the rename of a checkpoint durable, where the platform allows opening directories.
+    """
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
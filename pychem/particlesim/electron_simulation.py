@@ -1,11 +1,12 @@
 from decimal import Decimal
-from random import choice, random
-from math import sqrt, asin, acos, atan, sin, cos, tan, pi
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-import json
+from random import choice
+import os
+import random
+import sys
 import time
 
+from pychem.particlesim import checkpoint, nbody, trajectory
+
 
 G = Decimal('6.67408e-11')              # gravitational constant (m3*kg-1*s-2)
 Ke = Decimal('8.9875517873681764e9')    # Coulomb's constant (N*m2*C-2)
@@ -33,99 +34,72 @@ class Particle:
         self.velocity = velocity
 
 
-def simulation():
-    def coulombs_law(c1, c2, r):
-        if r != 0:
-            F = Decimal(Ke*c1*c2/(r*r))
-        else:
-            F = None
-        return F
-
-    def gravitional_force(m1, m2, r):
-        if r != 0:
-            F = Decimal(G*m1*m2/(r*r))
+def simulation(steps=300, delta_t=delta_t, backend=None, integrator='velocity_verlet', diagnostics=None,
+               path=None, interval=1, checkpoints=None):
+    """
+    Simulates the particles for 'steps' steps of 'delta_t' seconds with the NumPy engine in nbody and updates
+    their positions and velocities. 'backend' chooses the forces and 'integrator' the time steps, see
+    nbody.simulate; with the adaptive integrators 'delta_t' is the longest step. 'diagnostics' is called with
+    the energy and momentum conservation after every step, in reduced units. Returns, for every particle, its
+    positions after every step in picometres.
+
+    With 'path' every 'interval'-th step is written to a trajectory file as the simulation runs instead, with
+    the particles in the order of the returned list, and a trajectory.Trajectory of the file is returned with
+    that list.
+
+    With 'checkpoints', a checkpoint.Checkpoints, a run that was interrupted continues from its latest
+    checkpoint, and its trajectory file where the checkpoint left it; ValueError is raised if that file is gone.
+    A trajectory file with too few frames for 'steps' is grown.
+    The particles should be created as for the interrupted run; they are matched to the checkpoint in order of
+    mass, charge, position and velocity.
+    """
+    particle_list = sorted(particles, key=lambda particle: (particle.mass, particle.charge, particle.position,
+                                                            particle.velocity))
+    system = nbody.ParticleSystem.from_si([[float(x) for x in particle.position] for particle in particle_list],
+                                          [[float(v) for v in particle.velocity] for particle in particle_list],
+                                          [float(particle.mass) for particle in particle_list],
+                                          [float(particle.charge) for particle in particle_list])
+    writer = None
+    if path is not None:
+        if checkpoints is not None and checkpoints.latest() is not None and os.path.exists(path):
+            writer = trajectory.TrajectoryWriter.reopen(path, interval, steps // interval)
         else:
-            F = None
-        return F
-
-    def get_angle(a=None, o=None, s=None):
-        angle = None
-        if a is not None and o is not None:
-            if a == 0:
-                if o == 0:
-                    angle = Decimal('0')
-                elif o > 0:
-                    angle = Decimal(0.5 * pi)
-                elif o < 0:
-                    angle = Decimal((-0.5) * pi)
-            elif o == 0:
-                if a > 0:
-                    angle = Decimal('0')
-                elif a < 0:
-                    angle = Decimal(pi)
-            else:
-                angle = Decimal(atan(o/a))
-                if a < 0:
-                    angle += Decimal(pi)
-        if angle is not None:
-            if angle < 0:
-                angle += Decimal(pi)
-            return angle
-        else:
-            raise ValueError
+            writer = trajectory.TrajectoryWriter.for_steps(path, len(system), steps, interval, velocities=True)
+    positions = nbody.simulate(system, steps, float(delta_t) / nbody.UNIT_TIME, record=writer is None,
+                               backend=backend, integrator=integrator, diagnostics=diagnostics, writer=writer,
+                               checkpoints=checkpoints)
+
+    for i, particle in enumerate(particle_list):
+        particle.position = tuple(Decimal(value * nbody.UNIT_LENGTH) for value in system.positions[i].tolist())
+        particle.velocity = tuple(Decimal(value * nbody.UNIT_VELOCITY) for value in system.velocities[i].tolist())
+    if writer is not None:
+        writer.close()
+        return trajectory.Trajectory(path), particle_list
 
     data = dict()
-    for particle in particles:
+    for i, particle in enumerate(particle_list):
         data[particle] = dict()
-        data[particle]['positions'] = list()
+        # the unit of length is the picometre
+        data[particle]['positions'] = [tuple(position) for position in positions[:, i].tolist()]
         data[particle]['velocities'] = list()
-
-    for _ in range(300):
-        for particle in particles:
-            current_x, current_y, current_z = particle.position
-            current_v_x, current_v_y, current_v_z = particle.velocity
-
-            # calculate the next position of the particle:
-            for other_particle in particles:
-                if other_particle != particle:
-                    other_x, other_y, other_z = other_particle.position
-                    dx, dy, dz = other_x-current_x, other_y-current_y, other_z-current_z
-                    distance = Decimal(sqrt(dx*dx + dy*dy + dz*dz))
-
-                    fg = gravitional_force(particle.mass, other_particle.mass, distance)
-                    fe = -coulombs_law(particle.charge, other_particle.charge, distance)
-                    f_tot = fg + fe
-                    f_x = dx / distance * f_tot
-                    f_y = dy / distance * f_tot
-                    f_z = dz / distance * f_tot
-                    a_x, a_y, a_z = f_x/particle.mass, f_y/particle.mass, f_z/particle.mass
-                    delta_v_x, delta_v_y, delta_v_z = a_x*delta_t, a_y*delta_t, a_z*delta_t
-
-                    current_v_x += delta_v_x
-                    current_v_y += delta_v_y
-                    current_v_z += delta_v_z
-
-            next_x = Decimal(current_x + current_v_x * delta_t)
-            next_y = Decimal(current_y + current_v_y * delta_t)
-            next_z = Decimal(current_z + current_v_z * delta_t)
-            particle.next_position = (next_x, next_y, next_z)
-            particle.next_velocity = (current_v_x, current_v_y, current_v_z)
-
-        # applying all the calculated positions to the particle
-        for particle in particles:
-            particle.position = particle.next_position
-            particle.velocity = particle.next_velocity
-
-            current_x, current_y, current_z = particle.position
-            data[particle]['positions'].append((float(current_x*Decimal('1e12')),
-                                                float(current_y*Decimal('1e12')),
-                                                float(current_z*Decimal('1e12'))))
     return data
 
 
-def plot_3d(data):
+def plot_3d(data, every=1):
+    """
+    Plots the positions of every particle: 'data' is the result of simulation, or a trajectory.Trajectory of
+    which every 'every'-th frame is read.
+    """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
+    if isinstance(data, trajectory.Trajectory):
+        for particle in range(data.particle_count):
+            positions = data.particle_positions(particle, every)
+            ax.scatter(positions[:, 0], positions[:, 1], positions[:, 2])
+        plt.show()
+        return
     for key in data:
         xs = list()
         ys = list()
@@ -163,15 +137,20 @@ def create_electron():
              velocity=(Decimal(vx), Decimal(vy), Decimal(vz)))
 
 
-create_atom(Decimal('1.00782504')*u, e)
-create_atom(Decimal('1.00782504')*u, e, position=(Decimal('0'), Decimal('50e-12'), Decimal('0')))
-create_electron()
-create_electron()
-
-data = simulation()
-json_data = list()
-for key in data:
-    json_data.append(data[key])
-with open('files/esim_data/version2.0/' + str(time.time()) + '.json', 'w') as jsonfile:
-    json.dump(json_data, jsonfile, separators=(',', ':'), indent=4)
-plot_3d(data)
+if __name__ == '__main__':
+    # with a run directory the run is checkpointed there and continues where it was interrupted
+    run_directory = sys.argv[1] if len(sys.argv) > 1 else None
+    if run_directory is not None:
+        random.seed(0)
+    create_atom(Decimal('1.00782504')*u, e)
+    create_atom(Decimal('1.00782504')*u, e, position=(Decimal('0'), Decimal('50e-12'), Decimal('0')))
+    create_electron()
+    create_electron()
+
+    if run_directory is None:
+        frames, _ = simulation(path='files/esim_data/version2.0/' + str(time.time()) + '.npy')
+        plot_3d(frames)
+    else:
+        frames, _ = simulation(steps=100000, path=os.path.join(run_directory, 'trajectory.npy'), interval=10,
+                               checkpoints=checkpoint.Checkpoints(os.path.join(run_directory, 'checkpoints'), 1000))
+        plot_3d(frames, every=100)
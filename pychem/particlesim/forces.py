@@ -0,0 +1,443 @@
+from collections import namedtuple
+
+from pychem.particlesim import nbody
+
+
+# The error of an approximate backend against the exact pairwise forces: the root mean square and the largest
+# force error relative to the root mean square force, and the relative error of the potential energy.
+ForceError = namedtuple('ForceError', ['rms_force', 'max_force', 'energy'])
+
+# bits per axis of the Morton keys of the octree; 3 * 21 bits fit in an int64
+_MORTON_BITS = 21
+
+
+class ForceBackend:
+    """
+    Computes the gravitational plus Coulomb forces and the potential energy of a nbody.ParticleSystem, in
+    reduced units. The potential energy of a pair is (q1*q2 - G*m1*m2) / r.
+    """
+    def forces(self, system, out=None, targets=None):
+        """
+        Returns the forces on all particles as an (N, 3) array, or with 'targets', an array of particle
+        indexes, the forces on those particles only as a (len(targets), 3) array.
+        """
+        raise NotImplementedError
+
+    def potential_energy(self, system):
+        raise NotImplementedError
+
+    def get_state(self):
+        """
+        What the backend keeps between evaluations, as a dict of arrays and numbers, for checkpoints.
+        """
+        return dict()
+
+    def set_state(self, state):
+        pass
+
+
+class PairwiseBackend(ForceBackend):
+    """
+    The exact O(N^2) sum over all pairs, see nbody.pairwise_forces.
+    """
+    def __init__(self, softening=0.0):
+        self.softening = softening
+
+    def forces(self, system, out=None, targets=None):
+        return nbody.pairwise_forces(system, self.softening, out, targets)
+
+    def potential_energy(self, system):
+        import numpy
+        positions, masses, charges = system.positions, system.masses, system.charges
+        count = len(masses)
+        energy = 0.0
+        for start in range(0, count, nbody._BLOCK_ROWS):
+            stop = min(start + nbody._BLOCK_ROWS, count)
+            rows, columns = numpy.triu_indices(stop - start, k=1, m=count - start)
+            rows += start
+            columns += start
+            energy += _pair_terms(positions, masses, charges, rows, columns, self.softening, forces=False)[1].sum()
+        return float(energy)
+
+
+class BarnesHutBackend(ForceBackend):
+    """
+    The Barnes-Hut approximation on an octree. A cell of side s at distance d from a particle is replaced by
+    its multipole expansion about its center of mass if s / d < 'theta': the total mass for gravity, and the
+    total charge plus the dipole moment for the Coulomb forces, because the charges of a cell mostly cancel.
+    Cells of at most 'leaf_size' particles are summed directly. With 'theta' 0 every pair is summed directly.
+
+    The octree is built from sorted Morton keys and all particles of a block of 'block_size' particles walk the
+    tree together, so a level of the walk is a few NumPy operations. Forces take O(N log N) time.
+    """
+    def __init__(self, theta=0.5, softening=0.0, leaf_size=8, block_size=4096):
+        if theta < 0:
+            raise ValueError('"' + str(theta) + '" is not a valid opening angle.')
+        self.theta = theta
+        self.softening = softening
+        self.leaf_size = leaf_size
+        self.block_size = block_size
+
+    def forces(self, system, out=None, targets=None):
+        return self._evaluate(system, out, targets)[0]
+
+    def potential_energy(self, system):
+        return self._evaluate(system)[1]
+
+    def _evaluate(self, system, out=None, targets=None):
+        import numpy
+        if len(system) == 0:
+            # an octree needs a particle to have a size
+            return numpy.zeros((0, 3)) if out is None else out, 0.0
+        tree = _Octree(system.positions, system.masses, system.charges, self.leaf_size)
+        if targets is None:
+            walkers = numpy.arange(len(system))
+        else:
+            # the targets in tree order, so the particles of a block are close together
+            ranks = numpy.empty(len(system), dtype=numpy.int64)
+            ranks[tree.order] = numpy.arange(len(system))
+            target_ranks = ranks[numpy.asarray(targets, dtype=numpy.intp)]
+            permutation = numpy.argsort(target_ranks, kind='stable')
+            walkers = target_ranks[permutation]
+        sorted_forces = numpy.zeros((len(walkers), 3))
+        potentials = numpy.zeros(len(walkers))
+        for start in range(0, len(walkers), self.block_size):
+            stop = min(start + self.block_size, len(walkers))
+            self._walk(tree, walkers[start:stop], sorted_forces[start:stop], potentials[start:stop])
+        if out is None:
+            out = numpy.empty((len(walkers), 3))
+        if targets is None:
+            out[tree.order] = sorted_forces
+        else:
+            out[permutation] = sorted_forces
+        # every pair is counted from both sides
+        return out, float(potentials.sum() / 2)
+
+    def _walk(self, tree, particles, forces, potentials):
+        """
+        Adds the forces on and the potentials of the 'particles', indexes in tree order, to the rows of
+        'forces' and 'potentials' in the same order.
+        """
+        import numpy
+        rows = numpy.arange(len(particles))
+        nodes = numpy.zeros(len(particles), dtype=numpy.int64)
+        theta2 = self.theta * self.theta
+        softening2 = self.softening * self.softening
+        while len(particles):
+            offsets = tree.positions[particles] - tree.centers[nodes]
+            distance2 = numpy.einsum('ij,ij->i', offsets, offsets) + softening2
+            inside = (tree.starts[nodes] <= particles) & (particles < tree.ends[nodes])
+            accept = ~inside & (tree.sizes[nodes] ** 2 < theta2 * distance2)
+            if accept.any():
+                self._add_multipoles(tree, particles[accept], rows[accept], nodes[accept], offsets[accept],
+                                     distance2[accept], forces, potentials)
+
+            is_leaf = tree.first_child[nodes] < 0
+            leaf = ~accept & is_leaf
+            if leaf.any():
+                walkers, sources = _expand(numpy.flatnonzero(leaf), tree.starts[nodes[leaf]],
+                                           tree.ends[nodes[leaf]])
+                targets = particles[walkers]
+                distinct = targets != sources
+                walkers, targets, sources = walkers[distinct], targets[distinct], sources[distinct]
+                pair_forces, pair_potentials = _pair_terms(tree.positions, tree.masses, tree.charges, targets,
+                                                           sources, self.softening)
+                _accumulate(forces, potentials, rows[walkers], pair_forces, pair_potentials)
+
+            opened = ~accept & ~is_leaf
+            walkers, nodes = _expand(numpy.flatnonzero(opened), tree.first_child[nodes[opened]],
+                                     tree.child_end[nodes[opened]])
+            particles, rows = particles[walkers], rows[walkers]
+
+    @staticmethod
+    def _add_multipoles(tree, particles, rows, nodes, offsets, distance2, forces, potentials):
+        import numpy
+        inverse = 1.0 / numpy.sqrt(distance2)
+        inverse3 = inverse ** 3
+        dipoles = tree.dipoles[nodes]
+        dipole_offsets = numpy.einsum('ij,ij->i', dipoles, offsets)
+        charges = tree.charges[particles]
+        masses = tree.masses[particles]
+        # the field of the cell charge and the cell dipole, and the gravity towards the center of mass
+        field = (offsets * (tree.cell_charges[nodes] * inverse3
+                            + 3 * dipole_offsets * inverse3 * inverse * inverse)[:, numpy.newaxis]
+                 - dipoles * inverse3[:, numpy.newaxis])
+        node_forces = (charges[:, numpy.newaxis] * field
+                       - (nbody.G_REDUCED * masses * tree.cell_masses[nodes] * inverse3)[:, numpy.newaxis] * offsets)
+        node_potentials = (charges * (tree.cell_charges[nodes] * inverse + dipole_offsets * inverse3)
+                           - nbody.G_REDUCED * masses * tree.cell_masses[nodes] * inverse)
+        _accumulate(forces, potentials, rows, node_forces, node_potentials)
+
+
+class _Octree:
+    """
+    An octree over particles sorted by Morton key, so every cell holds a contiguous range [start, end) of
+    the sorted particles and the children of a cell are the contiguous nodes [first_child, child_end).
+    """
+    def __init__(self, positions, masses, charges, leaf_size):
+        import numpy
+        lower = positions.min(axis=0)
+        span = float((positions.max(axis=0) - lower).max()) or 1.0
+        # just over the span, so the particles on the upper faces stay in the cube
+        span *= 1 + 1e-9
+        scale = (1 << _MORTON_BITS) / span
+        cells = numpy.minimum(((positions - lower) * scale).astype(numpy.int64), (1 << _MORTON_BITS) - 1)
+        keys = _spread_bits(cells[:, 0]) << 2 | _spread_bits(cells[:, 1]) << 1 | _spread_bits(cells[:, 2])
+        self.order = numpy.argsort(keys, kind='stable')
+        keys = keys[self.order]
+        self.positions = positions[self.order]
+        self.masses = masses[self.order]
+        self.charges = charges[self.order]
+
+        count = len(keys)
+        starts, ends, levels, first_child, child_end = [[0]], [[count]], [[0]], list(), list()
+        level_starts, level_ends = numpy.array([0]), numpy.array([count])
+        node_count = 1
+        for level in range(_MORTON_BITS + 1):
+            internal = (level_ends - level_starts > leaf_size) & (level < _MORTON_BITS)
+            level_first = numpy.full(len(level_starts), -1, dtype=numpy.int64)
+            level_child_end = numpy.full(len(level_starts), -1, dtype=numpy.int64)
+            if not internal.any():
+                first_child.append(level_first)
+                child_end.append(level_child_end)
+                break
+            parent_starts, parent_ends = level_starts[internal], level_ends[internal]
+            # the children start where the key prefix of the next level changes inside an internal cell
+            prefixes = keys >> (3 * (_MORTON_BITS - level - 1))
+            in_parent, members = _expand(numpy.arange(len(parent_starts)), parent_starts, parent_ends)
+            changes = members[1:][(prefixes[members[1:]] != prefixes[members[:-1]])
+                                  & (in_parent[1:] == in_parent[:-1])]
+            child_starts = numpy.sort(numpy.concatenate([parent_starts, changes]))
+            parents = numpy.searchsorted(parent_starts, child_starts, side='right') - 1
+            next_starts = numpy.append(child_starts[1:], count)
+            last = numpy.append(parents[1:] != parents[:-1], True)
+            child_ends = numpy.where(last, parent_ends[parents], next_starts)
+
+            child_counts = numpy.bincount(parents, minlength=len(parent_starts))
+            level_first[internal] = node_count + numpy.cumsum(child_counts) - child_counts
+            level_child_end[internal] = level_first[internal] + child_counts
+            first_child.append(level_first)
+            child_end.append(level_child_end)
+            starts.append(child_starts)
+            ends.append(child_ends)
+            levels.append(numpy.full(len(child_starts), level + 1))
+            node_count += len(child_starts)
+            level_starts, level_ends = child_starts, child_ends
+
+        self.starts = numpy.concatenate(starts)
+        self.ends = numpy.concatenate(ends)
+        self.first_child = numpy.concatenate(first_child)
+        self.child_end = numpy.concatenate(child_end)
+        self.sizes = span / 2.0 ** numpy.concatenate(levels)
+
+        # the moments of every cell from prefix sums over the sorted particles
+        def cell_sums(values):
+            sums = numpy.concatenate([numpy.zeros((1,) + values.shape[1:]), numpy.cumsum(values, axis=0)])
+            return sums[self.ends] - sums[self.starts]
+        self.cell_masses = cell_sums(self.masses)
+        self.cell_charges = cell_sums(self.charges)
+        # the center of mass, or the mean position of a cell without mass
+        self.centers = cell_sums(self.positions) / (self.ends - self.starts)[:, numpy.newaxis]
+        numpy.divide(cell_sums(self.positions * self.masses[:, numpy.newaxis]), self.cell_masses[:, numpy.newaxis],
+                     out=self.centers, where=self.cell_masses[:, numpy.newaxis] > 0)
+        self.dipoles = (cell_sums(self.positions * self.charges[:, numpy.newaxis])
+                        - self.centers * self.cell_charges[:, numpy.newaxis])
+
+
+def _spread_bits(values):
+    """
+    Spreads the lowest 21 bits of every value over every third bit, for interleaving Morton keys.
+    """
+    values = values & 0x1fffff
+    values = (values | values << 32) & 0x1f00000000ffff
+    values = (values | values << 16) & 0x1f0000ff0000ff
+    values = (values | values << 8) & 0x100f00f00f00f00f
+    values = (values | values << 4) & 0x10c30c30c30c30c3
+    values = (values | values << 2) & 0x1249249249249249
+    return values
+
+
+class CellListBackend(ForceBackend):
+    """
+    Sums the pairs closer than 'cutoff' only, which takes O(N) time at a fixed density. The pairs within
+    'cutoff' + 'skin' are kept in a Verlet neighbor list, found with a cell list of that size, and the list is
+    only rebuilt once a particle has moved more than half the skin since the last build. Forces and energies
+    beyond the cutoff are left out; Coulomb forces are long-ranged, so this suits screened or neutral
+    systems, where the far field cancels.
+    """
+    def __init__(self, cutoff, skin=None, softening=0.0):
+        if cutoff <= 0:
+            raise ValueError('"' + str(cutoff) + '" is not a valid cutoff.')
+        self.cutoff = cutoff
+        self.skin = 0.2 * cutoff if skin is None else skin
+        self.softening = softening
+        self.rebuilds = 0
+        self._pairs = None
+        self._build_positions = None
+
+    def forces(self, system, out=None, targets=None):
+        import numpy
+        rows, columns = self._neighbor_pairs(system)
+        if targets is not None:
+            # only the pairs with a target; the forces of the others are not needed
+            targets = numpy.asarray(targets, dtype=numpy.intp)
+            is_target = numpy.zeros(len(system), dtype=bool)
+            is_target[targets] = True
+            keep = is_target[rows] | is_target[columns]
+            rows, columns = rows[keep], columns[keep]
+        pair_forces, _ = _pair_terms(system.positions, system.masses, system.charges, rows, columns,
+                                     self.softening, cutoff=self.cutoff)
+        all_forces = numpy.empty((len(system), 3)) if out is None or targets is not None else out
+        for axis in range(3):
+            all_forces[:, axis] = (numpy.bincount(rows, pair_forces[:, axis], minlength=len(system))
+                                   - numpy.bincount(columns, pair_forces[:, axis], minlength=len(system)))
+        if targets is None:
+            return all_forces
+        if out is None:
+            return all_forces[targets]
+        out[:] = all_forces[targets]
+        return out
+
+    def potential_energy(self, system):
+        rows, columns = self._neighbor_pairs(system)
+        _, pair_potentials = _pair_terms(system.positions, system.masses, system.charges, rows, columns,
+                                         self.softening, forces=False, cutoff=self.cutoff)
+        return float(pair_potentials.sum())
+
+    def get_state(self):
+        # the order of the pairs sets the order of the sums, so a restored list gives the same forces to the bit
+        state = {'rebuilds': self.rebuilds}
+        if self._pairs is not None:
+            state['rows'], state['columns'] = self._pairs
+            state['build_positions'] = self._build_positions
+        return state
+
+    def set_state(self, state):
+        import numpy
+        self.rebuilds = int(state['rebuilds'])
+        self._pairs = None
+        self._build_positions = None
+        if 'rows' in state:
+            self._pairs = (numpy.array(state['rows'], dtype=numpy.int64),
+                           numpy.array(state['columns'], dtype=numpy.int64))
+            self._build_positions = numpy.array(state['build_positions'], dtype=numpy.float64)
+
+    def _neighbor_pairs(self, system):
+        import numpy
+        positions = system.positions
+        if self._pairs is not None and self._build_positions.shape == positions.shape:
+            moved2 = numpy.einsum('ij,ij->i', positions - self._build_positions, positions - self._build_positions)
+            if moved2.max(initial=0.0) <= (self.skin / 2) ** 2:
+                return self._pairs
+        self._pairs = _cell_list_pairs(positions, self.cutoff + self.skin)
+        self._build_positions = positions.copy()
+        self.rebuilds += 1
+        return self._pairs
+
+
+def _cell_list_pairs(positions, radius):
+    """
+    Returns the pairs (i, j), i < j, of particles closer than 'radius' as two arrays, from the particles in
+    the same and the adjacent cells of a grid of cells of side 'radius'.
+    """
+    import numpy
+    if len(positions) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    lower = positions.min(axis=0)
+    # the cells are shifted by one, so the neighbors of every cell have non-negative coordinates
+    cells = ((positions - lower) // radius).astype(numpy.int64) + 1
+    dims = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    order = numpy.argsort(keys, kind='stable')
+    cell_keys, cell_starts, cell_counts = numpy.unique(keys[order], return_index=True, return_counts=True)
+
+    rows, columns = list(), list()
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                neighbor_keys = keys + (dx * dims[1] + dy) * dims[2] + dz
+                slots = numpy.minimum(numpy.searchsorted(cell_keys, neighbor_keys), len(cell_keys) - 1)
+                found = cell_keys[slots] == neighbor_keys
+                particles = numpy.flatnonzero(found)
+                targets, members = _expand(particles, cell_starts[slots[found]],
+                                           cell_starts[slots[found]] + cell_counts[slots[found]])
+                others = order[members]
+                keep = targets < others
+                targets, others = targets[keep], others[keep]
+                delta = positions[others] - positions[targets]
+                close = numpy.einsum('ij,ij->i', delta, delta) < radius * radius
+                rows.append(targets[close])
+                columns.append(others[close])
+    return numpy.concatenate(rows), numpy.concatenate(columns)
+
+
+def _expand(owners, starts, ends):
+    """
+    For ranges [starts[k], ends[k]) returns every member of every range and the owner of its range.
+    """
+    import numpy
+    counts = ends - starts
+    total = int(counts.sum())
+    owners = numpy.repeat(owners, counts)
+    members = numpy.arange(total) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+    return owners, members
+
+
+def _pair_terms(positions, masses, charges, targets, sources, softening, forces=True, cutoff=None):
+    """
+    The force on every target from its source, and the potential energy of every pair. Pairs farther apart
+    than 'cutoff' contribute nothing.
+    """
+    import numpy
+    delta = positions[sources] - positions[targets]
+    distance2 = numpy.einsum('ij,ij->i', delta, delta) + softening * softening
+    coupling = nbody.G_REDUCED * masses[targets] * masses[sources] - charges[targets] * charges[sources]
+    if cutoff is not None:
+        coupling = numpy.where(distance2 < cutoff * cutoff, coupling, 0.0)
+    inverse = 1.0 / numpy.sqrt(distance2)
+    potentials = -coupling * inverse
+    if not forces:
+        return None, potentials
+    return delta * (coupling * inverse ** 3)[:, numpy.newaxis], potentials
+
+
+def _accumulate(forces, potentials, rows, row_forces, row_potentials):
+    import numpy
+    for axis in range(3):
+        forces[:, axis] += numpy.bincount(rows, row_forces[:, axis], minlength=len(forces))
+    potentials += numpy.bincount(rows, row_potentials, minlength=len(potentials))
+
+
+# the backends that can be chosen by name; a CellListBackend needs a cutoff and is passed as an instance
+BACKENDS = {'pairwise': PairwiseBackend, 'barnes_hut': BarnesHutBackend}
+
+
+def get_backend(backend, softening=0.0):
+    """
+    Returns 'backend' if it is a ForceBackend, a new backend with 'softening' if it is a name in BACKENDS,
+    and the exact pairwise backend if it is None.
+    """
+    if isinstance(backend, ForceBackend):
+        return backend
+    if backend is None:
+        return PairwiseBackend(softening)
+    try:
+        return BACKENDS[backend](softening=softening)
+    except KeyError:
+        raise ValueError('"' + str(backend) + '" is not a force backend.')
+
+
+def force_error(system, backend, reference=None):
+    """
+    Compares the forces and the potential energy of 'backend' to those of 'reference', by default the exact
+    pairwise backend. Returns a ForceError.
+    """
+    import numpy
+    reference = reference or PairwiseBackend(getattr(backend, 'softening', 0.0))
+    exact_forces = reference.forces(system)
+    rms = numpy.sqrt(numpy.mean(numpy.einsum('ij,ij->i', exact_forces, exact_forces)))
+    differences = backend.forces(system) - exact_forces
+    errors = numpy.sqrt(numpy.einsum('ij,ij->i', differences, differences)) / rms
+    exact_energy = reference.potential_energy(system)
+    return ForceError(float(numpy.sqrt(numpy.mean(errors ** 2))), float(errors.max(initial=0.0)),
+                      abs(backend.potential_energy(system) - exact_energy) / abs(exact_energy))
@@ -0,0 +1,319 @@
+from collections import namedtuple
+
+from pychem.particlesim import nbody
+
+
+# The conservation diagnostics after a step: the step taken, the kinetic, potential and total energy, the
+# drift of the total energy relative to the start, the total momentum, and how far it moved since the start
+# relative to the sum of the momenta of all particles at the start.
+Diagnostics = namedtuple('Diagnostics', ['step', 'time', 'delta_t', 'kinetic_energy', 'potential_energy',
+                                         'total_energy', 'energy_drift', 'momentum', 'momentum_drift'])
+
+
+class Integrator:
+    """
+    Advances a nbody.ParticleSystem in time with the forces of a forces.ForceBackend. An integrator keeps the
+    accelerations at the end of its last step for the next one, as long as the particles stay where it left
+    them. 'force_evaluations' counts the particles whose force was computed.
+    """
+    def __init__(self):
+        self.force_evaluations = 0
+        self._accelerations = None
+        self._positions = None
+
+    def step(self, system, backend, delta_t):
+        """
+        Advances 'system' in place by one step of at most 'delta_t' and returns the time step taken.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        self._accelerations = None
+        self._positions = None
+
+    def get_state(self):
+        """
+        What the integrator keeps between steps, as a dict of arrays and numbers, for checkpoints.
+        """
+        state = {'force_evaluations': self.force_evaluations}
+        if self._accelerations is not None:
+            state['accelerations'] = self._accelerations
+            state['positions'] = self._positions
+        return state
+
+    def set_state(self, state):
+        import numpy
+        self.reset()
+        self.force_evaluations = int(state['force_evaluations'])
+        if 'accelerations' in state:
+            self._accelerations = numpy.array(state['accelerations'], dtype=numpy.float64)
+            self._positions = numpy.array(state['positions'], dtype=numpy.float64)
+
+    def accelerations(self, system, backend, targets=None):
+        import numpy
+        self.force_evaluations += len(system) if targets is None else len(targets)
+        if targets is None:
+            return backend.forces(system) / system.masses[:, numpy.newaxis]
+        return backend.forces(system, targets=targets) / system.masses[targets, numpy.newaxis]
+
+    def _start_accelerations(self, system, backend):
+        """
+        The accelerations at the current positions, kept from the last step if the particles did not move.
+        Otherwise all that was kept is dropped.
+        """
+        import numpy
+        if self._accelerations is None or not numpy.array_equal(self._positions, system.positions):
+            self.reset()
+            self._keep(system, self.accelerations(system, backend))
+        return self._accelerations
+
+    def _keep(self, system, accelerations):
+        self._accelerations = accelerations
+        self._positions = system.positions.copy()
+
+
+class EulerIntegrator(Integrator):
+    """
+    Symplectic Euler: the velocities are updated with the current forces and then the particles move with the
+    new velocities. First order; it is what nbody.simulate did before there were integrators.
+    """
+    def step(self, system, backend, delta_t):
+        system.velocities += self.accelerations(system, backend) * delta_t
+        system.positions += system.velocities * delta_t
+        return delta_t
+
+
+class VelocityVerlet(Integrator):
+    """
+    Velocity Verlet (kick-drift-kick): half a kick with the forces at the start, a full drift, and half a kick
+    with the forces at the end, which are kept for the next step. Second order and time reversible, with one
+    force evaluation per step.
+    """
+    def step(self, system, backend, delta_t):
+        system.velocities += self._start_accelerations(system, backend) * (delta_t / 2)
+        system.positions += system.velocities * delta_t
+        accelerations = self.accelerations(system, backend)
+        system.velocities += accelerations * (delta_t / 2)
+        self._keep(system, accelerations)
+        return delta_t
+
+
+class Leapfrog(Integrator):
+    """
+    Leapfrog in drift-kick-drift form: half a drift, a full kick with the forces at the middle of the step and
+    another half drift. Second order and time reversible, with one force evaluation per step and no state.
+    """
+    def step(self, system, backend, delta_t):
+        system.positions += system.velocities * (delta_t / 2)
+        system.velocities += self.accelerations(system, backend) * delta_t
+        system.positions += system.velocities * (delta_t / 2)
+        return delta_t
+
+
+class RungeKutta4(Integrator):
+    """
+    The classical fourth order Runge-Kutta method, with four force evaluations per step. Accurate for smooth
+    motion, but not symplectic: the energy drifts slowly over long runs.
+    """
+    def step(self, system, backend, delta_t):
+        positions, velocities = system.positions.copy(), system.velocities.copy()
+        position_slope = velocities
+        velocity_slope = self._start_accelerations(system, backend)
+        position_sum = position_slope.copy()
+        velocity_sum = velocity_slope.copy()
+        for fraction, weight in ((0.5, 2), (0.5, 2), (1.0, 1)):
+            system.positions[:] = positions + position_slope * (fraction * delta_t)
+            position_slope = velocities + velocity_slope * (fraction * delta_t)
+            velocity_slope = self.accelerations(system, backend)
+            position_sum += weight * position_slope
+            velocity_sum += weight * velocity_slope
+        system.positions[:] = positions + position_sum * (delta_t / 6)
+        system.velocities[:] = velocities + velocity_sum * (delta_t / 6)
+        return delta_t
+
+
+def acceleration_time_steps(accelerations, eta, length):
+    """
+    The time step of every particle from its acceleration a: eta * sqrt(length / |a|), the time in which a
+    particle at rest moves 'eta'^2 / 2 times 'length'. Particles without acceleration get infinite steps.
+    """
+    import numpy
+    magnitudes = numpy.sqrt(numpy.einsum('ij,ij->i', accelerations, accelerations))
+    with numpy.errstate(divide='ignore'):
+        return eta * numpy.sqrt(length / magnitudes)
+
+
+class AdaptiveVerlet(VelocityVerlet):
+    """
+    Velocity Verlet with one shared time step that follows the largest acceleration: every step takes the
+    smallest acceleration_time_steps of all particles, at most the 'delta_t' passed to step and at least
+    'min_delta_t'. A close encounter shortens the steps while it lasts instead of for the whole run.
+    """
+    def __init__(self, eta=0.05, length=1.0, min_delta_t=0.0):
+        super().__init__()
+        self.eta = eta
+        self.length = length
+        self.min_delta_t = min_delta_t
+
+    def step(self, system, backend, delta_t):
+        accelerations = self._start_accelerations(system, backend)
+        delta_t = min(delta_t, max(self.min_delta_t,
+                                   float(acceleration_time_steps(accelerations, self.eta, self.length).min())))
+        return super().step(system, backend, delta_t)
+
+
+class BlockTimeSteps(Integrator):
+    """
+    Velocity Verlet with a time step per particle. A step of 'delta_t' is split in blocks of delta_t / 2^k,
+    k up to 'max_level', and every particle takes the largest block that is not above its time step. A
+    particle is kicked with half its own block at the start and at the end of its block, and only the
+    particles at the end of a block get their forces computed; all particles drift together, so the others are
+    where their velocities take them. A particle can move to a larger block only where the larger blocks
+    start, so all particles are in step again at the end of 'delta_t'.
+
+    The time step of a particle is the smaller of its acceleration_time_steps and of eta * |a| / |da/dt|, with
+    the change of the acceleration over its last block. The second keeps a heavy particle that is pulled
+    around by a light one from taking blocks longer than the orbit.
+    """
+    def __init__(self, eta=0.05, length=1.0, max_level=12):
+        super().__init__()
+        self.eta = eta
+        self.length = length
+        self.max_level = max_level
+        self._levels = None
+
+    def reset(self):
+        super().reset()
+        self._levels = None
+
+    def get_state(self):
+        state = super().get_state()
+        if self._levels is not None:
+            state['levels'] = self._levels
+        return state
+
+    def set_state(self, state):
+        import numpy
+        super().set_state(state)
+        if 'levels' in state:
+            self._levels = numpy.array(state['levels'], dtype=numpy.int64)
+
+    def levels(self, accelerations, delta_t, previous=None, elapsed=None):
+        """
+        The smallest k for every particle such that delta_t / 2^k is not above its time step. 'previous' are
+        the accelerations 'elapsed' time before, if known.
+        """
+        import numpy
+        time_steps = acceleration_time_steps(accelerations, self.eta, self.length)
+        if previous is not None:
+            magnitudes = numpy.sqrt(numpy.einsum('ij,ij->i', accelerations, accelerations))
+            changes = accelerations - previous
+            changes = numpy.sqrt(numpy.einsum('ij,ij->i', changes, changes))
+            # an acceleration that did not change gives no limit
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                numpy.fmin(time_steps, self.eta * magnitudes * elapsed / changes, out=time_steps)
+        with numpy.errstate(divide='ignore'):
+            levels = numpy.ceil(numpy.log2(delta_t / time_steps))
+        return numpy.clip(levels, 0, self.max_level).astype(numpy.int64)
+
+    def step(self, system, backend, delta_t):
+        import numpy
+        accelerations = self._start_accelerations(system, backend)
+        # time in ticks of the smallest block
+        ticks = 1 << self.max_level
+        tick = delta_t / ticks
+        if self._levels is not None:
+            # the levels the particles chose at the end of the last step
+            levels = numpy.minimum(self._levels, self.max_level)
+        else:
+            levels = self.levels(accelerations, delta_t)
+        blocks = numpy.left_shift(1, self.max_level - levels)
+        system.velocities += accelerations * (blocks * (tick / 2))[:, numpy.newaxis]
+        ends = blocks.copy()
+        now = 0
+        while True:
+            following = int(ends.min())
+            system.positions += system.velocities * ((following - now) * tick)
+            now = following
+            active = numpy.flatnonzero(ends == now)
+            active_accelerations = self.accelerations(system, backend, active)
+            system.velocities[active] += active_accelerations * (blocks[active] * (tick / 2))[:, numpy.newaxis]
+            new_levels = self.levels(active_accelerations, delta_t, accelerations[active],
+                                     blocks[active] * tick)
+            accelerations[active] = active_accelerations
+            if now == ticks:
+                levels[active] = new_levels
+                break
+            # the largest block that starts now: the largest power of two that divides 'now'
+            aligned_level = self.max_level - (now & -now).bit_length() + 1
+            levels[active] = numpy.maximum(new_levels, aligned_level)
+            blocks[active] = numpy.left_shift(1, self.max_level - levels[active])
+            system.velocities[active] += active_accelerations * (blocks[active] * (tick / 2))[:, numpy.newaxis]
+            ends[active] = now + blocks[active]
+        self._keep(system, accelerations)
+        self._levels = levels
+        return delta_t
+
+
+# the integrators that can be chosen by name, with their default parameters
+INTEGRATORS = {'euler': EulerIntegrator, 'velocity_verlet': VelocityVerlet, 'leapfrog': Leapfrog,
+               'rk4': RungeKutta4, 'adaptive': AdaptiveVerlet, 'block': BlockTimeSteps}
+
+
+def get_integrator(integrator):
+    """
+    Returns 'integrator' if it is an Integrator, a new integrator if it is a name in INTEGRATORS, and
+    symplectic Euler if it is None.
+    """
+    if isinstance(integrator, Integrator):
+        return integrator
+    if integrator is None:
+        return EulerIntegrator()
+    try:
+        return INTEGRATORS[integrator]()
+    except KeyError:
+        raise ValueError('"' + str(integrator) + '" is not an integrator.')
+
+
+class ConservationMonitor:
+    """
+    Computes the Diagnostics of a system after every step, relative to the energy and momentum it had when the
+    monitor was created. The potential energy comes from the force backend.
+    """
+    def __init__(self, system, backend):
+        self.backend = backend
+        self.measure(system)
+
+    def measure(self, system):
+        """
+        Takes the energy and momentum of 'system' as the start the drifts are relative to.
+        """
+        import numpy
+        self.initial_energy = nbody.kinetic_energy(system) + self.backend.potential_energy(system)
+        self.initial_momentum = nbody.momentum(system)
+        self.momentum_scale = float(numpy.dot(system.masses, numpy.linalg.norm(system.velocities, axis=1)))
+
+    def get_state(self):
+        return {'initial_energy': self.initial_energy, 'initial_momentum': self.initial_momentum,
+                'momentum_scale': self.momentum_scale}
+
+    def set_state(self, state):
+        import numpy
+        self.initial_energy = float(state['initial_energy'])
+        self.initial_momentum = numpy.array(state['initial_momentum'], dtype=numpy.float64)
+        self.momentum_scale = float(state['momentum_scale'])
+
+    def diagnose(self, system, step, time, delta_t):
+        import numpy
+        kinetic = nbody.kinetic_energy(system)
+        potential = self.backend.potential_energy(system)
+        total = kinetic + potential
+        momentum = nbody.momentum(system)
+        energy_drift = total - self.initial_energy
+        if self.initial_energy:
+            energy_drift /= abs(self.initial_energy)
+        momentum_drift = float(numpy.linalg.norm(momentum - self.initial_momentum))
+        if self.momentum_scale:
+            momentum_drift /= self.momentum_scale
+        return Diagnostics(step, time, delta_t, kinetic, potential, total, energy_drift, tuple(momentum.tolist()),
+                           momentum_drift)
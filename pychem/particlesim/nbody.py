@@ -0,0 +1,180 @@
+from math import sqrt
+
+
+G = 6.67408e-11                 # gravitational constant (m3*kg-1*s-2)
+Ke = 8.9875517873681764e9       # Coulomb's constant (N*m2*C-2)
+
+# Reduced units: lengths in picometres, masses in atomic mass units and charges in elementary charges. The
+# unit of time makes Coulomb's constant 1, so the force between two charges is q1*q2/r^2.
+UNIT_LENGTH = 1e-12             # metre
+UNIT_MASS = 1.660539040e-27     # kilogram
+UNIT_CHARGE = 1.6021766e-19     # Coulomb
+UNIT_TIME = sqrt(UNIT_MASS * UNIT_LENGTH ** 3 / (Ke * UNIT_CHARGE ** 2))     # about 2.7e-18 seconds
+UNIT_VELOCITY = UNIT_LENGTH / UNIT_TIME
+# the gravitational constant in reduced units, about 8e-37
+G_REDUCED = G * UNIT_MASS ** 2 / (Ke * UNIT_CHARGE ** 2)
+
+# rows of particles per block of the pairwise force computation; the temporary arrays hold _BLOCK_ROWS * N
+# doubles each
+_BLOCK_ROWS = 64
+
+
+class ParticleSystem:
+    """
+    The state of N particles as structure-of-arrays float64 buffers in reduced units: 'positions' and
+    'velocities' of shape (N, 3), and 'masses' and 'charges' of shape (N,). Requires NumPy.
+    """
+    def __init__(self, positions, velocities, masses, charges):
+        import numpy
+        self.positions = numpy.array(positions, dtype=numpy.float64, order='C', ndmin=2)
+        self.velocities = numpy.array(velocities, dtype=numpy.float64, order='C', ndmin=2)
+        self.masses = numpy.array(masses, dtype=numpy.float64).reshape(-1)
+        self.charges = numpy.array(charges, dtype=numpy.float64).reshape(-1)
+        count = len(self.masses)
+        if self.positions.shape != (count, 3) or self.velocities.shape != (count, 3) or len(self.charges) != count:
+            raise ValueError('Positions and velocities should have shape (N, 3), masses and charges shape (N,).')
+
+    def __len__(self):
+        return len(self.masses)
+
+    @classmethod
+    def from_si(cls, positions, velocities, masses, charges):
+        """
+        Creates a system from positions in metres, velocities in metres per second, masses in kilograms and
+        charges in Coulomb.
+        """
+        import numpy
+        return cls(numpy.asarray(positions, dtype=numpy.float64) / UNIT_LENGTH,
+                   numpy.asarray(velocities, dtype=numpy.float64) / UNIT_VELOCITY,
+                   numpy.asarray(masses, dtype=numpy.float64) / UNIT_MASS,
+                   numpy.asarray(charges, dtype=numpy.float64) / UNIT_CHARGE)
+
+    def copy(self):
+        return ParticleSystem(self.positions, self.velocities, self.masses, self.charges)
+
+
+def pairwise_forces(system, softening=0.0, out=None, targets=None):
+    """
+    Returns the gravitational plus Coulomb force on every particle as an (N, 3) array in reduced units. Every
+    pair is computed once and its force is added to one particle and subtracted from the other (Newton's third
+    law), in blocks of rows that are broadcast against all later particles. 'softening' is added to every
+    distance in quadrature, which keeps close encounters finite; two particles at the same position without
+    softening get infinite forces.
+
+    With 'targets', an array of particle indexes, only the forces on those particles are computed, from all
+    particles, and returned as a (len(targets), 3) array.
+    """
+    import numpy
+    if targets is not None:
+        return _target_forces(system, softening, out, targets)
+    masses, charges = system.masses, system.charges
+    count = len(masses)
+    if out is None:
+        out = numpy.zeros((count, 3))
+    else:
+        out[:] = 0.0
+    # one contiguous array per coordinate
+    coordinates = numpy.ascontiguousarray(system.positions.T)
+    softening2 = softening * softening
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, count, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, count)
+            # the vectors from the particles of the block to the particles from 'start' on
+            deltas = [axis[numpy.newaxis, start:] - axis[start:stop, numpy.newaxis] for axis in coordinates]
+            distance2 = deltas[0] * deltas[0] + deltas[1] * deltas[1] + deltas[2] * deltas[2] + softening2
+            # positive couplings attract: gravity, and opposite charges
+            scale = (G_REDUCED * masses[start:stop, numpy.newaxis] * masses[numpy.newaxis, start:]
+                     - charges[start:stop, numpy.newaxis] * charges[numpy.newaxis, start:])
+            scale /= distance2 * numpy.sqrt(distance2)
+            # every pair once: of the particles in the block itself only the ones after the row particle
+            diagonal = scale[:, :stop - start]
+            diagonal[numpy.tril_indices(stop - start)] = 0.0
+            for axis, delta in enumerate(deltas):
+                delta *= scale
+                out[start:stop, axis] += delta.sum(axis=1)
+                out[start:, axis] -= delta.sum(axis=0)
+    return out
+
+
+def _target_forces(system, softening, out, targets):
+    """
+    The forces on the particles 'targets' from all particles, in blocks of targets broadcast against all
+    particles.
+    """
+    import numpy
+    targets = numpy.asarray(targets, dtype=numpy.intp)
+    masses, charges = system.masses, system.charges
+    if out is None:
+        out = numpy.empty((len(targets), 3))
+    coordinates = numpy.ascontiguousarray(system.positions.T)
+    softening2 = softening * softening
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(targets), _BLOCK_ROWS):
+            rows = targets[start:start + _BLOCK_ROWS]
+            deltas = [axis[numpy.newaxis, :] - axis[rows, numpy.newaxis] for axis in coordinates]
+            distance2 = deltas[0] * deltas[0] + deltas[1] * deltas[1] + deltas[2] * deltas[2] + softening2
+            scale = (G_REDUCED * masses[rows, numpy.newaxis] * masses[numpy.newaxis, :]
+                     - charges[rows, numpy.newaxis] * charges[numpy.newaxis, :])
+            scale /= distance2 * numpy.sqrt(distance2)
+            # no particle acts on itself
+            scale[numpy.arange(len(rows)), rows] = 0.0
+            for axis, delta in enumerate(deltas):
+                out[start:start + len(rows), axis] = (delta * scale).sum(axis=1)
+    return out
+
+
+def kinetic_energy(system):
+    import numpy
+    return float(0.5 * numpy.dot(system.masses, numpy.einsum('ij,ij->i', system.velocities, system.velocities)))
+
+
+def momentum(system):
+    """
+    The total momentum of 'system' as an array of 3 components.
+    """
+    return system.masses @ system.velocities
+
+
+def simulate(system, steps, delta_t, softening=0.0, record=True, backend=None, integrator=None,
+             diagnostics=None, writer=None, checkpoints=None):
+    """
+    Advances 'system' in place by 'steps' steps of 'delta_t' reduced time units. The forces come from
+    'backend', a forces.ForceBackend or the name of one, and by default from the exact pairwise sum with
+    'softening'. 'integrator' is an integrators.Integrator or the name of one; by default every step first
+    updates the velocities with the current forces and then moves the particles with the new velocities, as
+    the Decimal loop of electron_simulation did. Adaptive integrators take steps of at most 'delta_t'.
+
+    'diagnostics' is called after every step with an integrators.Diagnostics of the energy and momentum
+    conservation, which costs a potential energy evaluation per step. 'writer', a trajectory.TrajectoryWriter,
+    writes frames to a file as the simulation runs; with 'record' False the memory use does not depend on
+    'steps'.
+
+    With 'checkpoints', a checkpoint.Checkpoints, the simulation first resumes from the latest checkpoint if
+    there is one, and writes checkpoints as it runs. 'steps' counts from the start of the run, not from the
+    checkpoint, and the positions of the steps before the checkpoint are not returned.
+
+    Returns the positions after every step as an array of shape (steps, N, 3), or None if not 'record'.
+    """
+    import numpy
+    from pychem.particlesim import forces as force_backends, integrators
+    backend = force_backends.get_backend(backend, softening)
+    integrator = integrators.get_integrator(integrator)
+    monitor = integrators.ConservationMonitor(system, backend) if diagnostics is not None else None
+    start, time = 0, 0.0
+    if checkpoints is not None:
+        restored = checkpoints.restore(system, integrator, backend, writer, monitor)
+        if restored is not None:
+            start, time = restored.step, restored.time
+    trajectory = numpy.empty((max(steps - start, 0), len(system), 3)) if record else None
+    for step in range(start, steps):
+        step_time = integrator.step(system, backend, delta_t)
+        time += step_time
+        if record:
+            trajectory[step - start] = system.positions
+        if writer is not None:
+            writer.write(step, time, system)
+        if monitor is not None:
+            diagnostics(monitor.diagnose(system, step, time, step_time))
+        if checkpoints is not None and checkpoints.due(step + 1):
+            checkpoints.save(step + 1, time, system, integrator, backend, writer, monitor)
+    return trajectory
@@ -0,0 +1,195 @@
+from collections import namedtuple
+import os
+
+
+# One frame of a trajectory: the step after which it was written, the simulated time, and the positions and
+# velocities, or None if they were not written, of all particles in reduced units.
+Frame = namedtuple('Frame', ['step', 'time', 'positions', 'velocities'])
+
+
+def frame_dtype(particle_count, velocities=False):
+    """
+    The NumPy dtype of one frame of 'particle_count' particles: a fixed-size record of the step, the time and
+    the positions, and with 'velocities' the velocities.
+    """
+    import numpy
+    fields = [('step', numpy.int64), ('time', numpy.float64), ('positions', numpy.float64, (particle_count, 3))]
+    if velocities:
+        fields.append(('velocities', numpy.float64, (particle_count, 3)))
+    return numpy.dtype(fields)
+
+
+class TrajectoryWriter:
+    """
+    Writes the frames of a simulation to a .npy file of 'frame_count' frames that is allocated up front and
+    filled through a memory map as the simulation runs, so memory use does not grow with the length of the
+    run. Every 'interval'-th step is written. The frames that are not written yet have step -1.
+
+    Pass it to nbody.simulate as 'writer', or call write after every step. Requires NumPy.
+    """
+    def __init__(self, path, particle_count, frame_count, interval=1, velocities=False):
+        from numpy.lib import format
+        if interval < 1:
+            raise ValueError('"' + str(interval) + '" is not a valid write interval.')
+        self.path = path
+        self.interval = interval
+        self.frames = format.open_memmap(path, mode='w+', dtype=frame_dtype(particle_count, velocities),
+                                         shape=(frame_count,))
+        self.frames['step'] = -1
+        self.count = 0
+
+    @classmethod
+    def for_steps(cls, path, particle_count, steps, interval=1, velocities=False):
+        """
+        A writer with room for every 'interval'-th of 'steps' steps.
+        """
+        return cls(path, particle_count, steps // interval, interval, velocities)
+
+    @classmethod
+    def reopen(cls, path, interval=1, frame_count=None):
+        """
+        A writer that continues a trajectory file after its last written frame. If 'frame_count' is more than
+        the file has room for, the file is first replaced by a copy with room for 'frame_count' frames.
+        """
+        from numpy.lib import format
+        if frame_count is not None:
+            _grow(path, frame_count)
+        writer = cls.__new__(cls)
+        writer.path = path
+        writer.interval = interval
+        writer.frames = format.open_memmap(path, mode='r+')
+        writer.count = _written_count(writer.frames)
+        return writer
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, step, time, system):
+        """
+        Writes the state of 'system' after step 'step', counted from 0, if it is an 'interval'-th step.
+        Returns whether a frame was written.
+        """
+        if (step + 1) % self.interval:
+            return False
+        if self.count >= len(self.frames):
+            raise ValueError('The trajectory is full after ' + str(self.count) + ' frames.')
+        self.frames['time'][self.count] = time
+        self.frames['positions'][self.count] = system.positions
+        if 'velocities' in self.frames.dtype.names:
+            self.frames['velocities'][self.count] = system.velocities
+        # the step last: a frame counts as written once its step is set
+        self.frames['step'][self.count] = step
+        self.count += 1
+        return True
+
+    def truncate(self, count):
+        """
+        Drops the frames after the first 'count', for example the ones written after the checkpoint a
+        simulation resumes from. The file keeps its size. Raises ValueError if fewer frames were written, as
+        in a new file that replaced the one a checkpoint refers to.
+        """
+        if count > self.count:
+            raise ValueError('"' + str(self.path) + '" has ' + str(self.count) + ' frames, not '
+                             + str(count) + '.')
+        self.frames['step'][count:] = -1
+        self.count = count
+
+    def flush(self):
+        self.frames.flush()
+
+    def close(self):
+        if self.frames is not None:
+            self.frames.flush()
+            self.frames = None
+
+
+class Trajectory:
+    """
+    Reads a trajectory file of TrajectoryWriter through a read-only memory map: frames and particles are
+    read from disk when they are indexed, so a long run can be browsed and plotted without loading it. Only
+    the frames that were written count, also while the file is still being written.
+    """
+    def __init__(self, path):
+        import numpy
+        self.path = path
+        self._frames = numpy.load(path, mmap_mode='r')
+        if self._frames.dtype.names is None or 'positions' not in self._frames.dtype.names:
+            raise ValueError('"' + str(path) + '" is not a trajectory.')
+        self._count = _written_count(self._frames)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """
+        Returns frame 'index' as a Frame.
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('Frame ' + str(index) + ' is not in the trajectory.')
+        frame = self._frames[index]
+        velocities = frame['velocities'] if 'velocities' in self._frames.dtype.names else None
+        return Frame(int(frame['step']), float(frame['time']), frame['positions'], velocities)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    @property
+    def particle_count(self):
+        return self._frames.dtype['positions'].shape[0]
+
+    @property
+    def steps(self):
+        return self._frames['step'][:self._count]
+
+    @property
+    def times(self):
+        return self._frames['time'][:self._count]
+
+    @property
+    def positions(self):
+        """
+        The positions of all written frames as a memory-mapped array of shape (frames, N, 3).
+        """
+        return self._frames['positions'][:self._count]
+
+    @property
+    def velocities(self):
+        if 'velocities' not in self._frames.dtype.names:
+            return None
+        return self._frames['velocities'][:self._count]
+
+    def particle_positions(self, particle, every=1):
+        """
+        The positions of one particle in every 'every'-th frame, as an array of shape (frames, 3).
+        """
+        return self._frames['positions'][:self._count:every, particle]
+
+
+def _written_count(frames):
+    import numpy
+    unwritten = numpy.flatnonzero(frames['step'] < 0)
+    return int(unwritten[0]) if len(unwritten) else len(frames)
+
+
+def _grow(path, frame_count):
+    from numpy.lib import format
+    frames = format.open_memmap(path, mode='r')
+    if frame_count <= len(frames):
+        return
+    temporary_path = path + '.tmp'
+    grown = format.open_memmap(temporary_path, mode='w+', dtype=frames.dtype, shape=(frame_count,))
+    grown['step'] = -1
+    grown[:len(frames)] = frames
+    grown.flush()
+    # the maps are closed before the file they map is replaced
+    del frames, grown
+    os.replace(temporary_path, path)
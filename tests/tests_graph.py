@@ -1,5 +1,10 @@
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from pychem.molecule import graph
 
 
@@ -63,6 +68,250 @@ class TestGraphAlgorithms(unittest.TestCase):
         self.assertEqual(distances, {'1': 0, '2': 7, '3': 9, '4': 20, '5': 20, '6': 11})
         self.assertEqual(predecessors, {'1': None, '2': '1', '3': '1', '4': '3', '5': '6', '6': '3'})
 
+    def test_dijkstra_multiple_sources(self):
+        distances, predecessors = graph.dijkstra(dijkstra_graph(), ['1', '5'])
+        self.assertEqual(distances, {'1': 0, '2': 7, '3': 9, '4': 6, '5': 0, '6': 9})
+        self.assertEqual(predecessors, {'1': None, '2': '1', '3': '1', '4': '5', '5': None, '6': '5'})
+
+    def test_dijkstra_targets(self):
+        distances, _ = graph.dijkstra(dijkstra_graph(), '1', targets={'2', '3'})
+        self.assertEqual(distances['2'], 7)
+        self.assertEqual(distances['3'], 9)
+        self.assertEqual(distances['5'], float('inf'))
+        self.assertEqual(graph.find_shortest_path(dijkstra_graph(), '1', '5', alg='dijkstra'),
+                         ['1', '3', '6', '5'])
+
+    def test_bellman_ford(self):
+        for spfa in [False, True]:
+            distances, predecessors = graph.bellman_ford(bellman_ford_graph(), 's', spfa=spfa)
+            self.assertEqual(distances, {'s': 0, 't': 2, 'x': 4, 'y': 7, 'z': -2})
+            self.assertEqual(predecessors, {'s': None, 't': 'x', 'x': 'y', 'y': 's', 'z': 't'})
+        self.assertEqual(graph.find_shortest_path(bellman_ford_graph(), 's', 'z'), ['s', 'y', 'x', 't', 'z'])
+
+    def test_bellman_ford_negative_cycle(self):
+        g = bellman_ford_graph()
+        g.create_edge('z', 'y', -6)
+        for spfa in [False, True]:
+            with self.assertRaises(graph.NegativeCycleError) as context:
+                graph.bellman_ford(g, 's', spfa=spfa)
+            cycle = context.exception.cycle
+            self.assertEqual(set(cycle), {'y', 'x', 't', 'z'})
+            self.assertEqual(cycle[cycle.index('z') - 1], 't')
+
+    def test_bfs_shortest_paths(self):
+        distances, predecessors = graph.bfs_shortest_paths(semi_cyclic_graph(), 'A')
+        self.assertEqual(distances, {'A': 0, 'B': 1, 'D': 1, 'C': 2, 'E': 2, 'F': 3, 'G': 4, 'H': 4})
+        self.assertEqual(predecessors['G'], 'F')
+        distances, _ = graph.bfs_shortest_paths(semi_cyclic_graph(), 'A', targets=['B', 'D'])
+        self.assertNotIn('G', distances)
+        self.assertEqual(graph.find_shortest_path(semi_cyclic_graph(), 'A', 'G', alg='bfs'), ['A', 'B', 'E', 'F', 'G'])
+
+    def test_bidirectional_bfs(self):
+        self.assertEqual(graph.find_shortest_path(semi_cyclic_graph(), 'A', 'G', alg='bidirectional'),
+                         ['A', 'B', 'E', 'F', 'G'])
+        self.assertEqual(graph.bidirectional_bfs(tarjan_graph(), 'A', 'D'), [])
+        path = graph.bidirectional_bfs(tarjan_graph(), 'H', 'A')
+        self.assertEqual((len(path), path[0], path[-1]), (5, 'H', 'A'))
+
+    @unittest.skipIf(numpy is None, 'requires NumPy')
+    def test_distance_matrix(self):
+        g = dijkstra_graph()
+        ids = [node.identifier for node in g.yield_nodes()]
+        distances, _ = graph.dijkstra(g, '1')
+        self.assertEqual(graph.distance_matrix(g, weighted=True)[ids.index('1')].tolist(),
+                         [distances[identifier] for identifier in ids])
+        matrix = graph.distance_matrix(tarjan_graph())
+        ids = [node.identifier for node in tarjan_graph().yield_nodes()]
+        self.assertEqual(matrix[ids.index('H'), ids.index('A')], 4)
+        self.assertEqual(matrix[ids.index('A'), ids.index('H')], 255)
+
+    def test_ford_fulkerson(self):
+        max_flow, min_cut = graph.ford_fulkerson(ford_fulkerson_graph(), 's', 't')
+        self.assertEqual(max_flow, 13)
+        self.assertCountEqual(min_cut, [('v', 'z'), ('x', 't')])
+
+    def test_max_flow(self):
+        g = ford_fulkerson_graph()
+        for algorithm in ['dinic', 'push_relabel']:
+            result = graph.max_flow(g, 's', 't', algorithm=algorithm)
+            self.assertEqual(result.value, 13)
+            self.assertEqual(result.source_side, {'s', 'u', 'v', 'x', 'y'})
+            flows = {(edge.source.identifier, edge.sink.identifier): flow for edge, flow in result.flows.items()}
+            self.assertEqual(flows[('v', 'z')], 8)
+            self.assertEqual(flows[('x', 't')], 5)
+            self.assertEqual(flows[('z', 't')], 8)
+            self.assertEqual(graph.max_flow(g, 's', 't', algorithm=algorithm, force_unweighted=True).value, 2)
+        # in an undirected graph the edge from t to y can carry flow to t
+        undirected = graph.Graph(directed=False, weighted=True)
+        undirected.create_edges((edge.source.identifier, edge.sink.identifier, edge.weight) for edge in g.edges)
+        self.assertEqual(graph.max_flow(undirected, 's', 't').value, 18)
+        with self.assertRaises(ValueError):
+            graph.max_flow(g, 's', 't', algorithm='simplex')
+
+    def test_tarjan(self):
+        sccs = [{node.identifier for node in scc} for scc in graph.tarjan(tarjan_graph())]
+        self.assertCountEqual(sccs, [{'A', 'B', 'E', 'I'}, {'C', 'D'}, {'F', 'G'}, {'H'}])
+        # every SCC is completed before the SCCs with edges into it
+        self.assertEqual(sccs[-1], {'H'})
+
+    def test_tarjan_long_cycle(self):
+        # deeper than the recursion limit
+        length = 100000
+        csr = graph.CSRGraph(length, [(node, (node + 1) % length) for node in range(length)], directed=True)
+        count, labels = graph.scc_labels(csr)
+        self.assertEqual(count, 1)
+        self.assertEqual(set(labels), {0})
+
+    def test_biconnected_components(self):
+        g = semi_cyclic_graph()
+        components = [sorted(sorted(node.identifier for node in (edge.source, edge.sink)) for edge in component)
+                      for component in graph.biconnected_components(g)]
+        self.assertCountEqual(components, [[['A', 'B'], ['A', 'D'], ['B', 'C'], ['C', 'D']], [['B', 'E']],
+                                           [['E', 'F']], [['F', 'G'], ['F', 'H'], ['G', 'H']]])
+        self.assertCountEqual([{edge.source.identifier, edge.sink.identifier} for edge in graph.bridges(g)],
+                              [{'B', 'E'}, {'E', 'F'}])
+        # a parallel edge is not a bridge
+        g.create_edge('B', 'E')
+        self.assertEqual(len(graph.bridges(g)), 1)
+        with self.assertRaises(ValueError):
+            graph.bridges(tarjan_graph())
+
+    def test_longest_paths(self):
+        tree = graph.Graph(directed=False)
+        tree.create_edges([('A', 'B'), ('B', 'C'), ('B', 'D'), ('D', 'E'), ('C', 'F')])
+        paths = graph.longest_paths(tree)
+        self.assertEqual([[node.identifier for node in path] for path in paths], [['F', 'C', 'B', 'D', 'E']])
+        # all tied paths through the center B of the induced subgraph, each in one direction
+        paths = graph.longest_paths(tree, ['A', 'B', 'C', 'D'])
+        self.assertCountEqual([''.join(sorted(path)) for path in paths], ['ABC', 'ABD', 'BCD'])
+        # with cycles the paths run around the rings
+        paths = graph.longest_paths(semi_cyclic_graph())
+        self.assertCountEqual([''.join(node.identifier for node in path) for path in paths],
+                              ['ADCBEFGH', 'ADCBEFHG', 'CDABEFGH', 'CDABEFHG'])
+        self.assertEqual(len(graph.longest_paths(semi_cyclic_graph(), max_paths=1)), 1)
+        with self.assertRaises(ValueError):
+            graph.longest_paths(tarjan_graph())
+
+
+def _csr_and_ids(g):
+    csr = graph.CSRGraph.from_graph(g)
+    return csr, [node.identifier for node in csr.nodes]
+
+
+class TestCSRGraph(unittest.TestCase):
+    def test_csr_graph(self):
+        csr, ids = _csr_and_ids(dijkstra_graph())
+        self.assertEqual(len(csr), 6)
+        self.assertEqual(csr.edge_count, 9)
+        self.assertEqual(len(csr.neighbors), 18)
+        self.assertEqual(sorted(ids[node] for node in csr.adj_nodes(ids.index('3'))), ['1', '2', '4', '6'])
+        with self.assertRaises(AttributeError):
+            csr.directed = True
+
+    def test_dijkstra(self):
+        csr, ids = _csr_and_ids(dijkstra_graph())
+        distances, predecessors = graph.dijkstra(csr, ids.index('1'))
+        self.assertEqual(dict(zip(ids, distances)), {'1': 0, '2': 7, '3': 9, '4': 20, '5': 20, '6': 11})
+        self.assertEqual(ids[predecessors[ids.index('5')]], '6')
+
+    def test_bellman_ford(self):
+        csr, ids = _csr_and_ids(bellman_ford_graph())
+        distances, _ = graph.bellman_ford(csr, ids.index('s'))
+        self.assertEqual(dict(zip(ids, distances)), {'s': 0, 't': 2, 'x': 4, 'y': 7, 'z': -2})
+
+    def test_bfs_shortest_paths(self):
+        csr, ids = _csr_and_ids(semi_cyclic_graph())
+        path = graph.find_shortest_path(csr, ids.index('A'), ids.index('G'), alg='bfs')
+        self.assertEqual([ids[node] for node in path], ['A', 'B', 'E', 'F', 'G'])
+        path = graph.bidirectional_bfs(csr, ids.index('A'), ids.index('G'))
+        self.assertEqual([ids[node] for node in path], ['A', 'B', 'E', 'F', 'G'])
+        distances, _ = graph.bfs_shortest_paths(csr, ids.index('A'))
+        self.assertEqual(list(graph.bfs_levels(csr, ids.index('A'))), distances)
+
+    def test_bidirectional_bfs_directed(self):
+        csr, ids = _csr_and_ids(tarjan_graph())
+        path = graph.bidirectional_bfs(csr, ids.index('H'), ids.index('A'))
+        self.assertEqual((len(path), ids[path[0]], ids[path[-1]]), (5, 'H', 'A'))
+        for node, adj_node in zip(path, path[1:]):
+            self.assertIn(adj_node, csr.adj_nodes(node))
+        levels = graph.bfs_levels(csr, ids.index('A'))
+        self.assertEqual({ids[node]: levels[node] for node in range(len(csr))},
+                         {'A': 0, 'E': 1, 'B': 2, 'I': 3, 'C': -1, 'D': -1, 'F': -1, 'G': -1, 'H': -1})
+
+    def test_ford_fulkerson(self):
+        csr, ids = _csr_and_ids(ford_fulkerson_graph())
+        max_flow, min_cut = graph.ford_fulkerson(csr, ids.index('s'), ids.index('t'))
+        self.assertEqual(max_flow, 13)
+        self.assertEqual({(ids[node], ids[adj_node]) for node, adj_node in min_cut}, {('v', 'z'), ('x', 't')})
+
+    def test_tarjan(self):
+        csr, ids = _csr_and_ids(tarjan_graph())
+        sccs = [{ids[node] for node in scc} for scc in graph.tarjan(csr)]
+        self.assertCountEqual(sccs, [{'A', 'B', 'E', 'I'}, {'C', 'D'}, {'F', 'G'}, {'H'}])
+
+
+def cube_graph():
+    g = graph.Graph(directed=False, weighted=False)
+    edges = [(a, b) for a in range(8) for b in range(a + 1, 8) if bin(a ^ b).count('1') == 1]
+    g.create_edges(edges)
+    return g
+
+
+class TestRingPerception(unittest.TestCase):
+    def _node_sets(self, cycles):
+        return sorted(sorted(node.identifier for node in cycle) for cycle in cycles)
+
+    def test_semi_cyclic(self):
+        rings = graph.perceive_rings(semi_cyclic_graph())
+        self.assertEqual(rings.cyclomatic_number, 2)
+        self.assertEqual(self._node_sets(rings.sssr), [['A', 'B', 'C', 'D'], ['F', 'G', 'H']])
+        self.assertEqual(self._node_sets(rings.relevant_cycles), self._node_sets(rings.sssr))
+
+    def test_cube(self):
+        rings = graph.perceive_rings(cube_graph())
+        self.assertEqual(rings.cyclomatic_number, 5)
+        self.assertEqual([len(cycle) for cycle in rings.sssr], [4] * 5)
+        # all six faces are relevant, any five of them form an SSSR
+        self.assertEqual(len(rings.relevant_cycles), 6)
+        for cycle in rings.relevant_cycles:
+            for i, node in enumerate(cycle):
+                self.assertIn(cycle[i-1], node.adj_nodes)
+
+    def test_reduce_graph(self):
+        g = semi_cyclic_graph()
+        g.create_edges([('H', 'I'), ('I', 'J')])
+        self.assertEqual([node.identifier for node in graph._remove_degree1_nodes(g, recursive=False)],
+                         ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I'])
+        core = graph._remove_degree1_nodes(g)
+        self.assertEqual([node.identifier for node in core], ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'])
+        chains = [[node.identifier for node in chain] for chain in graph.get_all_degree2_chains(g, core)]
+        self.assertCountEqual(chains, [['B', 'A', 'D', 'C', 'B'], ['B', 'E', 'F'], ['F', 'G', 'H', 'F']])
+        reduced, _ = graph.reduce_graph(g)
+        self.assertEqual((len(reduced.nodes), len(reduced.edges)), (2, 3))
+        self.assertCountEqual([edge.weight for edge in reduced.edges], [4, 2, 3])
+        self.assertEqual(graph.cyclomatic_number(reduced), 2)
+
+    def test_reduced_rings(self):
+        for g in [semi_cyclic_graph(), cube_graph()]:
+            rings = graph.perceive_rings(g, reduce=False)
+            reduced_rings = graph.perceive_rings(g)
+            self.assertEqual(sorted(len(cycle) for cycle in reduced_rings.sssr),
+                             sorted(len(cycle) for cycle in rings.sssr))
+            self.assertEqual(self._node_sets(reduced_rings.relevant_cycles),
+                             self._node_sets(rings.relevant_cycles))
+
+    def test_chordless_cycles(self):
+        self.assertEqual(self._node_sets(graph.chordless_cycles(semi_cyclic_graph())),
+                         [['A', 'B', 'C', 'D'], ['F', 'G', 'H']])
+        # the six faces and the four hexagons around a pair of opposite corners
+        self.assertEqual(sorted(len(cycle) for cycle in graph.chordless_cycles(cube_graph())), [4] * 6 + [6] * 4)
+
+    def test_acyclic(self):
+        g = graph.Graph(directed=False, weighted=False)
+        g.create_edges([('A', 'B'), ('B', 'C'), ('B', 'D')])
+        self.assertEqual(graph.perceive_rings(g), (0, (), ()))
+        self.assertEqual(graph.cyclomatic_number(g), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,19 @@
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
 import unittest
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from pychem import Molecule
+from pychem.molecule import elements, fingerprint, geometrics, graph, substructure
+from pychem.molecule.molecule import Atom, Bond, topological_descriptors
+from pychem.molecule.parsers import iupac, smiles
 
 
 class TestSmiles(unittest.TestCase):
@@ -14,7 +28,7 @@ class TestSmiles(unittest.TestCase):
                                         '@@H]%10[C@@H]9C[C@@H](O)[C@@]%11(C)C%10=C[C@H](O%12)[C@]%11(O)[C@H](C'
                                         ')[C@]%12(O%13)[C@H](O)C[C@@]%13(C)CO')
         for mol, nr_of_atoms in [(ethane, 8),
-                                 # (benzene, 12),
+                                 (benzene, 12),
                                  (benzene2, 12),
                                  (alanine, 13),
                                  (asparagine, 17),
@@ -25,5 +39,487 @@ class TestSmiles(unittest.TestCase):
                 print(atom.symbol, len(atom.adj_atoms))
             self.assertEqual(len(mol.atoms), nr_of_atoms)
 
+    def test_smiles_syntax(self):
+        cyclohexene = Molecule(smiles='C=1CCCCC=1')
+        self.assertEqual(len(cyclohexene.atoms), 16)
+        self.assertEqual([bond.bond_type for bond in cyclohexene.bonds].count('='), 1)
+        toluene = Molecule(smiles='Cc1ccccc1')
+        self.assertEqual(len(toluene.atoms), 15)
+        copper_sulfate = Molecule(smiles='[Cu+2].[O-]S(=O)(=O)[O-]')
+        self.assertEqual((len(copper_sulfate.atoms), len(copper_sulfate.bonds)), (6, 4))
+        for invalid_smiles in ['C(C', 'CC)', 'C1CC', '(C)', 'C[C', 'C*', 'C11', 'CC%12%12']:
+            with self.assertRaises(ValueError):
+                Molecule(smiles=invalid_smiles)
+
+    def test_deep_branches(self):
+        depth = 5000
+        molecule = Molecule(smiles='C' + '(C' * depth + ')' * depth)
+        self.assertEqual(len(molecule.atoms), 3 * (depth + 1) + 2)
+
+
+class TestElements(unittest.TestCase):
+    def test_get_element(self):
+        carbon = elements.get_element(6)
+        self.assertEqual((carbon.name, carbon.symbol, carbon.atomic_number), ('carbon', 'C', 6))
+        for key in ['C', 'c', 'carbon', 'Carbon']:
+            self.assertIs(elements.get_element(key), carbon)
+        self.assertIs(elements.get_element('cl'), elements.get_element(17))
+        self.assertIs(elements.element_table()[6], carbon)
+        with self.assertRaises(KeyError):
+            elements.get_element('Xx')
+        with self.assertRaises(ValueError):
+            Atom('Xx', None)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = elements.CACHE_PATH
+            try:
+                elements.CACHE_PATH = os.path.join(directory, 'elements.cache')
+                rows = elements._compile_rows()
+                elements._write_cache(elements.CACHE_PATH, elements.ELEMENTS_PATH, rows)
+                self.assertEqual(elements._read_cache(elements.CACHE_PATH, elements.ELEMENTS_PATH), rows)
+            finally:
+                elements.CACHE_PATH = cache_path
+
+    def test_cache_not_writable(self):
+        self.assertNotEqual(os.path.dirname(elements.CACHE_PATH), elements.DATA_DIR)
+        with tempfile.TemporaryDirectory() as directory:
+            blocking_file = os.path.join(directory, 'file')
+            open(blocking_file, 'w').close()
+            cache_path = elements.CACHE_PATH
+            try:
+                # the cache directory can not be made inside a file: the table is only kept in memory
+                elements.CACHE_PATH = os.path.join(blocking_file, 'elements.cache')
+                elements._table = elements._index = None
+                self.assertEqual(elements.get_element('C').atomic_number, 6)
+                self.assertFalse(os.path.exists(elements.CACHE_PATH))
+            finally:
+                elements.CACHE_PATH = cache_path
+
+    def test_legacy_tables(self):
+        from pychem.molecule import molecule
+        self.assertIs(molecule.ELEMENTS, molecule.ELEMENTS)
+        self.assertEqual(molecule.ELEMENTS['carbon'].symbol, 'C')
+        self.assertIs(molecule.TRANSLATE_ELEMENT, molecule.TRANSLATE_ELEMENT)
+        self.assertEqual(molecule.TRANSLATE_ELEMENT['Cl'], 'chlorine')
+
+
+class TestIsotopes(unittest.TestCase):
+    def test_find_isotope(self):
+        copper = elements.find_isotope('52Cu')
+        self.assertEqual((copper.atomic_number, copper.neutron_count), (29, 23))
+        self.assertAlmostEqual(copper.mass, 51.99718)
+        self.assertAlmostEqual(copper.mass_uncertainty, 0.00028)
+        self.assertEqual(elements.get_isotope(29, 23).symbol, copper.symbol)
+        carbon = elements.get_isotope(6, 8)
+        self.assertEqual(carbon.symbol, '14C')
+        self.assertAlmostEqual(carbon.half_life / 31557600, 5730)
+        self.assertEqual(elements.find_isotope('12C').half_life, float('inf'))
+        self.assertAlmostEqual(elements.find_isotope('35Cl').abundance, 0.7576)
+        self.assertAlmostEqual(elements.isotope_mass(1, 2), 2.0141017778)
+        with self.assertRaises(KeyError):
+            elements.find_isotope('2C')
+
+    def test_isotope_mass(self):
+        methane = Molecule(smiles='[13CH4]')
+        self.assertAlmostEqual(methane.mass, 13.0033548378 + 4 * elements.get_element('H').atomic_weight)
+        heavy_water = Molecule(smiles='[2H]O[2H]')
+        self.assertAlmostEqual(heavy_water.mass, 2 * 2.0141017778 + elements.get_element('O').atomic_weight)
+        with self.assertRaises(ValueError):
+            Molecule(smiles='[2C]')
+
+    def test_isotope_mass_first_use(self):
+        # in a fresh interpreter nothing has loaded the isotope table before
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment = dict(os.environ, PYTHONPATH=root)
+        output = subprocess.check_output([sys.executable, '-c', 'from pychem.molecule import elements; '
+                                          'print(elements.isotope_mass(6, 13))'], env=environment)
+        self.assertAlmostEqual(float(output), 13.0033548378)
+        output = subprocess.check_output([sys.executable, '-c', 'from pychem import Molecule; '
+                                          'print(Molecule(smiles="[13CH4]").mass)'], env=environment)
+        self.assertAlmostEqual(float(output), 13.0033548378 + 4 * elements.get_element('H').atomic_weight)
+
+
+class TestImplicitHydrogens(unittest.TestCase):
+    SMILES = ['CC', 'c1ccccc1', 'O=C(N)C[C@H](N)C(=O)O', '[NH4+].[Cl-]', 'C[2H]', '[H][H]']
+
+    def test_implicit_hydrogens(self):
+        ethane = Molecule(smiles='CC', implicit_hydrogens=True)
+        self.assertEqual(len(ethane.atoms), 2)
+        self.assertEqual([atom.hydrogen_count for atom in ethane.atoms], [3, 3])
+        self.assertEqual(ethane.formula(), 'C2H6')
+        self.assertEqual(Molecule(smiles='[NH4+].[Cl-]', implicit_hydrogens=True).formula(), 'ClH4N')
+
+    def test_same_properties(self):
+        for smiles_string in self.SMILES:
+            explicit = Molecule(smiles=smiles_string)
+            implicit = Molecule(smiles=smiles_string, implicit_hydrogens=True)
+            self.assertAlmostEqual(explicit.mass, implicit.mass)
+            self.assertEqual(explicit.formula(), implicit.formula())
+            self.assertEqual(explicit.hash_molecule(), implicit.hash_molecule())
+            self.assertEqual(explicit.hash_isomer(), implicit.hash_isomer())
+
+    def test_add_and_remove_hydrogens(self):
+        for smiles_string in self.SMILES:
+            molecule = Molecule(smiles=smiles_string)
+            atom_count, digest = len(molecule.atoms), molecule.hash_molecule()
+            molecule.remove_hydrogens()
+            self.assertTrue(all(atom.symbol != 'H' or atom.isotope or not atom.bonds
+                                or atom.adj_atoms[0].symbol == 'H' for atom in molecule.atoms))
+            self.assertEqual(molecule.hash_molecule(), digest)
+            molecule.add_hydrogens()
+            self.assertEqual((len(molecule.atoms), molecule.hash_molecule()), (atom_count, digest))
+
+
+class TestBulkSmiles(unittest.TestCase):
+    LINES = ['CC ethane\n', '\n', 'C(C broken\n', 'O=C(O)C(N)C L-alanine\n']
+
+    def test_parse_many(self):
+        records = list(smiles.parse_many(self.LINES, workers=0))
+        self.assertEqual([record.line_number for record in records], [1, 3, 4])
+        self.assertEqual([record.identifier for record in records], ['ethane', 'broken', 'L-alanine'])
+        self.assertEqual(len(records[0].molecule.atoms), 2)
+        self.assertEqual(records[0].molecule.formula(), 'C2H6')
+        self.assertIsNone(records[1].molecule)
+        self.assertIsInstance(records[1].error, ValueError)
+        self.assertEqual(len(records[2].molecule.atoms), 6)
+        explicit = list(smiles.parse_many(self.LINES, workers=0, implicit_hydrogens=False))
+        self.assertEqual(len(explicit[0].molecule.atoms), 8)
+
+    def test_parse_many_process_pool(self):
+        lines = self.LINES * 20
+        serial = list(smiles.parse_many(lines, workers=0, transform=Molecule.hash_molecule))
+        parallel = list(smiles.parse_many(lines, workers=2, chunk_size=5, transform=Molecule.hash_molecule))
+        self.assertEqual([record.molecule for record in parallel], [record.molecule for record in serial])
+        unordered = smiles.parse_many(lines, workers=2, chunk_size=5, ordered=False)
+        self.assertCountEqual([record.line_number for record in unordered],
+                              [record.line_number for record in serial])
+
+    def test_parse_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'molecules.smi')
+            with open(path, 'w') as smiles_file:
+                smiles_file.writelines(self.LINES)
+            identifiers = [record.identifier for record in smiles.parse_file(path, workers=0)]
+        self.assertEqual(identifiers, ['ethane', 'broken', 'L-alanine'])
+
+    def test_pickle(self):
+        alanine = Molecule(smiles='O=C(O)C(N)C')
+        copy = pickle.loads(pickle.dumps(alanine))
+        self.assertEqual(len(copy.atoms), 13)
+        self.assertEqual(copy.mass, alanine.mass)
+        self.assertEqual(copy.hash_molecule(), alanine.hash_molecule())
+
+
+def _shuffled_copy(molecule, seed):
+    """
+    A copy of 'molecule' with its atoms and bonds in another order.
+    """
+    shuffle = random.Random(seed)
+    state = molecule.__getstate__()
+    order = list(range(len(state['atoms'])))
+    shuffle.shuffle(order)
+    position = {old: new for new, old in enumerate(order)}
+    state['atoms'] = [state['atoms'][old] for old in order]
+    state['bonds'] = [(position[sink], position[source], bond_type) if shuffle.random() < 0.5
+                      else (position[source], position[sink], bond_type)
+                      for source, sink, bond_type in state['bonds']]
+    shuffle.shuffle(state['bonds'])
+    copy = Molecule.__new__(Molecule)
+    copy.__setstate__(state)
+    return copy
+
+
+class TestCanonicalRanks(unittest.TestCase):
+    def test_canonical_order(self):
+        alanine = Molecule(smiles='O=C(O)C(N)C')
+        ranks = alanine.canonical_ranks()
+        self.assertEqual(sorted(ranks.values()), list(range(13)))
+        self.assertEqual([atom.symbol for atom in alanine.canonical_order()][:6], ['O', 'O', 'N', 'C', 'C', 'C'])
+
+    def test_same_molecule_same_hash(self):
+        for smiles_1, smiles_2 in [('O=C(O)C(N)C', 'CC(N)C(=O)O'),
+                                   ('C1=CC=CC=C1', 'C1C=CC=CC=1'),
+                                   ('OCC(O)CO', 'C(O)C(CO)O')]:
+            self.assertEqual(Molecule(smiles=smiles_1).bond_table(), Molecule(smiles=smiles_2).bond_table())
+            self.assertEqual(Molecule(smiles=smiles_1).hash_molecule(), Molecule(smiles=smiles_2).hash_molecule())
+
+    def test_different_molecule_different_hash(self):
+        self.assertNotEqual(Molecule(smiles='CCCO').hash_molecule(), Molecule(smiles='CC(C)O').hash_molecule())
+        self.assertNotEqual(Molecule(smiles='NCC(=O)OC').hash_molecule(),
+                            Molecule(smiles='CC(N)C(=O)O').hash_molecule())
+        for smiles_1, smiles_2 in [('[CH2]=[CH2]', '[CH2][CH2]'), ('[O]=[O]', '[O][O]'), ('C#N', 'C=N')]:
+            self.assertNotEqual(Molecule(smiles=smiles_1).hash_molecule(), Molecule(smiles=smiles_2).hash_molecule())
+            self.assertNotEqual(Molecule(smiles=smiles_1).hash_isomer(), Molecule(smiles=smiles_2).hash_isomer())
+
+    def test_symmetric_cage_atom_order(self):
+        # refinement alone leaves all atoms of these cages tied, so their ranks come from the tie breaking
+        for cage in ['C12C3C4C5C1C6C7C2C3C8C4C5C6C78', 'C1C2CC3CC4CC1CC(C2)C(C3)C4']:
+            molecule = Molecule(smiles=cage)
+            for seed in range(10):
+                shuffled = _shuffled_copy(molecule, seed)
+                self.assertEqual(shuffled.hash_molecule(), molecule.hash_molecule())
+                self.assertEqual(shuffled.bond_table(), molecule.bond_table())
+                self.assertEqual([atom.symbol for atom in shuffled.canonical_order()],
+                                 [atom.symbol for atom in molecule.canonical_order()])
+
+
+class TestHashing(unittest.TestCase):
+    def test_hash_is_cached_and_invalidated(self):
+        propanol = Molecule(smiles='CCCO')
+        digest = propanol.hash_molecule()
+        self.assertEqual(len(digest), 16)
+        self.assertIs(propanol.hash_molecule(), digest)
+
+        carbon = Atom('C', propanol)
+        propanol.add_atom(carbon)
+        propanol.add_bond(Bond(carbon, next(iter(propanol.atoms))))
+        self.assertNotEqual(propanol.hash_molecule(), digest)
+
+    def test_hash_isomer_charges(self):
+        molecules = list()
+        for charge in [0, 1]:
+            molecule = Molecule()
+            nitrogen, carbon = Atom('N', molecule, charge=charge), Atom('C', molecule)
+            molecule.add_atom(nitrogen)
+            molecule.add_atom(carbon)
+            molecule.add_bond(Bond(nitrogen, carbon))
+            molecules.append(molecule)
+        self.assertEqual(molecules[0].hash_molecule(), molecules[1].hash_molecule())
+        self.assertNotEqual(molecules[0].hash_isomer(), molecules[1].hash_isomer())
+
+
+class TestRings(unittest.TestCase):
+    CEPHALOSTATIN = 'C[C@@](C)(O1)C[C@@H](O)[C@@]1(O2)[C@@H](C)[C@@H]3CC=C4[C@]3(C2)C(=O)C[C@H]5[C@H]4CC[C@@H](C' \
+                    '6)[C@]5(C)Cc(n7)c6nc(C[C@@]89(C))c7C[C@@H]8CC[C@@H]%10[C@@H]9C[C@@H](O)[C@@]%11(C)C%10=C[C@H' \
+                    '](O%12)[C@]%11(O)[C@H](C)[C@]%12(O%13)[C@H](O)C[C@@]%13(C)CO'
+
+    def test_ring_sizes(self):
+        for smiles_string, sssr_sizes, relevant_sizes in [('CC', [], []),
+                                                          ('c1ccc2ccccc2c1', [6, 6], [6, 6]),
+                                                          ('C1CC2CCC1CC2', [6, 6], [6, 6, 6]),
+                                                          ('C1C2CC3CC1CC(C2)C3', [6, 6, 6], [6, 6, 6, 6]),
+                                                          (self.CEPHALOSTATIN, [5] * 5 + [6] * 8, [5] * 5 + [6] * 8)]:
+            molecule = Molecule(smiles=smiles_string)
+            self.assertEqual(molecule.cyclomatic_number(), len(sssr_sizes))
+            self.assertEqual(sorted(len(ring) for ring in molecule.sssr()), sssr_sizes)
+            self.assertEqual(sorted(len(ring) for ring in molecule.relevant_cycles()), relevant_sizes)
+
+    def test_reduced_graph(self):
+        for smiles_string in ['C1CC2CCC1CC2', 'C1CC11CC1', 'CCCCC1CCCC(CCC)C1CCC', self.CEPHALOSTATIN]:
+            molecule = Molecule(smiles=smiles_string)
+            rings = graph.perceive_rings(molecule, reduce=False)
+            self.assertCountEqual([frozenset(ring) for ring in molecule.relevant_cycles()],
+                                  [frozenset(ring) for ring in rings.relevant_cycles])
+
+    def test_rings_are_cached(self):
+        molecule = Molecule(smiles='c1ccccc1')
+        self.assertIs(molecule.ring_info(), molecule.ring_info())
+        self.assertTrue(all(atom.symbol == 'C' for atom in molecule.sssr()[0]))
+        molecule.remove_hydrogens()
+        self.assertEqual(len(molecule.sssr()), 1)
+
+    def test_ring_systems(self):
+        # naphthalene and benzene, joined by a CH2 linker
+        molecule = Molecule(smiles='c1ccc2ccccc2c1Cc1ccccc1', implicit_hydrogens=True)
+        self.assertEqual(sorted(len(ring_system) for ring_system in molecule.ring_systems()), [6, 10])
+        self.assertEqual(len(molecule.chain_bonds()), 2)
+        # spiro rings only share an atom
+        self.assertEqual(len(Molecule(smiles='C1CCC2(CC1)CCCC2').ring_systems()), 2)
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestDistances(unittest.TestCase):
+    def test_distance_matrix(self):
+        molecule = Molecule(smiles='CC(C)CO', implicit_hydrogens=True)
+        matrix = molecule.distance_matrix()
+        self.assertEqual(matrix.dtype, numpy.uint8)
+        self.assertEqual(matrix[0].tolist(), [0, 1, 2, 2, 3])
+        self.assertEqual(matrix[4].tolist(), [3, 2, 3, 1, 0])
+        self.assertIs(molecule.distance_matrix(), matrix)
+        self.assertFalse(matrix.flags.writeable)
+        salt = Molecule(smiles='[Na+].[Cl-]').distance_matrix()
+        self.assertEqual(salt[0, 1], 255)
+
+    def test_descriptors(self):
+        # the Wiener index of butane and isobutane; hydrogens are left out
+        self.assertEqual(Molecule(smiles='CCCC').wiener_index(), 10)
+        self.assertEqual(Molecule(smiles='CC(C)C', implicit_hydrogens=True).wiener_index(), 9)
+        cyclohexane = Molecule(smiles='C1CCCCC1')
+        self.assertEqual(cyclohexane.diameter(), 3)
+        self.assertEqual(set(cyclohexane.eccentricities().values()), {3})
+        descriptors = topological_descriptors([Molecule(smiles=smiles_string)
+                                               for smiles_string in ['C', 'CCCCC', 'C1CCCCC1', 'CC.CCC']])
+        self.assertEqual(descriptors.wiener_indices.tolist(), [0, 20, 27, 5])
+        self.assertEqual(descriptors.diameters.tolist(), [0, 4, 3, 2])
+        self.assertEqual(descriptors.eccentricities[1].tolist(), [4, 3, 2, 3, 4])
+
+
+class TestChains(unittest.TestCase):
+    def test_longest_carbon_chains(self):
+        # 2,2,4-trimethylpentane: three methyl groups on one end and two on the other
+        chains = Molecule(smiles='CC(C)(C)CC(C)C').longest_carbon_chains()
+        self.assertEqual(len(chains), 6)
+        self.assertEqual({len(chain) for chain in chains}, {5})
+        # the ring atoms are only part of a chain on request
+        molecule = Molecule(smiles='C1CCCCC1CCCC(C)C')
+        self.assertEqual({len(chain) for chain in molecule.longest_carbon_chains()}, {5})
+        self.assertEqual({len(chain) for chain in molecule.longest_carbon_chains(include_rings=True)}, {11})
+        self.assertEqual(Molecule(smiles='c1ccccc1').longest_carbon_chains(), ())
+
+    def test_geometrics(self):
+        molecule = Molecule(smiles='CCC(CC)C(C)CCC')
+        chains = geometrics.list_longest_chains(molecule.atoms)
+        self.assertEqual([len(chain) for chain in chains], [7, 7])
+        self.assertEqual(len(geometrics.list_ending_atoms(molecule.atoms)), 4)
+
+    def test_parent_chain(self):
+        # 3-ethyl-2-methylpentane: of the chains of five carbon atoms, the ones with two substituents
+        molecule = Molecule(smiles='CC(C)C(CC)CC')
+        parent_chain = iupac._find_parent_chain(molecule)
+        self.assertEqual(len(parent_chain), 5)
+        self.assertEqual(iupac._substituent_count(parent_chain), 2)
+        self.assertIsNone(iupac._find_parent_chain(Molecule(smiles='C1CC1')))
+
+
+class TestSubstructure(unittest.TestCase):
+    def test_query(self):
+        benzene = substructure.Query('c1ccccc1')
+        self.assertTrue(benzene.has_match(Molecule(smiles='c1ccccc1CC')))
+        self.assertFalse(benzene.has_match(Molecule(smiles='C1CCCCC1')))
+        self.assertEqual(len(benzene.find_matches(Molecule(smiles='c1ccccc1'), unique=False)), 12)
+        self.assertEqual(len(benzene.find_matches(Molecule(smiles='c1ccccc1'))), 1)
+        # the atoms of a group have no other neighbors: the hydroxyl group of an acid, not the oxygen of an ester
+        acid = substructure.Query('-C(=O)O')
+        self.assertEqual(acid.count_matches(Molecule(smiles='OC(=O)CCC(=O)O')), 2)
+        self.assertFalse(acid.has_match(Molecule(smiles='CC(=O)OC')))
+        match = acid.find_matches(Molecule(smiles='CC(=O)O', implicit_hydrogens=True))[0]
+        self.assertEqual([atom.symbol for atom in match], ['C', 'O', 'O', 'C'])
+        self.assertFalse(substructure.Query('-[S](=O)O').has_match(Molecule(smiles='CS(=O)(=O)O')))
+        self.assertTrue(substructure.Query('[S](=O)O').has_match(Molecule(smiles='CS(=O)(=O)O')))
+        with self.assertRaises(ValueError):
+            substructure.Query('')
+
+    def test_match_all(self):
+        molecules = [Molecule(smiles=smiles_string) for smiles_string in ['CC(=O)O', '[NH4+].[Cl-]', 'CCO']]
+        self.assertEqual(list(substructure.match_all(['C=O', '[NH4+]', '-O'], molecules)),
+                         [[True, False, True], [False, True, False], [False, False, True]])
+        groups = list(iupac.find_functional_groups(molecules))
+        self.assertEqual(groups, [{'carboxylic acid': 1}, {'ammonium': 1}, {}])
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestFingerprints(unittest.TestCase):
+    smiles_strings = ['CC(=O)O', 'OC(=O)CCC(=O)O', 'CC(=O)OC', 'c1ccccc1O', 'c1ccc2ccccc2c1', 'CCO', 'CCCCCC']
+
+    def test_fingerprint(self):
+        molecule = Molecule(smiles='c1ccccc1O')
+        words = fingerprint.fingerprint(molecule, n_bits=256)
+        self.assertEqual(words.dtype, numpy.uint64)
+        self.assertEqual(words.shape, (4,))
+        self.assertIs(fingerprint.fingerprint(molecule, n_bits=256), words)
+        # every bit of a substructure is set in the molecule
+        query_words = fingerprint.fingerprint(substructure.Query('-O'), n_bits=256)
+        self.assertTrue(((words & query_words) == query_words).all())
+        with self.assertRaises(ValueError):
+            fingerprint.fingerprint(molecule, n_bits=100)
+
+    def test_screen_and_search(self):
+        molecules = [Molecule(smiles=smiles_string) for smiles_string in self.smiles_strings]
+        index = fingerprint.FingerprintIndex(n_bits=256)
+        index.add(molecules)
+        self.assertEqual(len(index), len(molecules))
+        for pattern in ['-C(=O)O', 'c1ccccc1', 'CCO', 'C=O', 'N']:
+            query = substructure.Query(pattern)
+            matches = [row for row, molecule in enumerate(molecules) if query.has_match(molecule)]
+            self.assertTrue(set(matches).issubset(index.screen(query).tolist()))
+            self.assertEqual(index.search(query), matches)
+        self.assertEqual(index.search('N'), [])
+
+    def test_similar(self):
+        molecules = [Molecule(smiles=smiles_string) for smiles_string in self.smiles_strings]
+        index = fingerprint.FingerprintIndex()
+        index.add(molecules[:4])
+        index.add_fingerprints(fingerprint.fingerprints(molecules[4:]), molecules[4:])
+        rows, similarities = index.similar(Molecule(smiles='CC(=O)O'), k=3)
+        self.assertEqual(rows[0], 0)
+        self.assertEqual(similarities[0], 1.0)
+        self.assertEqual(len(rows), 3)
+        self.assertTrue((numpy.diff(similarities) <= 0).all())
+        # the index keeps a molecule for every row or for none
+        with self.assertRaises(ValueError):
+            index.add_fingerprints(fingerprint.fingerprints(molecules))
+
+
+class TestMemory(unittest.TestCase):
+    def test_compact_atoms_and_bonds(self):
+        propane = Molecule(smiles='CCC')
+        for item in list(propane.atoms) + list(propane.bonds):
+            self.assertTrue(hasattr(type(item), '__slots__'))
+            self.assertFalse(hasattr(item, '__dict__'))
+        for atom in propane.atoms:
+            # a hydrogen keeps its one bond itself instead of in a list
+            if len(atom.bonds) == 1:
+                self.assertIsInstance(atom._edges, Bond)
+            else:
+                self.assertIsInstance(atom._edges, list)
+        self.assertIsNone(Atom('C', propane)._edges)
+
+    def test_memory_per_atom(self):
+        Molecule(smiles='CC')
+        tracemalloc.start()
+        try:
+            polyethylene = Molecule(smiles='C' * 3000)
+            used_memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.clear_traces()
+            reference = _old_layout(polyethylene)
+            reference_memory, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(reference.nodes), 9002)
+        self.assertLessEqual(used_memory * 3, reference_memory)
+
+
+class _OldNode:
+    pass
+
+
+class _OldEdge:
+    pass
+
+
+def _old_layout(molecule):
+    """
+    A copy of 'molecule' stored the way atoms and bonds used to be: plain objects with an instance dict, the
+    element fields copied onto every atom, and the adjacent atoms and the bonds of an atom in sets.
+    """
+    layout = _OldNode()
+    layout.nodes, layout.edges = set(), set()
+    copies = dict()
+    for atom in molecule.atoms:
+        copy = _OldNode()
+        copy.identifier = None
+        copy.adj_nodes, copy.edges = set(), set()
+        copy.adj_atoms, copy.bonds = copy.adj_nodes, copy.edges
+        copy.molecule = layout
+        copy.element = atom.element
+        copy.isotope, copy.charge, copy.aromatic, copy.isomer = atom.isotope, atom.charge, atom.aromatic, atom.isomer
+        copy.symbol = atom.symbol
+        copy.atomic_number = atom.atomic_number
+        copy.atomic_weight = atom.atomic_weight
+        copy.electronegativity = atom.electronegativity
+        copies[atom] = copy
+        layout.nodes.add(copy)
+    for bond in molecule.bonds:
+        copy = _OldEdge()
+        copy.source, copy.sink, copy.weight = copies[bond.source], copies[bond.sink], 1
+        copy.electron_count, copy.bond_type = bond.electron_count, bond.bond_type
+        for node, other_node in ((copy.source, copy.sink), (copy.sink, copy.source)):
+            node.adj_nodes.add(other_node)
+            node.edges.add(copy)
+        layout.edges.add(copy)
+    return layout
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,419 @@
+import os
+import random
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from pychem.particlesim import checkpoint, electron_simulation, forces, integrators, nbody, trajectory
+
+
+def random_system(count, seed=0):
+    random_state = numpy.random.default_rng(seed)
+    charges = numpy.where(numpy.arange(count) % 2 == 0, 1.0, -1.0)
+    masses = numpy.where(charges > 0, 1.007276466879, 5.4857991e-4)
+    return nbody.ParticleSystem(random_state.uniform(-500, 500, (count, 3)), random_state.normal(0, 1, (count, 3)),
+                                masses, charges)
+
+
+def hydrogen_orbit(radius=50.0, speed=1.0):
+    """
+    An electron around a proton at 'radius', at 'speed' times the speed of a circular orbit, with the center
+    of mass at rest. Returns the system and the period of the circular orbit.
+    """
+    masses = numpy.array([1.007276466879, 5.4857991e-4])
+    reduced_mass = masses.prod() / masses.sum()
+    relative_speed = speed / numpy.sqrt(reduced_mass * radius)
+    velocities = numpy.outer([-masses[1], masses[0]], [0, relative_speed, 0]) / masses.sum()
+    system = nbody.ParticleSystem([[0, 0, 0], [radius, 0, 0]], velocities, masses, [1, -1])
+    return system, 2 * numpy.pi * radius / (speed * relative_speed)
+
+
+def direct_forces(system):
+    forces = numpy.zeros((len(system), 3))
+    for i in range(len(system)):
+        for j in range(len(system)):
+            if i != j:
+                delta = system.positions[j] - system.positions[i]
+                distance = numpy.sqrt(delta @ delta)
+                coupling = (nbody.G_REDUCED * system.masses[i] * system.masses[j]
+                            - system.charges[i] * system.charges[j])
+                forces[i] += coupling * delta / distance ** 3
+    return forces
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestNBody(unittest.TestCase):
+    def test_pairwise_forces(self):
+        # more particles than a block of rows
+        system = random_system(150)
+        forces = nbody.pairwise_forces(system)
+        self.assertTrue(numpy.allclose(forces, direct_forces(system), rtol=1e-10, atol=0))
+        # Newton's third law: the forces cancel
+        self.assertLess(numpy.abs(forces.sum(axis=0)).max(), 1e-12 * numpy.abs(forces).max())
+
+    def test_two_charges(self):
+        system = nbody.ParticleSystem([[0, 0, 0], [2, 0, 0]], numpy.zeros((2, 3)), [1, 1], [1, 1])
+        self.assertTrue(numpy.allclose(nbody.pairwise_forces(system), [[-0.25, 0, 0], [0.25, 0, 0]]))
+        with self.assertRaises(ValueError):
+            nbody.ParticleSystem([[0, 0, 0]], numpy.zeros((2, 3)), [1, 1], [1, 1])
+
+    def test_simulate(self):
+        system = random_system(20)
+        trajectory = nbody.simulate(system, 10, 0.01)
+        self.assertEqual(trajectory.shape, (10, 20, 3))
+        self.assertTrue((trajectory[-1] == system.positions).all())
+        self.assertIsNone(nbody.simulate(system, 2, 0.01, record=False))
+
+    def test_electron_simulation(self):
+        electron_simulation.particles.clear()
+        electron_simulation.create_atom(Decimal('1.00782504') * electron_simulation.u, electron_simulation.e)
+        electron = electron_simulation.Particle(position=(Decimal('50e-12'), Decimal('0'), Decimal('0')),
+                                                mass=Decimal('5.4857991e-4') * electron_simulation.u,
+                                                charge=-electron_simulation.e)
+        data = electron_simulation.simulation(steps=5)
+        self.assertEqual(len(data[electron]['positions']), 5)
+        # the electron is pulled towards the proton; positions are in picometres
+        self.assertLess(data[electron]['positions'][-1][0], 50)
+        self.assertLess(electron.position[0], Decimal('50e-12'))
+        electron_simulation.particles.clear()
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestForceBackends(unittest.TestCase):
+    def test_barnes_hut(self):
+        system = random_system(500)
+        # without opening angle every pair is summed directly
+        error = forces.force_error(system, forces.BarnesHutBackend(theta=0))
+        self.assertLess(max(error), 1e-12)
+        error = forces.force_error(system, forces.BarnesHutBackend(theta=0.5))
+        self.assertLess(error.rms_force, 0.02)
+        # the energy of a neutral system is a sum of terms that mostly cancel
+        self.assertLess(error.energy, 0.05)
+        single = nbody.ParticleSystem([[0, 0, 0]], [[0, 0, 0]], [1], [1])
+        self.assertEqual(forces.BarnesHutBackend().forces(single).tolist(), [[0, 0, 0]])
+
+    def test_empty_system(self):
+        empty = nbody.ParticleSystem(numpy.zeros((0, 3)), numpy.zeros((0, 3)), [], [])
+        for backend in (forces.PairwiseBackend(), forces.BarnesHutBackend(), forces.CellListBackend(cutoff=1)):
+            self.assertEqual(backend.forces(empty).shape, (0, 3))
+            self.assertEqual(backend.potential_energy(empty), 0.0)
+
+    def test_cell_list(self):
+        system = random_system(300)
+        # a cutoff beyond the size of the system keeps every pair
+        self.assertLess(max(forces.force_error(system, forces.CellListBackend(cutoff=2000))), 1e-12)
+        backend = forces.CellListBackend(cutoff=100, skin=20)
+        rows, columns = numpy.triu_indices(len(system), k=1)
+        distances = numpy.linalg.norm(system.positions[rows] - system.positions[columns], axis=1)
+        couplings = (nbody.G_REDUCED * system.masses[rows] * system.masses[columns]
+                     - system.charges[rows] * system.charges[columns])
+        expected = -(couplings / distances)[distances < 100].sum()
+        self.assertAlmostEqual(backend.potential_energy(system), expected)
+        # the neighbor list is only rebuilt once a particle moved more than half the skin
+        system.positions[0] += 5
+        backend.forces(system)
+        self.assertEqual(backend.rebuilds, 1)
+        system.positions[0] += 10
+        backend.forces(system)
+        self.assertEqual(backend.rebuilds, 2)
+
+    def test_simulate_with_backend(self):
+        system = random_system(100)
+        exact = nbody.simulate(system.copy(), 5, 0.01)
+        approximate = nbody.simulate(system.copy(), 5, 0.01, backend='barnes_hut')
+        self.assertTrue(numpy.allclose(exact, approximate, atol=1e-3))
+        with self.assertRaises(ValueError):
+            nbody.simulate(system, 1, 0.01, backend='particle_mesh')
+
+    def test_target_forces(self):
+        system = random_system(200)
+        targets = numpy.array([150, 3, 77, 3])
+        for backend in (forces.PairwiseBackend(), forces.BarnesHutBackend(theta=0.5, block_size=16),
+                        forces.CellListBackend(cutoff=100)):
+            expected = backend.forces(system)[targets]
+            self.assertTrue(numpy.allclose(backend.forces(system, targets=targets), expected, rtol=1e-12, atol=0))
+            out = numpy.empty((len(targets), 3))
+            self.assertIs(backend.forces(system, out=out, targets=targets), out)
+            self.assertTrue(numpy.allclose(out, expected, rtol=1e-12, atol=0))
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestIntegrators(unittest.TestCase):
+    def test_fixed_steps(self):
+        system, period = hydrogen_orbit()
+        drifts = dict()
+        for name in ('euler', 'velocity_verlet', 'leapfrog', 'rk4'):
+            diagnostics = list()
+            orbit = system.copy()
+            nbody.simulate(orbit, 400, period / 200, integrator=name, diagnostics=diagnostics.append, record=False)
+            self.assertEqual(len(diagnostics), 400)
+            self.assertAlmostEqual(diagnostics[-1].time, 2 * period)
+            # the pair forces cancel, so every integrator keeps the momentum
+            self.assertLess(max(abs(d.momentum_drift) for d in diagnostics), 1e-12)
+            drifts[name] = max(abs(d.energy_drift) for d in diagnostics)
+            # after two periods the electron is back where it started
+            self.assertLess(numpy.linalg.norm(orbit.positions[1] - system.positions[1]), 5.0 if name == 'euler'
+                            else 0.5)
+        self.assertLess(drifts['velocity_verlet'], 1e-3)
+        self.assertLess(drifts['leapfrog'], 1e-3)
+        self.assertLess(drifts['rk4'], 1e-6)
+        self.assertLess(drifts['velocity_verlet'], drifts['euler'] / 10)
+        with self.assertRaises(ValueError):
+            integrators.get_integrator('midpoint')
+
+    def test_euler_is_the_default(self):
+        system = random_system(20)
+        default = nbody.simulate(system.copy(), 5, 0.01)
+        euler = nbody.simulate(system.copy(), 5, 0.01, integrator=integrators.EulerIntegrator())
+        self.assertTrue((default == euler).all())
+
+    def test_adaptive_steps(self):
+        # an eccentric orbit: the electron falls towards the proton and back
+        system, period = hydrogen_orbit(speed=0.6)
+        adaptive = integrators.AdaptiveVerlet(eta=0.05, length=50.0)
+        diagnostics = list()
+        nbody.simulate(system.copy(), 1000, period / 20, integrator=adaptive, diagnostics=diagnostics.append,
+                       record=False)
+        steps = [d.delta_t for d in diagnostics]
+        self.assertGreater(diagnostics[-1].time, period)
+        self.assertLess(min(steps), max(steps) / 3)
+        adaptive_drift = max(abs(d.energy_drift) for d in diagnostics)
+        # as many steps of the average length drift more
+        diagnostics = list()
+        nbody.simulate(system.copy(), 1000, sum(steps) / 1000, integrator='velocity_verlet',
+                       diagnostics=diagnostics.append, record=False)
+        self.assertLess(2 * adaptive_drift, max(abs(d.energy_drift) for d in diagnostics))
+
+    def test_block_time_steps(self):
+        # two atoms with eccentric orbits and one particle far away that hardly feels anything
+        first, period = hydrogen_orbit(speed=0.4)
+        second, _ = hydrogen_orbit(speed=0.8)
+        second.positions += [300, 0, 0]
+        system = nbody.ParticleSystem(numpy.concatenate([first.positions, second.positions, [[0, 5000, 0]]]),
+                                      numpy.concatenate([first.velocities, second.velocities, [[0, 0, 0]]]),
+                                      numpy.concatenate([first.masses, second.masses, [1.0]]),
+                                      numpy.concatenate([first.charges, second.charges, [0.0]]))
+        block = integrators.BlockTimeSteps(eta=0.2)
+        diagnostics = list()
+        nbody.simulate(system.copy(), 40, period / 20, integrator=block, diagnostics=diagnostics.append,
+                       record=False)
+        self.assertAlmostEqual(diagnostics[-1].time, 2 * period)
+        block_drift = max(abs(d.energy_drift) for d in diagnostics)
+        self.assertLess(block_drift, 0.05)
+        # the particle far from the others takes the longest blocks, the electrons shorter ones than the protons
+        self.assertEqual(block._levels[4], 0)
+        self.assertGreater(block._levels[1], block._levels[0])
+
+        # fixed steps with as many force evaluations drift much more
+        fixed = integrators.VelocityVerlet()
+        steps = block.force_evaluations // len(system)
+        diagnostics = list()
+        nbody.simulate(system.copy(), steps, 2 * period / steps, integrator=fixed, diagnostics=diagnostics.append,
+                       record=False)
+        self.assertLessEqual(fixed.force_evaluations, block.force_evaluations + len(system))
+        self.assertGreater(max(abs(d.energy_drift) for d in diagnostics), 5 * block_drift)
+
+    def test_electron_simulation_diagnostics(self):
+        electron_simulation.particles.clear()
+        electron_simulation.create_atom(Decimal('1.00782504') * electron_simulation.u, electron_simulation.e)
+        electron_simulation.Particle(position=(Decimal('50e-12'), Decimal('0'), Decimal('0')),
+                                     mass=Decimal('5.4857991e-4') * electron_simulation.u,
+                                     charge=-electron_simulation.e)
+        diagnostics = list()
+        electron_simulation.simulation(steps=20, diagnostics=diagnostics.append)
+        self.assertEqual([d.step for d in diagnostics], list(range(20)))
+        self.assertLess(max(abs(d.energy_drift) for d in diagnostics), 1e-3)
+        electron_simulation.particles.clear()
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestTrajectory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'run.npy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        system = random_system(30)
+        recorded = nbody.simulate(system.copy(), 12, 0.01)
+        with trajectory.TrajectoryWriter.for_steps(self.path, len(system), 12, interval=3, velocities=True) as writer:
+            nbody.simulate(system, 12, 0.01, record=False, writer=writer)
+        self.assertEqual(len(writer), 4)
+        frames = trajectory.Trajectory(self.path)
+        self.assertEqual(len(frames), 4)
+        self.assertEqual(frames.particle_count, 30)
+        self.assertEqual(frames.steps.tolist(), [2, 5, 8, 11])
+        self.assertTrue(numpy.allclose(frames.times, [0.03, 0.06, 0.09, 0.12]))
+        self.assertTrue((frames.positions == recorded[2::3]).all())
+        self.assertTrue((frames[-1].positions == system.positions).all())
+        self.assertTrue((frames[-1].velocities == system.velocities).all())
+        self.assertTrue((frames.particle_positions(7, every=2) == recorded[2::6, 7]).all())
+        self.assertEqual([frame.step for frame in frames], [2, 5, 8, 11])
+        with self.assertRaises(IndexError):
+            frames[4]
+
+    def test_partial_trajectory(self):
+        system = random_system(10)
+        writer = trajectory.TrajectoryWriter(self.path, len(system), 5)
+        nbody.simulate(system, 2, 0.01, record=False, writer=writer)
+        writer.flush()
+        # the frames that are written can be read while the simulation runs
+        frames = trajectory.Trajectory(self.path)
+        self.assertEqual(len(frames), 2)
+        self.assertIsNone(frames.velocities)
+        nbody.simulate(system, 3, 0.01, record=False, writer=writer)
+        with self.assertRaises(ValueError):
+            writer.write(5, 0.06, system)
+        writer.close()
+        self.assertEqual(len(trajectory.Trajectory(self.path)), 5)
+
+    def test_electron_simulation_file(self):
+        electron_simulation.particles.clear()
+        electron_simulation.create_atom(Decimal('1.00782504') * electron_simulation.u, electron_simulation.e)
+        electron = electron_simulation.Particle(position=(Decimal('50e-12'), Decimal('0'), Decimal('0')),
+                                                mass=Decimal('5.4857991e-4') * electron_simulation.u,
+                                                charge=-electron_simulation.e)
+        frames, particle_list = electron_simulation.simulation(steps=10, path=self.path, interval=5)
+        self.assertEqual(len(frames), 2)
+        index = particle_list.index(electron)
+        self.assertLess(frames[-1].positions[index, 0], 50)
+        self.assertAlmostEqual(float(electron.position[0]) / nbody.UNIT_LENGTH, frames[-1].positions[index, 0])
+        electron_simulation.particles.clear()
+
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_simulation(self, name, steps, integrator, backend, checkpoints=None):
+        """
+        Runs 'steps' steps of a fixed system from the start, or from the latest of 'checkpoints', and returns
+        the system, the diagnostics and a random number drawn after the run.
+        """
+        system = random_system(40, seed=3)
+        path = os.path.join(self.directory.name, name + '.npy')
+        if checkpoints is not None and checkpoints.latest() is not None:
+            writer = trajectory.TrajectoryWriter.reopen(path, interval=2)
+        else:
+            writer = trajectory.TrajectoryWriter.for_steps(path, len(system), 30, interval=2, velocities=True)
+        diagnostics = list()
+        nbody.simulate(system, steps, 0.05, record=False, backend=backend, integrator=integrator,
+                       diagnostics=diagnostics.append, writer=writer, checkpoints=checkpoints)
+        writer.close()
+        return system, diagnostics, random.random()
+
+    def test_resume(self):
+        for integrator in ('velocity_verlet', 'rk4', 'block'):
+            random.seed(1)
+            system, diagnostics, number = self.run_simulation('run', 30, integrator,
+                                                              forces.CellListBackend(cutoff=300))
+            checkpoints = checkpoint.Checkpoints(os.path.join(self.directory.name, integrator), 5)
+            random.seed(1)
+            # interrupted after 17 steps, two steps after the last checkpoint
+            self.run_simulation('interrupted', 17, integrator, forces.CellListBackend(cutoff=300), checkpoints)
+            self.assertEqual(checkpoints.steps(), [5, 10, 15])
+            random.seed(2)
+            resumed, resumed_diagnostics, resumed_number = self.run_simulation(
+                'interrupted', 30, integrator, forces.CellListBackend(cutoff=300), checkpoints)
+            # to the bit
+            self.assertTrue((resumed.positions == system.positions).all())
+            self.assertTrue((resumed.velocities == system.velocities).all())
+            self.assertEqual(resumed_diagnostics, diagnostics[15:])
+            self.assertEqual(resumed_number, number)
+            frames = trajectory.Trajectory(os.path.join(self.directory.name, 'run.npy'))
+            resumed_frames = trajectory.Trajectory(os.path.join(self.directory.name, 'interrupted.npy'))
+            self.assertEqual(len(resumed_frames), 15)
+            self.assertTrue((resumed_frames.positions == frames.positions).all())
+            self.assertTrue((resumed_frames.times == frames.times).all())
+
+    def test_missing_trajectory(self):
+        electron_simulation.particles.clear()
+        electron_simulation.create_atom(Decimal('1.00782504') * electron_simulation.u, electron_simulation.e)
+        electron_simulation.Particle(position=(Decimal('50e-12'), Decimal('0'), Decimal('0')),
+                                     mass=Decimal('5.4857991e-4') * electron_simulation.u,
+                                     charge=-electron_simulation.e)
+        path = os.path.join(self.directory.name, 'run.npy')
+        checkpoints = checkpoint.Checkpoints(os.path.join(self.directory.name, 'checkpoints'), 5)
+        electron_simulation.simulation(steps=10, path=path, checkpoints=checkpoints)
+        os.remove(path)
+        # the checkpoint refers to 10 frames that a new file does not have
+        with self.assertRaises(ValueError):
+            electron_simulation.simulation(steps=20, path=path, checkpoints=checkpoints)
+        electron_simulation.particles.clear()
+
+    def test_resume_with_diagnostics(self):
+        checkpoints = checkpoint.Checkpoints(self.directory.name, 2)
+        system = random_system(10)
+        nbody.simulate(system, 4, 0.01, record=False, checkpoints=checkpoints)
+        # the first run had no diagnostics: the drifts are measured from the restored state
+        diagnostics = list()
+        nbody.simulate(system, 8, 0.01, record=False, checkpoints=checkpoints, diagnostics=diagnostics.append)
+        self.assertEqual([diagnostic.step for diagnostic in diagnostics], [4, 5, 6, 7])
+        self.assertLess(abs(diagnostics[0].energy_drift), 1e-3)
+
+    def test_resume_longer_trajectory(self):
+        electron_simulation.particles.clear()
+        electron_simulation.create_atom(Decimal('1.00782504') * electron_simulation.u, electron_simulation.e)
+        electron_simulation.Particle(position=(Decimal('50e-12'), Decimal('0'), Decimal('0')),
+                                     mass=Decimal('5.4857991e-4') * electron_simulation.u,
+                                     charge=-electron_simulation.e)
+        path = os.path.join(self.directory.name, 'run.npy')
+        checkpoints = checkpoint.Checkpoints(os.path.join(self.directory.name, 'checkpoints'), 5)
+        first_frames, _ = electron_simulation.simulation(steps=10, path=path, checkpoints=checkpoints)
+        first_positions = first_frames.positions.copy()
+        del first_frames
+        # the file of 10 frames is grown to 20
+        frames, _ = electron_simulation.simulation(steps=20, path=path, checkpoints=checkpoints)
+        self.assertEqual(len(frames), 20)
+        self.assertEqual(frames.steps.tolist(), list(range(20)))
+        self.assertTrue((frames.positions[:10] == first_positions).all())
+        electron_simulation.particles.clear()
+
+    def test_mismatch(self):
+        checkpoints = checkpoint.Checkpoints(self.directory.name, 2)
+        system = random_system(10)
+        nbody.simulate(system, 2, 0.01, record=False, checkpoints=checkpoints)
+        with self.assertRaises(ValueError):
+            nbody.simulate(random_system(10), 4, 0.01, integrator='leapfrog', checkpoints=checkpoints)
+        with self.assertRaises(ValueError):
+            nbody.simulate(random_system(12), 4, 0.01, checkpoints=checkpoints)
+        # a run that is done does not step any more
+        self.assertEqual(nbody.simulate(system, 2, 0.01, checkpoints=checkpoints).shape, (0, 10, 3))
+
+    def test_retention(self):
+        checkpoints = checkpoint.Checkpoints(self.directory.name, 1, keep=2, keep_every=4)
+        nbody.simulate(random_system(10), 10, 0.01, record=False, checkpoints=checkpoints)
+        self.assertEqual(checkpoints.steps(), [4, 8, 9, 10])
+        self.assertEqual(checkpoints.latest(), checkpoints.path(10))
+
+    def test_atomic_replacement(self):
+        checkpoints = checkpoint.Checkpoints(self.directory.name, 1)
+        system = random_system(10)
+        integrator, backend = integrators.VelocityVerlet(), forces.PairwiseBackend()
+        checkpoints.save(1, 0.01, system, integrator, backend)
+        saved = open(checkpoints.path(1), 'rb').read()
+        system.positions += 1
+        # an interruption while writing leaves the last complete checkpoint as it was
+        with mock.patch('numpy.savez', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                checkpoints.save(1, 0.01, system, integrator, backend)
+        self.assertEqual(os.listdir(self.directory.name), ['checkpoint-000000000001.npz'])
+        self.assertEqual(open(checkpoints.path(1), 'rb').read(), saved)
+        checkpoints.save(1, 0.01, system, integrator, backend)
+        restored = random_system(10)
+        self.assertEqual(checkpoints.restore(restored, integrator, backend).step, 1)
+        self.assertTrue((restored.positions == system.positions).all())
+
+
+if __name__ == '__main__':
+    unittest.main()